@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+admission.py
+------------
+Controllo di ammissione per /api/ask: token bucket per client e globali,
+code separate per percorsi economici (COMM/KB/regole) e costosi (LLM).
+
+- ogni richiesta: bucket del client ("all") + bucket globale ("all")
+- solo prima del percorso LLM: bucket LLM del client + bucket LLM globale
+  (il globale è addebitato dal leader single-flight: misura le chiamate a monte)
+- corsie (Lane): concorrenza massima + coda limitata; coda piena o attesa
+  oltre il timeout → 429 con Retry-After
+- la corsia "cheap" è indipendente da quella "llm": con l'LLM saturo le risposte
+  da KB/COMM restano immediate
+- corsie per thread (ThreadLane) per i percorsi LLM sincroni (rerank di applastversion)
+
+Client = IP aggiunto a X-Forwarded-For dal proxy fidato (ADM_TRUSTED_PROXIES hop
+contati da destra: le voci a sinistra le scrive il client e non valgono) oppure IP
+della connessione.
+
+Env (rate = richieste/secondo, burst = capienza bucket):
+    ADMISSION_ENABLE (1)
+    ADM_CLIENT_RATE (5)      ADM_CLIENT_BURST (20)
+    ADM_CLIENT_LLM_RATE (0.5) ADM_CLIENT_LLM_BURST (5)
+    ADM_GLOBAL_RATE (200)    ADM_GLOBAL_BURST (400)
+    ADM_GLOBAL_LLM_RATE (20) ADM_GLOBAL_LLM_BURST (40)
+    ADM_LLM_CONCURRENCY (16) ADM_LLM_QUEUE (64)    ADM_LLM_QUEUE_TIMEOUT_S (20)
+    ADM_CHEAP_CONCURRENCY (64) ADM_CHEAP_QUEUE (256) ADM_CHEAP_QUEUE_TIMEOUT_S (2)
+    ADM_RERANK_CONCURRENCY (8) ADM_RERANK_QUEUE (32) ADM_RERANK_QUEUE_TIMEOUT_S (5)
+    ADM_MAX_CLIENTS (10000)
+    ADM_TRUSTED_PROXIES (1)  proxy davanti all'app (0 = ignora X-Forwarded-For)
+"""
+
+from __future__ import annotations
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+
+def _f(name: str, default: str) -> float:
+    return float(os.getenv(name, default))
+
+
+ADMISSION_ENABLE = os.getenv("ADMISSION_ENABLE", "1") == "1"
+MAX_CLIENTS = int(os.getenv("ADM_MAX_CLIENTS", "10000"))
+TRUSTED_PROXIES = int(os.getenv("ADM_TRUSTED_PROXIES", "1"))
+
+
+class AdmissionRejected(Exception):
+    """Richiesta non ammessa: rispondere 429 con Retry-After."""
+
+    def __init__(self, reason: str, retry_after_s: float) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+    @property
+    def retry_after(self) -> str:
+        return str(max(1, math.ceil(self.retry_after_s)))
+
+
+class TokenBucket:
+    """Bucket classico: `rate` token/s fino a `burst`. Non thread-safe (protetto da Admission)."""
+
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def take(self, n: float = 1.0) -> float:
+        """0 se ammesso, altrimenti secondi di attesa prima che ci siano n token."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= n:
+            self.tokens -= n
+            return 0.0
+        return (n - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class Lane:
+    """Corsia async: al massimo `concurrency` in esecuzione, `max_queue` in attesa."""
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, queue_timeout_s: float) -> None:
+        self.name = name
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self._sem = asyncio.Semaphore(max(1, concurrency))
+        self.waiting = 0
+        self.running = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self._sem.locked():
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected(f"coda {self.name} piena", self.queue_timeout_s / 2 or 1.0)
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._sem.acquire(), self.queue_timeout_s)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise AdmissionRejected(f"attesa in coda {self.name} oltre {self.queue_timeout_s}s",
+                                        self.queue_timeout_s / 2 or 1.0) from None
+            finally:
+                self.waiting -= 1
+        else:
+            await self._sem.acquire()
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._sem.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {"running": self.running, "waiting": self.waiting, "rejected": self.rejected}
+
+
+class ThreadLane:
+    """Come Lane, per codice sincrono (threadpool): semaforo + coda limitata + timeout."""
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, queue_timeout_s: float) -> None:
+        self.name = name
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self._sem = threading.BoundedSemaphore(max(1, concurrency))
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+        self.rejected = 0
+
+    def _rejected(self, reason: str) -> AdmissionRejected:
+        with self._lock:
+            self.rejected += 1
+        return AdmissionRejected(reason, self.queue_timeout_s / 2 or 1.0)
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        if not self._sem.acquire(blocking=False):
+            with self._lock:
+                full = self.waiting >= self.max_queue
+                if not full:
+                    self.waiting += 1
+            if full:
+                raise self._rejected(f"coda {self.name} piena")
+            try:
+                ok = self._sem.acquire(timeout=self.queue_timeout_s)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            if not ok:
+                raise self._rejected(f"attesa in coda {self.name} oltre {self.queue_timeout_s}s")
+        with self._lock:
+            self.running += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.running -= 1
+            self._sem.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {"running": self.running, "waiting": self.waiting, "rejected": self.rejected}
+
+
+class Admission:
+    def __init__(self) -> None:
+        self.client_rate = (_f("ADM_CLIENT_RATE", "5"), _f("ADM_CLIENT_BURST", "20"))
+        self.client_llm_rate = (_f("ADM_CLIENT_LLM_RATE", "0.5"), _f("ADM_CLIENT_LLM_BURST", "5"))
+        self.global_all = TokenBucket(_f("ADM_GLOBAL_RATE", "200"), _f("ADM_GLOBAL_BURST", "400"))
+        self.global_llm = TokenBucket(_f("ADM_GLOBAL_LLM_RATE", "20"), _f("ADM_GLOBAL_LLM_BURST", "40"))
+        self.lanes = {
+            "cheap": Lane("cheap", int(_f("ADM_CHEAP_CONCURRENCY", "64")), int(_f("ADM_CHEAP_QUEUE", "256")),
+                          _f("ADM_CHEAP_QUEUE_TIMEOUT_S", "2")),
+            "llm": Lane("llm", int(_f("ADM_LLM_CONCURRENCY", "16")), int(_f("ADM_LLM_QUEUE", "64")),
+                        _f("ADM_LLM_QUEUE_TIMEOUT_S", "20")),
+        }
+        self.thread_lanes = {
+            "rerank": ThreadLane("rerank", int(_f("ADM_RERANK_CONCURRENCY", "8")), int(_f("ADM_RERANK_QUEUE", "32")),
+                                 _f("ADM_RERANK_QUEUE_TIMEOUT_S", "5")),
+        }
+        # client → (bucket "all", bucket "llm"), LRU limitato
+        self._clients: "OrderedDict[str, Tuple[TokenBucket, TokenBucket]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected: Dict[str, int] = {}
+
+    def _buckets(self, client: str) -> Tuple[TokenBucket, TokenBucket]:
+        b = self._clients.get(client)
+        if b is None:
+            b = (TokenBucket(*self.client_rate), TokenBucket(*self.client_llm_rate))
+            self._clients[client] = b
+            if len(self._clients) > MAX_CLIENTS:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(client)
+        return b
+
+    def _reject(self, reason: str, wait: float) -> None:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        raise AdmissionRejected(reason, wait)
+
+    def admit(self, client: str) -> None:
+        """Ogni richiesta (qualsiasi percorso). Solleva AdmissionRejected."""
+        if not ADMISSION_ENABLE:
+            return
+        with self._lock:
+            wait = self._buckets(client)[0].take()
+            if wait:
+                self._reject("client", wait)
+            wait = self.global_all.take()
+            if wait:
+                self._reject("global", wait)
+
+    def admit_llm(self, client: str) -> None:
+        """Prima del percorso LLM: budget LLM del client."""
+        if not ADMISSION_ENABLE:
+            return
+        with self._lock:
+            wait = self._buckets(client)[1].take()
+            if wait:
+                self._reject("client_llm", wait)
+
+    def charge_upstream(self) -> None:
+        """Una chiamata LLM reale a monte (leader single-flight): budget globale."""
+        if not ADMISSION_ENABLE:
+            return
+        with self._lock:
+            wait = self.global_llm.take()
+            if wait:
+                self._reject("global_llm", wait)
+
+    @asynccontextmanager
+    async def lane(self, name: str) -> AsyncIterator[None]:
+        if not ADMISSION_ENABLE:
+            yield
+            return
+        async with self.lanes[name].slot():
+            yield
+
+    @contextmanager
+    def thread_lane(self, name: str) -> Iterator[None]:
+        if not ADMISSION_ENABLE:
+            yield
+            return
+        with self.thread_lanes[name].slot():
+            yield
+
+    def stats(self) -> Dict[str, Any]:
+        lanes = {k: v.stats() for k, v in self.lanes.items()}
+        lanes.update({k: v.stats() for k, v in self.thread_lanes.items()})
+        return {"enabled": ADMISSION_ENABLE, "clients": len(self._clients), "rejected": dict(self.rejected),
+                "lanes": lanes}
+
+
+def client_id(request: Any) -> str:
+    """
+    IP del client. In X-Forwarded-For ogni proxy aggiunge a destra l'indirizzo da cui
+    riceve: vale solo la voce scritta dal proxy fidato più esterno (TRUSTED_PROXIES
+    da destra), il resto è testo arbitrario del client.
+    """
+    fwd = request.headers.get("x-forwarded-for") if request is not None and TRUSTED_PROXIES > 0 else None
+    if fwd:
+        hops = [h.strip() for h in fwd.split(",") if h.strip()]
+        if hops:
+            return hops[max(0, len(hops) - TRUSTED_PROXIES)]
+    client = getattr(request, "client", None)
+    return getattr(client, "host", None) or "unknown"
+
+
+_ADMISSION: Optional[Admission] = None
+
+
+def get_admission() -> Admission:
+    global _ADMISSION
+    if _ADMISSION is None:
+        _ADMISSION = Admission()
+    return _ADMISSION
@@ -1,15 +1,35 @@
 import os
 import json
 import re
-from typing import List, Dict, Any, Optional
-
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-
-from openai import OpenAI
+import hashlib
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple
+
+import startup  # per primo: misura import e caricamenti (report su /ready)
+
+with startup.step("fastapi", "import"):
+    from fastapi import FastAPI, HTTPException
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import FileResponse
+    from fastapi.staticfiles import StaticFiles
+    from pydantic import BaseModel
+    from fastapi import Request
+    from starlette.concurrency import run_in_threadpool
+
+with startup.step("llm_gateway", "import"):
+    import llm_gateway
+with startup.step("guardrails_engine", "import"):
+    from guardrails_engine import get_engine as get_rules_engine
+with startup.step("admission", "import"):
+    from admission import AdmissionRejected, client_id, get_admission
+with startup.step("singleflight", "import"):
+    from singleflight import AsyncSingleFlight, LeaderCancelled, SingleFlightFull
+with startup.step("static_assets", "import"):
+    from static_assets import PrecompressedStatic, ensure_built
+with startup.step("event_log", "import"):
+    from event_log import Timer, diag, emit, get_event_log, loop_lag_stats, start_loop_lag
+with startup.step("json_fragments", "import"):
+    from json_fragments import FastJSONResponse, RawJSONResponse, assemble, cached_fragment, fragment
 
 # ============================================================
 # CONFIG BASE
@@ -21,19 +41,18 @@ DATA_DIR = os.path.join(STATIC_DIR, "data")
 
 MASTER_PATH = os.path.join(DATA_DIR, "ctf_system_COMPLETE_GOLD_master.json")
 COMM_PATH = os.path.join(DATA_DIR, "COMM.json")
+PREGEN_PATH = os.path.join(DATA_DIR, "gold_pregen.json")
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
 OPENAI_MODEL_ENV = (os.getenv("OPENAI_MODEL", "gpt-4o") or "gpt-4o").strip()
-
-client: Optional[OpenAI] = None
-if OPENAI_API_KEY:
-    client = OpenAI(api_key=OPENAI_API_KEY)
+RULES_ENGINE_ENABLE = os.getenv("RULES_ENGINE_ENABLE", "1") == "1"
+SINGLEFLIGHT_TIMEOUT_S = float(os.getenv("SINGLEFLIGHT_TIMEOUT_S", "90"))
 
 # ============================================================
 # FASTAPI APP
 # ============================================================
 
-app = FastAPI(title="Tecnaria Sinapsi – GOLD")
+app = FastAPI(title="Tecnaria Sinapsi – GOLD", default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -46,6 +65,9 @@ app.add_middleware(
 if not os.path.isdir(STATIC_DIR):
     os.makedirs(STATIC_DIR, exist_ok=True)
 
+# asset buildati (hash + .gz/.br, cache immutable): montati PRIMA di /static
+DIST_STATIC = PrecompressedStatic()
+app.mount("/static/dist", DIST_STATIC, name="static_dist")
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 # ============================================================
@@ -76,18 +98,25 @@ def normalize(text: str) -> str:
 # ============================================================
 
 KB_BLOCKS: List[Dict[str, Any]] = []
+# parole normalizzate (triggers + question_it) per blocco, calcolate una volta al load
+KB_WORDS: List[frozenset] = []
+# generazione KB = hash del file master: invalida le risposte pre-generate (gold_pregen.py)
+KB_GENERATION: str = ""
 
 
 def load_kb() -> None:
-    global KB_BLOCKS
+    global KB_BLOCKS, KB_WORDS, KB_GENERATION
     if not os.path.exists(MASTER_PATH):
-        print(f"[WARN] MASTER_PATH non trovato: {MASTER_PATH}")
+        diag("KB", f"MASTER_PATH non trovato: {MASTER_PATH}", "warn")
         KB_BLOCKS = []
+        KB_WORDS = []
         return
 
     try:
-        with open(MASTER_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(MASTER_PATH, "rb") as f:
+            raw = f.read()
+        KB_GENERATION = hashlib.sha256(raw).hexdigest()[:12]
+        data = json.loads(raw)
 
         if isinstance(data, dict) and "blocks" in data:
             KB_BLOCKS = data["blocks"]
@@ -96,21 +125,26 @@ def load_kb() -> None:
         else:
             KB_BLOCKS = []
 
-        print(f"[INFO] KB caricata: {len(KB_BLOCKS)} blocchi")
+        KB_WORDS = [block_words(b) for b in KB_BLOCKS]
+        diag("KB", f"caricata: {len(KB_BLOCKS)} blocchi")
     except Exception as e:
-        print(f"[ERROR] caricando KB: {e}")
+        diag("KB", f"caricando KB: {e}", "error")
         KB_BLOCKS = []
+        KB_WORDS = []
 
 
-def score_block(question_norm: str, block: Dict[str, Any]) -> float:
+def block_words(block: Dict[str, Any]) -> frozenset:
     triggers = " ".join(block.get("triggers", []))
     q_it = block.get("question_it", "")
-    text = normalize(triggers + " " + q_it)
-    if not text:
-        return 0.0
+    return frozenset(normalize(triggers + " " + q_it).split())
+
+
+def score_block(question_norm: str, block: Dict[str, Any],
+                b_words: Optional[frozenset] = None) -> float:
+    if b_words is None:
+        b_words = block_words(block)
 
     q_words = set(question_norm.split())
-    b_words = set(text.split())
     if not q_words or not b_words:
         return 0.0
 
@@ -121,36 +155,58 @@ def score_block(question_norm: str, block: Dict[str, Any]) -> float:
     return len(common) / max(len(q_words), 1)
 
 
-def match_from_kb(question: str, threshold: float = 0.18) -> Optional[Dict[str, Any]]:
+def match_from_kb_scored(question: str, threshold: float = 0.18) -> Tuple[Optional[Dict[str, Any]], float]:
+    """(blocco migliore o None sotto soglia, punteggio migliore)"""
     if not KB_BLOCKS:
-        return None
+        return None, 0.0
     qn = normalize(question)
     best_block: Optional[Dict[str, Any]] = None
     best_score = 0.0
-    for b in KB_BLOCKS:
-        s = score_block(qn, b)
+    for b, words in zip(KB_BLOCKS, KB_WORDS):
+        s = score_block(qn, b, words)
         if s > best_score:
             best_score = s
             best_block = b
     if best_score < threshold:
-        return None
-    return best_block
+        return None, best_score
+    return best_block, best_score
 
 
-load_kb()
+def match_from_kb(question: str, threshold: float = 0.18) -> Optional[Dict[str, Any]]:
+    return match_from_kb_scored(question, threshold)[0]
+
+
+with startup.step("kb master"):
+    load_kb()
 
 # ============================================================
 # CARICAMENTO COMM (dati aziendali/commerciali)
 # ============================================================
 
 COMM_ITEMS: List[Dict[str, Any]] = []
+# corpo JSON completo della risposta COMM, codificato una volta al load (id COMM → bytes)
+COMM_BODIES: Dict[str, bytes] = {}
+
+COMM_FALLBACK_ANSWER = (
+    "Le informazioni richieste rientrano nei dati aziendali/commerciali. "
+    "Per sicurezza è necessario fare riferimento ai canali ufficiali Tecnaria."
+)
+COMM_FALLBACK_BODY = assemble(answer=COMM_FALLBACK_ANSWER, source="json_comm_fallback", meta={})
+
+
+def comm_answer(item: Dict[str, Any]) -> str:
+    answer = item.get("response_variants", {}).get("gold", {}).get("it")
+    if not answer:
+        answer = item.get("answer_it") or item.get("answer", "")
+    return answer
 
 
 def load_comm() -> None:
-    global COMM_ITEMS
+    global COMM_ITEMS, COMM_BODIES
     if not os.path.exists(COMM_PATH):
-        print(f"[WARN] COMM_PATH non trovato: {COMM_PATH}")
+        diag("COMM", f"COMM_PATH non trovato: {COMM_PATH}", "warn")
         COMM_ITEMS = []
+        COMM_BODIES = {}
         return
 
     try:
@@ -164,10 +220,16 @@ def load_comm() -> None:
         else:
             COMM_ITEMS = []
 
-        print(f"[INFO] COMM caricata: {len(COMM_ITEMS)} blocchi COMM")
+        COMM_BODIES = {
+            str(item["id"]): assemble(answer=fragment(comm_answer(item)), source="json_comm",
+                                      meta={"comm_id": item["id"]})
+            for item in COMM_ITEMS if item.get("id")
+        }
+        diag("COMM", f"caricata: {len(COMM_ITEMS)} blocchi COMM")
     except Exception as e:
-        print(f"[ERROR] caricando COMM: {e}")
+        diag("COMM", f"caricando COMM: {e}", "error")
         COMM_ITEMS = []
+        COMM_BODIES = {}
 
 
 def is_commercial_question(q: str) -> bool:
@@ -208,7 +270,38 @@ def match_comm(question: str) -> Optional[Dict[str, Any]]:
     return best if best_score >= 1 else None
 
 
-load_comm()
+with startup.step("comm"):
+    load_comm()
+
+# ============================================================
+# INTENT ROUTER (GET /api/ask di tecnaria_api: trie di frasi-trigger)
+# ============================================================
+
+# costruito in warm-up (o al primo uso): JSON_BAG è riempito sul posto
+JSON_BAG: Dict[str, Any] = {}
+FAQ_ROWS: int = 0
+
+
+def _intent_router():
+    global FAQ_ROWS
+    from intent_router import get_router  # import pesante (scraper_tecnaria/numpy): lazy
+    router = get_router()
+    if not JSON_BAG:
+        JSON_BAG.update(router.bag)
+        FAQ_ROWS = len(router.intents)
+    return router
+
+
+def intent_route(q: str) -> Dict[str, Any]:
+    """
+    Instradamento deterministico (nessuna chiamata esterna): match_id, family, intent,
+    score, text e html pre-renderizzato. Nessun match → match_id None, score 0.
+    """
+    hit = _intent_router().route(q)
+    if hit is None:
+        return {"match_id": None, "family": None, "intent": None, "score": 0.0,
+                "text": "", "html": "", "lang": "it", "source": "intent_none"}
+    return hit
 
 # ============================================================
 # LLM: PROMPT TECNARIA GOLD
@@ -274,48 +367,172 @@ Questo è un sistema GOLD: precisione massima, nessuna invenzione,
 risposte chiare, determinate e ingegneristiche.
 """
 
+GOLD_MODEL = "gpt-5.1"
+GOLD_TEMPERATURE = 0.2
+# versione prompt: cambia con testo, modello o temperatura → risposte pre-generate obsolete
+GOLD_PROMPT_VERSION = hashlib.sha256(
+    f"{GOLD_MODEL}|{GOLD_TEMPERATURE}|{SYSTEM_PROMPT_GOLD}".encode("utf-8")
+).hexdigest()[:12]
+
+
 def call_openai(prompt_system: str, question: str, temperature: float = 0.3) -> str:
     """
     Wrapper unico per chiamare OpenAI.
     Modello FORZATO a gpt-5.1 (ignora OPENAI_MODEL_ENV).
     """
-    if client is None:
-        return "Il motore esterno non è disponibile (OPENAI_API_KEY mancante)."
+    return call_openai_info(prompt_system, question, temperature)[0]
+
+
+def call_openai_info(prompt_system: str, question: str, temperature: float = 0.3) -> Tuple[str, Dict[str, Any]]:
+    """
+    Come call_openai, più i dati della chiamata per il log eventi:
+    → (risposta, {"ok", "cached", "attempts", "latency_ms", "status"})
+    """
+    if not llm_gateway.is_configured():
+        return ("Il motore esterno non è disponibile (OPENAI_API_KEY mancante).",
+                {"ok": False, "cached": False, "attempts": 0, "latency_ms": 0.0, "status": None})
+
+    res = llm_gateway.chat(
+        [
+            {"role": "system", "content": prompt_system},
+            {"role": "user", "content": question},
+        ],
+        model=GOLD_MODEL,
+        purpose="gold",
+        temperature=temperature,
+        top_p=1.0,
+    )
+    info = {"ok": res.ok, "cached": res.cached, "attempts": res.attempts,
+            "latency_ms": round(res.latency_ms, 1), "status": res.status}
+    if not res.ok:
+        diag("LLM", f"chiamando OpenAI: {res.error}", "error", status=res.status)
+        return "Si è verificato un errore nella chiamata al motore esterno.", info
+    return res.content, info
+
+# domande identiche in volo → una sola chiamata esterna (chiave: domanda normalizzata + percorso)
+GOLD_FLIGHT = AsyncSingleFlight()
+
+
+async def call_openai_coalesced(prompt_system: str, question: str, path: str,
+                                temperature: float = 0.3) -> tuple:
+    """
+    call_openai fuori dall'event loop (threadpool) e condivisa tra richieste concorrenti
+    con la stessa domanda normalizzata sullo stesso percorso. → ((risposta, info), condivisa)
+    Solo il leader occupa la corsia LLM e consuma il budget LLM globale.
+    """
+    adm = get_admission()
+
+    async def upstream() -> Tuple[str, Dict[str, Any]]:
+        async with adm.lane("llm"):
+            adm.charge_upstream()
+            return await run_in_threadpool(call_openai_info, prompt_system, question, temperature)
+
+    return await GOLD_FLIGHT.do(f"{path}:{normalize(question)}", upstream, timeout=SINGLEFLIGHT_TIMEOUT_S)
+
+# ============================================================
+# RISPOSTE GOLD PRE-GENERATE (job offline: python gold_pregen.py)
+# ============================================================
 
+# domanda normalizzata → {"q", "answer", "kb_id", "origin"}
+PREGEN_ANSWERS: Dict[str, Dict[str, Any]] = {}
+
+
+def load_pregen() -> None:
+    """
+    Carica static/data/gold_pregen.json solo se generato con il prompt e la KB correnti:
+    altrimenti la tabella è obsoleta e si risponde live finché il job non la rigenera.
+    """
+    global PREGEN_ANSWERS
+    PREGEN_ANSWERS = {}
+    if not os.path.exists(PREGEN_PATH):
+        return
     try:
-        completion = client.chat.completions.create(
-            model="gpt-5.1",
-            messages=[
-                {"role": "system", "content": prompt_system},
-                {"role": "user", "content": question},
-            ],
-            temperature=temperature,
-            top_p=1.0,
-        )
-        return (completion.choices[0].message.content or "").strip()
+        with open(PREGEN_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
     except Exception as e:
-        print(f"[ERROR] chiamando OpenAI: {e}")
-        return "Si è verificato un errore nella chiamata al motore esterno."
+        diag("PREGEN", f"lettura {PREGEN_PATH}: {e}", "error")
+        return
+    if data.get("prompt_version") != GOLD_PROMPT_VERSION or data.get("kb_generation") != KB_GENERATION:
+        diag("PREGEN", f"tabella obsoleta (prompt {data.get('prompt_version')}≠{GOLD_PROMPT_VERSION} "
+                       f"o KB {data.get('kb_generation')}≠{KB_GENERATION}): ignorata", "warn")
+        return
+    PREGEN_ANSWERS = data.get("answers") or {}
+    diag("PREGEN", f"caricate: {len(PREGEN_ANSWERS)} risposte GOLD pre-generate")
+
+
+with startup.step("gold pregen"):
+    load_pregen()
+
+# ============================================================
+# WARM-UP (pre-fork con gunicorn --preload, vedi gunicorn.conf.py)
+# ============================================================
+
+@startup.on_warmup("rules engine")
+def _warm_rules() -> None:
+    if RULES_ENGINE_ENABLE:
+        get_rules_engine().route("warm-up CTF lamiera")
+
+
+@startup.on_warmup("intent router")
+def _warm_intents() -> None:
+    intent_route("ctf serve preforo")
+
+
+@startup.on_warmup("static assets")
+def _warm_static() -> None:
+    ensure_built()
+    DIST_STATIC.reload()
+
+
+@startup.on_warmup("http client")
+def _warm_http() -> None:
+    llm_gateway.preload()
+
+
+@app.on_event("startup")
+async def _on_startup() -> None:
+    # con --preload il warm-up è già stato fatto nel master: qui è un no-op
+    startup.warmup_async()
+    start_loop_lag()
 
 # ============================================================
 # ENDPOINTS
 # ============================================================
 
 @app.get("/")
-async def root() -> FileResponse:
+async def root(request: Request):
     """
-    Serve l'interfaccia HTML (static/index.html).
+    Serve l'interfaccia HTML: static/dist/index.html (precompressa, ETag/304) se buildata,
+    altrimenti static/index.html.
     """
+    if DIST_STATIC.built:
+        return await DIST_STATIC.get_response("index.html", request.scope)
     index_path = os.path.join(STATIC_DIR, "index.html")
     if not os.path.exists(index_path):
         raise HTTPException(status_code=500, detail="index.html non trovato")
     return FileResponse(index_path)
 
 
+@app.get("/live")
+async def live():
+    """
+    Liveness: il processo risponde (indipendente dal warm-up).
+    """
+    return {"ok": True}
+
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness: 200 solo a warm-up completato; il corpo è il report di avvio (ms per passo).
+    """
+    return FastJSONResponse(startup.report(), status_code=200 if startup.is_ready() else 503)
+
+
 @app.get("/api/status")
-async def status():
+async def status(lag_window_s: float = 60.0):
     """
-    Riepilogo rapido dello stato backend.
+    Riepilogo rapido dello stato backend (lag dell'event loop sugli ultimi `lag_window_s` secondi).
     """
     return {
         "status": "Tecnaria Bot attivo (GOLD only)",
@@ -323,65 +540,154 @@ async def status():
         "comm_blocks": len(COMM_ITEMS),
         "openai_api_key_present": bool(OPENAI_API_KEY),
         "openai_model_env": OPENAI_MODEL_ENV,
-        "openai_model_effective": "gpt-5.1",
+        "openai_model_effective": GOLD_MODEL,
+        "gold_prompt_version": GOLD_PROMPT_VERSION,
+        "kb_generation": KB_GENERATION,
+        "pregen_answers": len(PREGEN_ANSWERS),
+        "rules_engine": RULES_ENGINE_ENABLE,
+        "singleflight": GOLD_FLIGHT.stats(),
+        "admission": get_admission().stats(),
+        "event_log": get_event_log().stats(),
+        "loop_lag": loop_lag_stats(lag_window_s),
     }
 
 
 @app.post("/api/ask", response_model=AnswerResponse)
-async def api_ask(req: QuestionRequest):
+async def api_ask(req: QuestionRequest, request: Request):
     """
     Modalità GOLD Tecnaria (tecnica, con prompt strutturale).
+    Ogni risposta registra un evento "ask" (percorso, blocco, punteggi, tempi per fase).
     """
     question_raw = (req.question or "").strip()
     if not question_raw:
         raise HTTPException(status_code=400, detail="Domanda vuota")
 
+    t = Timer()
+    ev: Dict[str, Any] = {"route": None, "status": 200, "q": question_raw[:300]}
+    adm = get_admission()
+    client = client_id(request)
+    try:
+        adm.admit(client)
+    except AdmissionRejected as e:
+        emit("ask", "warn", route="rejected", status=429, reason=e.reason, total_ms=t.total_ms())
+        raise HTTPException(status_code=429, detail=f"Troppe richieste ({e.reason})",
+                            headers={"Retry-After": e.retry_after})
+    t.lap("admit")
+
     q_norm = question_raw.lower()
+    level = "info"
 
     try:
-        # 1) DOMANDE AZIENDALI / COMMERCIALI → SOLO COMM.JSON
-        if is_commercial_question(q_norm):
-            comm_block = match_comm(q_norm)
-            if comm_block:
-                answer = comm_block.get("response_variants", {}).get("gold", {}).get("it")
-                if not answer:
-                    answer = comm_block.get("answer_it") or comm_block.get("answer", "")
-                return AnswerResponse(
-                    answer=answer,
-                    source="json_comm",
-                    meta={"comm_id": comm_block.get("id")},
-                )
-            else:
-                fallback = (
-                    "Le informazioni richieste rientrano nei dati aziendali/commerciali. "
-                    "Per sicurezza è necessario fare riferimento ai canali ufficiali Tecnaria."
-                )
-                return AnswerResponse(
-                    answer=fallback,
-                    source="json_comm_fallback",
-                    meta={},
-                )
-
-        # 2) DOMANDE TECNICHE → CHATGPT GOLD TECNARIA
-        gpt_answer = call_openai(SYSTEM_PROMPT_GOLD, question_raw, temperature=0.2)
-        kb_block = match_from_kb(question_raw)
-        kb_id = kb_block.get("id") if kb_block else None
+        # 1-2) percorsi economici: corsia propria, mai in coda dietro l'LLM
+        async with adm.lane("cheap"):
+            t.lap("queue_cheap")
+            # 1) DOMANDE AZIENDALI / COMMERCIALI → SOLO COMM.JSON
+            if is_commercial_question(q_norm):
+                # corpi pre-serializzati: nessuna validazione/encoding per richiesta
+                comm_block = match_comm(q_norm)
+                t.lap("comm")
+                if comm_block:
+                    ev.update(route="comm", block_id=comm_block.get("id"))
+                    body = COMM_BODIES.get(str(comm_block.get("id")))
+                    if body is not None:
+                        return RawJSONResponse(body)
+                    return AnswerResponse(
+                        answer=comm_answer(comm_block),
+                        source="json_comm",
+                        meta={"comm_id": comm_block.get("id")},
+                    )
+                else:
+                    ev["route"] = "comm_fallback"
+                    return RawJSONResponse(COMM_FALLBACK_BODY)
+
+            kb_block, kb_score = match_from_kb_scored(question_raw)
+            kb_id = kb_block.get("id") if kb_block else None
+            ev.update(kb_id=kb_id, kb_score=round(kb_score, 4))
+            t.lap("kb")
+
+            # 2) REGOLE CURATE (override) → risposta fissa, nessuna chiamata esterna
+            rules = get_rules_engine() if RULES_ENGINE_ENABLE else None
+            routed = rules.route(question_raw) if rules else None
+            t.lap("rules")
+            if routed and routed.override:
+                answer, guard_ids = rules.post_check(question_raw, routed.override.answer, routed.q_hits)
+                t.lap("post_check")
+                ev.update(route="rules_override", block_id=routed.override.id, guardrails=guard_ids)
+                return RawJSONResponse(assemble(
+                    answer=cached_fragment(answer) if answer is routed.override.answer else answer,
+                    source="rules_override",
+                    meta={
+                        "used_chatgpt": False,
+                        "kb_id": kb_id,
+                        "rule_id": routed.override.id,
+                        "guardrails": guard_ids,
+                    },
+                ))
+
+        # 3) DOMANDE TECNICHE → GOLD pre-generata (stesso prompt e KB) o CHATGPT GOLD live
+        #    (+ augment + post-check in entrambi i casi: le regole possono cambiare senza rigenerare)
+        pre = PREGEN_ANSWERS.get(normalize(question_raw))
+        if pre is not None:
+            gpt_answer = pre["answer"]
+            ev.update(route="pregen", block_id=pre.get("kb_id") or kb_id)
+            meta: Dict[str, Any] = {
+                "used_chatgpt": True,
+                "kb_id": kb_id,
+                "pregen": True,
+            }
+            t.lap("pregen")
+        else:
+            ev["route"] = "llm"
+            adm.admit_llm(client)
+            (gpt_answer, llm_info), coalesced = await call_openai_coalesced(
+                SYSTEM_PROMPT_GOLD, question_raw, "gold", temperature=GOLD_TEMPERATURE
+            )
+            t.lap("llm")
+            ev.update(block_id=kb_id, coalesced=coalesced, llm=llm_info)
+            if not llm_info["ok"]:
+                level = "error"
+            meta = {
+                "used_chatgpt": True,
+                "kb_id": kb_id,
+                "coalesced": coalesced,
+            }
+        if rules:
+            if routed.augment:
+                gpt_answer = gpt_answer.rstrip() + "\n\n" + "\n\n".join(r.answer for r in routed.augment)
+                meta["augment_ids"] = [r.id for r in routed.augment]
+            gpt_answer, meta["guardrails"] = rules.post_check(question_raw, gpt_answer, routed.q_hits)
+            ev.update(augment_ids=meta.get("augment_ids"), guardrails=meta["guardrails"])
+            t.lap("post_check")
 
         return AnswerResponse(
             answer=gpt_answer,
             source="chatgpt_gold_tecnaria",
-            meta={
-                "used_chatgpt": True,
-                "kb_id": kb_id,
-            },
+            meta=meta,
         )
 
     except HTTPException:
         raise
+    except AdmissionRejected as e:
+        level = "warn"
+        ev.update(status=429, reason=e.reason)
+        raise HTTPException(status_code=429, detail=f"Troppe richieste ({e.reason})",
+                            headers={"Retry-After": e.retry_after})
+    except (SingleFlightFull, LeaderCancelled, asyncio.TimeoutError) as e:
+        # la richiesta leader della stessa domanda è fallita / satura: riprovare a breve
+        level = "warn"
+        ev.update(status=503, reason=type(e).__name__)
+        diag("API", f"/api/ask single-flight: {type(e).__name__}", "warn")
+        raise HTTPException(status_code=503, detail="Servizio momentaneamente occupato, riprova.",
+                            headers={"Retry-After": "2"})
     except Exception as e:
-        print(f"[ERROR] /api/ask: {e}")
+        level = "error"
+        ev.update(route="error", error=f"{type(e).__name__}: {e}")
+        diag("API", f"/api/ask: {e}", "error")
         return AnswerResponse(
             answer="Si è verificato un problema interno. Contatta l’Ufficio Tecnico Tecnaria.",
             source="error",
             meta={"exception": str(e)},
         )
+    finally:
+        # solo un append in memoria: la scrittura su disco è del thread di event_log
+        emit("ask", level, stages=t.stages, total_ms=t.total_ms(), **ev)
@@ -3,15 +3,34 @@ import json
 import re
 import unicodedata
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
-
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-
-from openai import OpenAI
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import startup  # per primo: misura import e caricamenti (report su /ready)
+
+with startup.step("fastapi", "import"):
+    from fastapi import FastAPI, HTTPException, Request
+    from fastapi.middleware.cors import CORSMiddleware
+    from pydantic import BaseModel
+    from fastapi.staticfiles import StaticFiles
+    from fastapi.responses import FileResponse
+
+with startup.step("lang_id / llm_gateway / translation_memory", "import"):
+    import lang_id
+    import llm_gateway
+    import translation_memory
+with startup.step("admission", "import"):
+    from admission import AdmissionRejected, client_id, get_admission
+with startup.step("singleflight", "import"):
+    from singleflight import SingleFlight
+with startup.step("static_assets", "import"):
+    from static_assets import PrecompressedStatic, ensure_built
+with startup.step("kb_dedup / ctf_templates", "import"):
+    import ctf_templates
+    import kb_dedup
+with startup.step("event_log", "import"):
+    from event_log import Timer, diag, emit, get_event_log, loop_lag_stats, start_loop_lag
+with startup.step("json_fragments", "import"):
+    from json_fragments import FastJSONResponse, RawJSONResponse, assemble, fragment
 
 # ============================================================
 # CONFIG
@@ -19,14 +38,25 @@ from openai import OpenAI
 
 APP_VERSION = "12.6.0-DIAGNOSTIC-LIMITI"
 
-client = OpenAI()
-
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "static", "data")
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 
 MASTER_PATH = os.path.join(DATA_DIR, "ctf_system_COMPLETE_GOLD_master.json")
 OVERLAY_DIR = os.path.join(DATA_DIR, "overlays")
+I18N_DIR = os.path.join(STATIC_DIR, "i18n")  # answer_<lang> pre-tradotte (pretranslate_gold.py)
+
+SUPPORTED_LANGS = ("it", "en", "fr", "de", "es")
+
+# rerank identici in volo (stessa domanda + stessi candidati) → una sola chiamata LLM
+RERANK_FLIGHT = SingleFlight()
+RERANK_FLIGHT_TIMEOUT_S = float(os.getenv("SINGLEFLIGHT_TIMEOUT_S", "90"))
+# quasi-duplicati (kb_dedup, MinHash+LSH) collassati a indice: un candidato per cluster
+KB_DEDUP_COLLAPSE = os.getenv("KB_DEDUP_COLLAPSE", "1") == "1"
+# blocchi CTF parametrici (ctf_templates): slot modello/acciaio/lamiera riempiti dalla domanda
+TEMPLATE_BLOCKS_ENABLE = os.getenv("TEMPLATE_BLOCKS_ENABLE", "1") == "1"
+# il template vince solo se batte il miglior blocco curato, o se nessun blocco supera questa soglia
+TEMPLATE_MASTER_THRESHOLD = float(os.getenv("TEMPLATE_MASTER_THRESHOLD", "0.5"))
 
 FALLBACK_FAMILY = "COMM"
 FALLBACK_ID = "COMM-FALLBACK-NOANSWER-0001"
@@ -42,6 +72,7 @@ FALLBACK_MESSAGE = (
 app = FastAPI(
     title="TECNARIA GOLD – MATCHING v12.6.0 DIAGNOSTIC+LIMITI",
     version=APP_VERSION,
+    default_response_class=FastJSONResponse,
 )
 
 app.add_middleware(
@@ -51,11 +82,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# asset buildati (hash + .gz/.br, cache immutable): montati PRIMA di /static
+DIST_STATIC = PrecompressedStatic()
+app.mount("/static/dist", DIST_STATIC, name="static_dist")
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 
 @app.get("/")
-def index():
+async def index(request: Request):
+    if DIST_STATIC.built:
+        return await DIST_STATIC.get_response("index.html", request.scope)
     path = os.path.join(STATIC_DIR, "index.html")
     if os.path.exists(path):
         return FileResponse(path)
@@ -68,7 +104,7 @@ def index():
 
 class AskRequest(BaseModel):
     question: str
-    lang: str = "it"
+    lang: Optional[str] = None  # se assente: rilevata dalla domanda (lang_id, fastText)
     mode: str = "gold"
 
 
@@ -135,25 +171,84 @@ def load_overlay_blocks() -> List[Dict[str, Any]]:
     return blocks
 
 
+def apply_i18n_answers(blocks: List[Dict[str, Any]]) -> int:
+    """
+    answer_<lang> dalle traduzioni offline in static/i18n/<lang>.json.
+    Usate solo se l'hash della answer_it corrente coincide (niente traduzioni stale).
+    """
+    applied = 0
+    for lang in SUPPORTED_LANGS:
+        if lang == "it":
+            continue
+        try:
+            answers = load_json(os.path.join(I18N_DIR, f"{lang}.json")).get("answers") or {}
+        except Exception:
+            continue
+        for b in blocks:
+            tr = answers.get(b.get("id"))
+            if not tr or b.get(f"answer_{lang}") or not b.get("answer_it"):
+                continue
+            if tr.get("src") == translation_memory.text_hash(b["answer_it"]):
+                b[f"answer_{lang}"] = tr.get("text")
+                applied += 1
+    return applied
+
+
 # ============================================================
 # STATE
 # ============================================================
 
-class KBState:
-    master_blocks: List[Dict[str, Any]] = []
-    overlay_blocks: List[Dict[str, Any]] = []
+class KBState(NamedTuple):
+    """
+    Snapshot immutabile della KB: reload_all costruisce tutto a parte e lo pubblica
+    con un unico swap di `S`; una richiesta legge `S` una volta e resta coerente.
+    """
+    master_blocks: List[Dict[str, Any]]
+    overlay_blocks: List[Dict[str, Any]]
+    # id blocco → id canonico dei quasi-duplicati (kb_dedup): un candidato per cluster
+    dup_clusters: Dict[str, str]
+    templates: Optional[ctf_templates.TemplateSet]
+
+
+S = KBState([], [], {}, None)
+
+# risposta GOLD già codificata in JSON, per lingua, salvata sul blocco stesso (viaggia con lo snapshot)
+ANSWER_JSON_KEY = "_answer_json"
 
 
-S = KBState()
+def block_answer(block: Dict[str, Any], lang: str) -> str:
+    return (
+        block.get(f"answer_{lang}")
+        or block.get("answer_it")
+        or FALLBACK_MESSAGE
+    )
+
+
+def encode_answers(blocks: List[Dict[str, Any]]) -> None:
+    for b in blocks:
+        b[ANSWER_JSON_KEY] = {lang: fragment(block_answer(b, lang)) for lang in SUPPORTED_LANGS}
 
 
 def reload_all():
-    S.master_blocks = load_master_blocks()
-    S.overlay_blocks = load_overlay_blocks()
-    print(f"[KB LOADED] master={len(S.master_blocks)} overlay={len(S.overlay_blocks)}")
+    global S
+    master_blocks = load_master_blocks()
+    overlay_blocks = load_overlay_blocks()
+    n_i18n = apply_i18n_answers(master_blocks + overlay_blocks)
+    encode_answers(master_blocks + overlay_blocks)
+    dup_clusters = kb_dedup.cluster_map(master_blocks + overlay_blocks) if KB_DEDUP_COLLAPSE else {}
+    templates = None
+    if TEMPLATE_BLOCKS_ENABLE and os.path.exists(ctf_templates.TEMPLATES_PATH):
+        try:
+            templates = ctf_templates.TemplateSet()
+        except Exception as e:
+            diag("TEMPLATES", f"{ctf_templates.TEMPLATES_PATH}: {e}", "error")
+    S = KBState(master_blocks, overlay_blocks, dup_clusters, templates)
+    diag("KB LOADED", f"master={len(master_blocks)} overlay={len(overlay_blocks)} i18n={n_i18n} "
+                      f"dup={len(dup_clusters)}")
 
 
-reload_all()
+with startup.step("kb master+overlay+i18n"):
+    reload_all()
 
 
 # ============================================================
@@ -228,7 +323,8 @@ def score_block(question: str, block: Dict[str, Any]) -> float:
     return total
 
 
-def lexical_candidates(question: str, blocks: List[Dict[str, Any]], limit: int = 15):
+def lexical_candidates(question: str, blocks: List[Dict[str, Any]], limit: int = 15,
+                       clusters: Optional[Dict[str, str]] = None):
     scored: List[Tuple[float, Dict[str, Any]]] = []
 
     for block in blocks:
@@ -237,6 +333,9 @@ def lexical_candidates(question: str, blocks: List[Dict[str, Any]], limit: int =
             scored.append((s, block))
 
     scored.sort(key=lambda x: x[0], reverse=True)
+    if clusters:
+        # quasi-duplicati: resta solo il migliore del cluster (meno candidati ambigui al rerank)
+        scored = kb_dedup.collapse_scored(scored, clusters)
     return scored[:limit]
 
 
@@ -256,9 +355,11 @@ def is_overview_question(q_norm: str) -> bool:
 # RERANK AI – v12.6 con DIAGNOSTIC SAFE + LIMITI
 # ============================================================
 
-def ai_rerank(question: str, candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+def ai_rerank(question: str, candidates: List[Dict[str, Any]], client: Optional[str] = None) -> Dict[str, Any]:
     """
     Usa l'AI SOLO per scegliere l'ID tra i candidati.
+    Budget LLM del client + corsia "rerank" (admission): se esauriti, vince il primo
+    candidato lessicale, come quando l'LLM fallisce.
 
     Patch v12.2 STRADA A: geometria vs chiodi difettosi.
     Patch v12.3: negazioni → killer.
@@ -498,22 +599,41 @@ def ai_rerank(question: str, candidates: List[Dict[str, Any]]) -> Dict[str, Any]
             "- Rispondi SOLO con un ID presente nella lista dei candidati.\n"
         )
 
-        res = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=20,
-            temperature=0.0,
+        adm = get_admission()
+        if client is not None:
+            adm.admit_llm(client)
+
+        def upstream():
+            # solo il leader single-flight occupa la corsia e consuma il budget LLM globale
+            with adm.thread_lane("rerank"):
+                adm.charge_upstream()
+                return llm_gateway.chat(
+                    [{"role": "user", "content": prompt}],
+                    model="gpt-4.1-mini",
+                    purpose="rerank",
+                    max_tokens=20,
+                    temperature=0.0,
+                )
+
+        res, _ = RERANK_FLIGHT.do(
+            f"rerank:{q_norm}|{','.join(str(i) for i in candidate_ids)}",
+            upstream,
+            timeout=RERANK_FLIGHT_TIMEOUT_S,
         )
+        if not res.ok:
+            raise RuntimeError(res.error)
 
-        chosen = (res.choices[0].message.content or "").strip()
+        chosen = res.content
 
         if chosen in candidate_ids:
             for b in candidates:
                 if b.get("id") == chosen:
                     return b
 
+    except AdmissionRejected as e:
+        diag("AI RERANK", f"rerank non ammesso ({e.reason}): primo candidato lessicale", "warn")
     except Exception as e:
-        print("[AI RERANK ERROR]", e)
+        diag("AI RERANK", str(e), "error")
 
     return candidates[0]
 
@@ -522,67 +642,138 @@ def ai_rerank(question: str, candidates: List[Dict[str, Any]]) -> Dict[str, Any]
 # BEST BLOCK
 # ============================================================
 
-def find_best_block(question: str) -> Tuple[Dict[str, Any], float]:
+def find_best_block(question: str, kb: KBState, client: Optional[str] = None) -> Tuple[Dict[str, Any], float]:
     q_norm = normalize(question)
 
     # 1. Overlay
-    over_scored = lexical_candidates(question, S.overlay_blocks)
+    over_scored = lexical_candidates(question, kb.overlay_blocks, clusters=kb.dup_clusters)
     if over_scored:
         over_blocks = [b for s, b in over_scored]
-        best_o = ai_rerank(question, over_blocks)
+        best_o = ai_rerank(question, over_blocks, client)
         best_s = max(s for s, b in over_scored if b is best_o)
         return best_o, float(best_s)
 
     # 2. Overview
     if is_overview_question(q_norm):
         overview_blocks = [
-            b for b in S.master_blocks if "OVERVIEW" in (b.get("id") or "").upper()
+            b for b in kb.master_blocks if "OVERVIEW" in (b.get("id") or "").upper()
         ]
-        scored = lexical_candidates(question, overview_blocks)
+        scored = lexical_candidates(question, overview_blocks, clusters=kb.dup_clusters)
         if scored:
             blocks = [b for s, b in scored]
-            best = ai_rerank(question, blocks)
+            best = ai_rerank(question, blocks, client)
             best_s = max(s for s, b in scored if b is best)
             return best, float(best_s)
 
     # 3. Master
-    master_scored = lexical_candidates(question, S.master_blocks)
+    master_scored = lexical_candidates(question, kb.master_blocks, clusters=kb.dup_clusters)
     if not master_scored:
         return None, 0.0
 
     master_blocks = [b for s, b in master_scored]
-    best = ai_rerank(question, master_blocks)
+    best = ai_rerank(question, master_blocks, client)
     best_s = max(s for s, b in master_scored if b is best)
     return best, float(best_s)
 
 
+def match_template(question: str, kb: KBState) -> Optional[ctf_templates.TemplateHit]:
+    """
+    Blocco parametrico solo se non scavalca un blocco curato: il punteggio lessicale
+    della domanda del template (slot riempiti) deve battere il miglior candidato
+    overlay/master, salvo che nessuno di questi superi TEMPLATE_MASTER_THRESHOLD.
+    """
+    hit = kb.templates.match(question) if kb.templates is not None else None
+    if hit is None:
+        return None
+    best = 0.0
+    for blocks in (kb.overlay_blocks, kb.master_blocks):
+        scored = lexical_candidates(question, blocks, limit=1, clusters=kb.dup_clusters)
+        if scored:
+            best = max(best, scored[0][0])
+    if best < TEMPLATE_MASTER_THRESHOLD:
+        return hit
+    return hit if score_block(question, {"question_it": hit.question}) > best else None
+
+
+# ============================================================
+# WARM-UP (pre-fork con gunicorn --preload, vedi gunicorn.conf.py)
+# ============================================================
+
+@startup.on_warmup("lang model")
+def _warm_lang() -> None:
+    lang_id.warmup()
+    lang_id.detect_lang("warm-up connettori CTF")
+
+
+@startup.on_warmup("static assets")
+def _warm_static() -> None:
+    ensure_built()
+    DIST_STATIC.reload()
+
+
+@startup.on_warmup("http client")
+def _warm_http() -> None:
+    llm_gateway.preload()
+
+
+@startup.on_warmup("lexical matcher")
+def _warm_matcher() -> None:
+    lexical_candidates("connettori CTF su lamiera grecata", S.master_blocks, clusters=S.dup_clusters)
+
+
+@app.on_event("startup")
+async def _on_startup() -> None:
+    startup.warmup_async()
+    start_loop_lag()
+
+
 # ============================================================
 # ENDPOINTS
 # ============================================================
 
+@app.get("/ready")
+def ready():
+    """Readiness (distinta da /health): 200 solo a warm-up finito, corpo = report di avvio."""
+    return FastJSONResponse(startup.report(), status_code=200 if startup.is_ready() else 503)
+
+
 @app.get("/health")
-def health():
+def health(lag_window_s: float = 60.0):
+    kb = S
     return {
         "ok": True,
         "version": APP_VERSION,
-        "master_blocks": len(S.master_blocks),
-        "overlay_blocks": len(S.overlay_blocks),
+        "master_blocks": len(kb.master_blocks),
+        "overlay_blocks": len(kb.overlay_blocks),
+        "template_blocks": len(kb.templates.templates) if kb.templates is not None else 0,
+        "singleflight_rerank": RERANK_FLIGHT.stats(),
+        "admission": get_admission().stats(),
+        "event_log": get_event_log().stats(),
+        "loop_lag": loop_lag_stats(lag_window_s),
     }
 
 
 @app.post("/api/reload")
 def api_reload():
     reload_all()
+    kb = S
     return {
         "ok": True,
         "version": APP_VERSION,
-        "master_blocks": len(S.master_blocks),
-        "overlay_blocks": len(S.overlay_blocks),
+        "master_blocks": len(kb.master_blocks),
+        "overlay_blocks": len(kb.overlay_blocks),
     }
 
 
 @app.post("/api/ask", response_model=AskResponse)
-def api_ask(req: AskRequest):
+def api_ask(req: AskRequest, request: Request):
+    t = Timer()
+    client = client_id(request)
+    try:
+        get_admission().admit(client)
+    except AdmissionRejected as e:
+        emit("ask", "warn", route="rejected", status=429, reason=e.reason, total_ms=t.total_ms())
+        raise HTTPException(429, f"Troppe richieste ({e.reason})", headers={"Retry-After": e.retry_after})
 
     if req.mode.lower() != "gold":
         raise HTTPException(400, "Modalità non supportata (solo gold).")
@@ -591,31 +782,53 @@ def api_ask(req: AskRequest):
     if not question:
         raise HTTPException(400, "Domanda vuota.")
 
-    block, score = find_best_block(question)
+    lang = lang_id.normalize_lang(req.lang or lang_id.detect_lang(question), SUPPORTED_LANGS)
+    t.lap("lang")
+
+    # blocchi parametrici (testi solo IT): modello a catalogo + intento → risposta renderizzata, niente rerank
+    kb = S  # un solo snapshot per tutta la richiesta (anche durante /api/reload)
+    hit = match_template(question, kb) if lang == "it" else None
+    t.lap("template")
+    if hit is not None:
+        emit("ask", route="template", q=question[:300], lang=lang, block_id=hit.id, family=hit.family,
+             slots=hit.slots, score=hit.score, stages=t.stages, total_ms=t.total_ms())
+        return RawJSONResponse(assemble(
+            ok=True,
+            answer=hit.answer,
+            family=hit.family,
+            id=hit.id,
+            mode="gold",
+            lang=lang,
+            score=hit.score
+        ))
+
+    block, score = find_best_block(question, kb, client)
+    t.lap("match")
 
     if block is None:
+        emit("ask", route="fallback", q=question[:300], lang=lang, block_id=None, score=0.0,
+             stages=t.stages, total_ms=t.total_ms())
         return AskResponse(
             ok=False,
             answer=FALLBACK_MESSAGE,
             family=FALLBACK_FAMILY,
             id=FALLBACK_ID,
             mode="gold",
-            lang=req.lang,
+            lang=lang,
             score=0.0
         )
 
-    answer = (
-        block.get(f"answer_{req.lang}")
-        or block.get("answer_it")
-        or FALLBACK_MESSAGE
-    )
+    # risposta GOLD pre-codificata al load: il corpo è solo concatenato
+    answer = (block.get(ANSWER_JSON_KEY) or {}).get(lang) or block_answer(block, lang)
+    emit("ask", route="block", q=question[:300], lang=lang, block_id=block.get("id"),
+         family=block.get("family"), score=round(float(score), 4), stages=t.stages, total_ms=t.total_ms())
 
-    return AskResponse(
+    return RawJSONResponse(assemble(
         ok=True,
         answer=answer,
-        family=block.get("family", "CTF_SYSTEM"),
-        id=block.get("id", "UNKNOWN-ID"),
-        mode=block.get("mode", "gold"),
-        lang=req.lang,
+        family=str(block.get("family", "CTF_SYSTEM")),
+        id=str(block.get("id", "UNKNOWN-ID")),
+        mode=str(block.get("mode", "gold")),
+        lang=lang,
         score=float(score)
-    )
+    ))
@@ -4,11 +4,16 @@ configuratore_connettori.py
 Pipeline a due step per ordini connettori Tecnaria:
 1) Estrazione parametri critici (slot-filling)
 2) Calcolo finale altezza + codice connettore
+   (solver locale deterministico sui cataloghi CTF/CTL; LLM solo come fallback
+    o, se richiesto, per la formulazione di `mostra_al_cliente`)
 """
 
 import os
+import re
 import json
-from typing import Dict, Any, Optional
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
 
 # ===========
 # LLM ADAPTER
@@ -19,35 +24,29 @@ from typing import Dict, Any, Optional
 # OPENAI_MODEL=gpt-4o-mini (o altro modello)
 #
 # Se usi provider compatibile (es. DeepSeek-compat), basta impostare OPENAI_BASE_URL.
+# Trasporto, pool, retry e limiti di concorrenza: llm_gateway.
 
 def ask_chatgpt(prompt: str) -> str:
-    import requests
+    import llm_gateway
 
-    api_key = os.getenv("OPENAI_API_KEY", "").strip()
-    base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
     model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
-    if not api_key:
+    if not llm_gateway.is_configured():
         # Fallback hard (per ambienti senza chiave): restituisco errore JSON valido
         return json.dumps({"status": "ERROR", "detail": "OPENAI_API_KEY mancante"})
 
-    url = f"{base_url}/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-    data = {
-        "model": model,
-        "temperature": 0.0,
-        "messages": [
+    res = llm_gateway.chat(
+        [
             {"role": "system", "content": "Rispondi SOLO in JSON quando richiesto. Non aggiungere testo extra."},
             {"role": "user", "content": prompt},
         ],
-    }
-    resp = requests.post(url, headers=headers, json=data, timeout=60)
-    resp.raise_for_status()
-    content = resp.json()["choices"][0]["message"]["content"]
-    return content
+        model=model,
+        purpose="configuratore",
+        temperature=0.0,
+    )
+    if not res.ok:
+        return json.dumps({"status": "ERROR", "detail": res.error})
+    return res.content
 
 
 # ==================
@@ -122,20 +121,293 @@ Se i parametri sono insufficienti, restituisci:
 CRITICAL_FIELDS = {"spessore_soletta_mm", "copriferro_mm", "supporto"}
 
 def _safe_json_loads(raw: str) -> Dict[str, Any]:
+    raw_stripped = str(raw or "").strip()
     try:
-        return json.loads(raw)
+        out = json.loads(raw_stripped)
     except Exception:
-        # Provo a tagliare eventuali pre/post testo non JSON
-        raw_stripped = raw.strip()
-        # fallback estremamente prudente
-        return {"status": "ERROR", "raw": raw_stripped[:2000]}
+        out = None
+    if isinstance(out, dict):
+        return out
+    # testo non JSON o JSON non-oggetto (lista, stringa, numero): fallback estremamente prudente
+    return {"status": "ERROR", "raw": raw_stripped[:2000]}
+
+# ==============================
+# ESTRATTORE LOCALE (grammatica)
+# ==============================
+# Regex + unità (mm/cm) per i casi comuni, es.
+#   "CTF soletta 5 cm copriferro 25 mm su lamiera grecata REI60"
+#   "CTF su soletta piena 12 cm, copriferro 3 cm"
+# L'LLM viene chiamato solo se nel testo restano numeri non interpretati.
+
+ESTRAZIONE_LOCALE = os.getenv("CONFIG_ESTRAZIONE_LOCALE", "1") == "1"
+
+_NUM = r"(\d+(?:[.,]\d+)?)"
+_UNIT = r"\s*(mm|cm|millimetri|centimetri)?\b"
+_SLOT_RE = {
+    "spessore_soletta_mm": re.compile(
+        r"\b(?:spessore\s+(?:della\s+|di\s+)?)?(?:soletta|getto|cappa)(?:\s+(?:piena|collaborante|in\s+calcestruzzo|in\s+cls))?"
+        r"(?:\s+(?:spessa|alta|spessore|altezza))?\s*(?:da|di|=|:)?\s*" + _NUM + _UNIT, re.IGNORECASE),
+    "copriferro_mm": re.compile(
+        r"\bcopri\s*-?\s*ferro\s*(?:minimo\s*)?(?:da|di|=|:)?\s*" + _NUM + _UNIT, re.IGNORECASE),
+}
+_PRODOTTO_RE = [
+    (re.compile(r"\b(?:ctl\s*maxi|ctlm\s*\d*)\b", re.IGNORECASE), "CTL MAXI"),
+    (re.compile(r"\b(?:ctlb?\s*\d*|ctl)\b", re.IGNORECASE), "CTL"),
+    (re.compile(r"\bctf\s*(?:\d{2}\s*/\s*)?\d*\b", re.IGNORECASE), "CTF"),
+    (re.compile(r"\bdiapason\b", re.IGNORECASE), "Diapason"),
+    (re.compile(r"\b(?:mini\s*)?(?:v\s*|ct\s*)?cem\s*-?\s*e\b", re.IGNORECASE), "CEM-E"),
+]
+# soletta piena / negazioni prima della lamiera: "senza lamiera grecata" contiene "lamiera"
+_SUPPORTO_RE = [
+    (re.compile(r"\b(?:soletta\s+piena|(?:senza|no|niente)\s+(?:la\s+)?lamiera(?:\s+grecata)?|getto\s+pieno|piena)\b",
+                re.IGNORECASE), "soletta_piena"),
+    (re.compile(r"(?<!senza\s)(?<!no\s)\b(?:lamiera(?:\s+grecata)?|grecata|hi\s*-?\s*bond|tr\s*60|lamiera\s+collaborante)\b",
+                re.IGNORECASE), "lamiera_grecata"),
+]
+_REI_RE = re.compile(r"\b(R|REI|EI)\s*-?\s*(\d{2,3})\b", re.IGNORECASE)
+_DIGIT_RE = re.compile(r"\d")
+
+_FOLLOWUP = {
+    "spessore_soletta_mm": "lo spessore della soletta (mm o cm)",
+    "copriferro_mm": "il copriferro (mm)",
+    "supporto": "il supporto (lamiera grecata o soletta piena)",
+}
+
+
+def _to_mm(value: str, unit: Optional[str], default_unit: str) -> float:
+    v = float(value.replace(",", "."))
+    unit = (unit or default_unit).lower()
+    return v * 10.0 if unit.startswith("c") else v
+
+
+def _mm_out(v: float) -> Any:
+    return int(v) if float(v).is_integer() else v
+
+
+def estrai_parametri_locale(domanda: str) -> Tuple[Dict[str, Any], str]:
+    """
+    Slot-filling locale. Ritorna (campi trovati, testo residuo non interpretato).
+    Senza unità: soletta in cm se < 30, altrimenti mm; copriferro in mm.
+    """
+    found: Dict[str, Any] = {}
+    residuo = domanda
+
+    def consume(m: "re.Match") -> None:
+        nonlocal residuo
+        residuo = residuo.replace(m.group(0), " ", 1)
+
+    for field, rx in _SLOT_RE.items():
+        m = rx.search(domanda)
+        if not m:
+            continue
+        value, unit = m.group(1), m.group(2)
+        if field == "spessore_soletta_mm":
+            default_unit = "cm" if float(value.replace(",", ".")) < 30 else "mm"
+        else:
+            default_unit = "mm"
+        found[field] = _mm_out(_to_mm(value, unit, default_unit))
+        consume(m)
+
+    for rx, prodotto in _PRODOTTO_RE:
+        m = rx.search(domanda)
+        if m:
+            found["prodotto"] = prodotto
+            consume(m)
+            break
+
+    for rx, supporto in _SUPPORTO_RE:
+        m = rx.search(domanda)
+        if m:
+            found["supporto"] = supporto
+            consume(m)
+            break
+
+    m = _REI_RE.search(domanda)
+    if m:
+        found["classe_fuoco"] = f"{m.group(1).upper()}{m.group(2)}"
+        consume(m)
+
+    found.setdefault("note", "")
+    return found, residuo
+
+
+def _esito_locale(found: Dict[str, Any]) -> Dict[str, Any]:
+    """Stesso JSON dell'estrazione LLM (READY / MISSING)."""
+    needed = [k for k in ("spessore_soletta_mm", "copriferro_mm", "supporto") if k not in found]
+    if not needed:
+        return {"status": "READY", "found": found}
+    return {
+        "status": "MISSING",
+        "found": found,
+        "needed_fields": needed,
+        "followup_question": "Per scegliere l'altezza del connettore mi indichi "
+                             + ", ".join(_FOLLOWUP[k] for k in needed) + "?",
+    }
+
 
 def estrai_parametri(domanda: str) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    if ESTRAZIONE_LOCALE:
+        found, residuo = estrai_parametri_locale(domanda)
+        esito = _esito_locale(found)
+        # tutto interpretato (o nessun numero lasciato indietro) → nessuna chiamata di rete
+        if esito["status"] == "READY" or not _DIGIT_RE.search(residuo):
+            esito["_estrazione"] = {"path": "locale", "ms": round((time.perf_counter() - t0) * 1000, 3)}
+            return esito
     prompt = PROMPT_ESTRAZIONE.replace("{DOMANDA_UTENTE}", domanda)
     raw = ask_chatgpt(prompt)
-    return _safe_json_loads(raw)
+    esito = _safe_json_loads(raw)
+    esito["_estrazione"] = {
+        "path": "llm" if not ESTRAZIONE_LOCALE else "locale+llm",
+        "ms": round((time.perf_counter() - t0) * 1000, 3),
+    }
+    return esito
+
+# ==========================
+# SOLVER LOCALE (rule table)
+# ==========================
+# Regola (solo soletta piena): altezza utile = spessore_soletta_mm - copriferro_mm;
+# si sceglie l'altezza di catalogo più alta che NON supera l'altezza utile.
+# Con lamiera grecata la scelta dipende dall'altezza della greca, che i cataloghi
+# non riportano: in quel caso decide l'LLM (PROMPT_SOLUZIONE).
+# Cataloghi: static/static/data/critici/codici_ctf.json / codici_ctl.json
+# (fallback: elenco CTF in documenti_gTab/Prodotti_Elenco.txt).
+
+_BASE_DIR = Path(__file__).resolve().parent
+_CRITICI_DIR = _BASE_DIR / "static" / "static" / "data" / "critici"
+_PRODOTTI_ELENCO = _BASE_DIR / "documenti_gTab" / "Prodotti_Elenco.txt"
+
+SOLVER_LOCALE = os.getenv("CONFIG_SOLVER_LOCALE", "1") == "1"
+# Se 1, il testo `mostra_al_cliente` viene riformulato dall'LLM (una chiamata in più)
+LLM_WORDING = os.getenv("CONFIG_LLM_WORDING", "0") == "1"
+
+# prodotto → (file catalogo, prefisso codici da usare)
+_CATALOGHI = {
+    "CTF": ("codici_ctf.json", "CTF"),
+    "CTL": ("codici_ctl.json", "CTLB"),
+    "CTL MAXI": ("codici_ctl.json", "CTLM"),
+}
+_CODE_RE = re.compile(r"^([A-Z]+)(\d{3})$")
+_CATALOG_CACHE: Dict[str, List[Tuple[int, str]]] = {}
+
+PROMPT_WORDING = """Riformula in modo conciso e chiaro, per la conferma d'ordine al cliente, questa soluzione
+(non cambiare numeri né codici):
+{soluzione}
+
+Restituisci SOLO JSON: {{"mostra_al_cliente": "<testo>"}}"""
+
+
+def _catalogo(prodotto: str) -> List[Tuple[int, str]]:
+    """[(altezza_mm, codice), ...] ordinato per altezza, caricato una volta per prodotto."""
+    if prodotto in _CATALOG_CACHE:
+        return _CATALOG_CACHE[prodotto]
+    fname, prefix = _CATALOGHI[prodotto]
+    codes: List[str] = []
+    try:
+        with (_CRITICI_DIR / fname).open("r", encoding="utf-8") as f:
+            codes = json.load(f).get("data", {}).get("codici", []) or []
+    except Exception:
+        if prefix == "CTF" and _PRODOTTI_ELENCO.exists():
+            codes = [ln.strip() for ln in _PRODOTTI_ELENCO.read_text(encoding="utf-8").splitlines()]
+    out: List[Tuple[int, str]] = []
+    for c in codes:
+        m = _CODE_RE.match(str(c).strip())
+        if m and m.group(1) == prefix:
+            out.append((int(m.group(2)), m.group(0)))
+    out.sort()
+    _CATALOG_CACHE[prodotto] = out
+    return out
+
+
+def _num(v: Any) -> Optional[float]:
+    try:
+        return float(str(v).replace(",", ".").strip())
+    except Exception:
+        return None
+
+
+def _prodotto_catalogo(found: Dict[str, Any]) -> Optional[str]:
+    prodotto = str(found.get("prodotto", "")).upper().replace("-", " ").strip()
+    note = str(found.get("note", "")).upper()
+    if prodotto.startswith("CTF"):
+        return "CTF"
+    if prodotto.startswith("CTL"):
+        return "CTL MAXI" if ("MAXI" in prodotto or "MAXI" in note or "CTLM" in prodotto) else "CTL"
+    return None
+
+
+def risolvi_localmente(found: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Calcolo deterministico di altezza + codice (stesso JSON di PROMPT_SOLUZIONE).
+    Ritorna None se il prodotto non è coperto dalle tabelle o il supporto non è
+    soletta piena (→ fallback LLM).
+    """
+    prodotto = _prodotto_catalogo(found)
+    supporto = str(found.get("supporto", "")).strip()
+    if prodotto is None or supporto != "soletta_piena":
+        return None
+    catalogo = _catalogo(prodotto)
+    if not catalogo:
+        return None
+
+    spessore = _num(found.get("spessore_soletta_mm"))
+    copriferro = _num(found.get("copriferro_mm"))
+    if spessore is None or copriferro is None or spessore <= 0 or copriferro < 0:
+        return {"status": "INSUFFICIENT"}
+
+    utile = spessore - copriferro
+    scelti = [(h, c) for h, c in catalogo if h <= utile]
+    if not scelti:
+        return {
+            "status": "INSUFFICIENT",
+            "detail": f"Altezza utile {utile:g} mm inferiore al connettore più basso ({catalogo[0][1]}).",
+        }
+    altezza, codice = scelti[-1]
+
+    avvertenze = ["Soluzione da confermare con il progettista / Ufficio Tecnico Tecnaria."]
+    if prodotto == "CTF":
+        avvertenze.append("Fissaggio con 2 chiodi HSBR14 per connettore mediante chiodatrice SPIT P560.")
+    else:
+        avvertenze.append("Fissaggio con viti su trave/tavolato in legno secondo istruzioni Tecnaria.")
+    if found.get("classe_fuoco"):
+        avvertenze.append(f"Classe di resistenza al fuoco richiesta ({found.get('classe_fuoco')}) da verificare in progetto.")
+
+    motivazione = (
+        f"Altezza utile = {spessore:g} mm di soletta − {copriferro:g} mm di copriferro = {utile:g} mm. "
+        f"Il {codice} ({altezza} mm) è il connettore di catalogo più alto che rientra nell'altezza utile."
+    )
+    mostra = (
+        f"Connettore proposto: {codice} (altezza {altezza} mm) per soletta da {spessore:g} mm "
+        f"con copriferro {copriferro:g} mm su {supporto.replace('_', ' ')}."
+    )
+    return {
+        "soluzione": {
+            "altezza_connettore_mm": altezza,
+            "codice_prodotto": codice,
+            "motivazione_breve": motivazione,
+            "avvertenze": avvertenze,
+        },
+        "mostra_al_cliente": mostra,
+    }
+
+
+def _riformula_per_cliente(sol: Dict[str, Any]) -> Dict[str, Any]:
+    """Opzionale: solo la formulazione del testo cliente passa dall'LLM."""
+    raw = ask_chatgpt(PROMPT_WORDING.format(soluzione=json.dumps(sol["soluzione"], ensure_ascii=False)))
+    testo = _safe_json_loads(raw).get("mostra_al_cliente")
+    if isinstance(testo, str) and testo.strip():
+        sol["mostra_al_cliente"] = testo.strip()
+    return sol
+
 
 def calcola_soluzione(found: Dict[str, Any]) -> Dict[str, Any]:
+    if SOLVER_LOCALE:
+        sol = risolvi_localmente(found)
+        if sol is not None:
+            if LLM_WORDING and "soluzione" in sol:
+                sol = _riformula_per_cliente(sol)
+            return sol
+
     p = PROMPT_SOLUZIONE.format(
         prodotto=str(found.get("prodotto", "")),
         spessore=str(found.get("spessore_soletta_mm", "")),
@@ -178,12 +450,14 @@ def pipeline_connettore(domanda_utente: str,
                         defaults: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     defaults = defaults or get_defaults()
     step1 = estrai_parametri(domanda_utente)
+    estrazione = step1.pop("_estrazione", None)
 
     if step1.get("status") == "READY" and isinstance(step1.get("found"), dict):
         return {
             "status": "OK",
             "input_params": step1["found"],
-            "result": calcola_soluzione(step1["found"])
+            "result": calcola_soluzione(step1["found"]),
+            "estrazione": estrazione,
         }
 
     if step1.get("status") == "MISSING":
@@ -203,14 +477,16 @@ def pipeline_connettore(domanda_utente: str,
                 "question": step1.get("followup_question", "Servono dati aggiuntivi."),
                 "found_partial": found,
                 "missing": sorted(list(needed)),
+                "estrazione": estrazione,
             }
 
         # 3) Parametri completi → calcolo
         return {
             "status": "OK",
             "input_params": found,
-            "result": calcola_soluzione(found)
+            "result": calcola_soluzione(found),
+            "estrazione": estrazione,
         }
 
     # Fallback errore
-    return {"status": "ERROR", "detail": step1}
+    return {"status": "ERROR", "detail": step1, "estrazione": estrazione}
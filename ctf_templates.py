@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+ctf_templates.py
+----------------
+Blocchi parametrici CTF: template con slot tipizzati (model, material, lamina)
+riempiti dalla domanda a runtime, al posto delle combinazioni materializzate.
+
+- template e slot: static/data/ctf_templates.json (scritto da generator_ctf.py)
+- slot "catalog": codici della sezione "=== CTF" di documenti_gTab/Prodotti_Elenco.txt
+  (CTF020 … CTF135); altezza in mm = numero del codice. Un nuovo modello in
+  catalogo è subito coperto, senza rigenerare nulla
+- slot "enum": valori con pattern regex ed etichetta per il testo; default se assente
+
+Costo di match costante: una passata di regex per slot + parole chiave dei
+template, indipendente dal numero di modelli/acciai/lamiere.
+
+Keywords ed excludes sono radici cercate a inizio parola ("uso" non scatta su
+"fuso"). Gli excludes globali (supporti non in acciaio, calcolo, interasse,
+scelta del prodotto) lasciano la domanda ai blocchi curati del master; il
+chiamante decide comunque se il template batte il miglior blocco lessicale
+(applastversion.match_template).
+
+Casi di regressione: static/data/tests/ctf_templates_cases.json
+    python ctf_templates.py --check
+
+Uso:
+    from ctf_templates import get_templates
+    hit = get_templates().match("come si posa un ctf105 su s355 con doppia lamiera?")
+    hit.answer, hit.id, hit.slots
+"""
+
+from __future__ import annotations
+import json
+import os
+import re
+import unicodedata
+from typing import Any, Dict, List, NamedTuple, Optional
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_PATH = os.path.join(_BASE_DIR, "static", "data", "ctf_templates.json")
+
+_SECTION = re.compile(r"^===\s*(\S+)")
+CASES_PATH = os.path.join(_BASE_DIR, "static", "data", "tests", "ctf_templates_cases.json")
+
+
+class TemplateHit(NamedTuple):
+    id: str
+    family: str
+    intent: str
+    answer: str
+    question: str
+    slots: Dict[str, Optional[str]]
+    score: float  # quota di slot del template presi dalla domanda (1.0 = tutti)
+
+
+def _norm(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower().replace("×", "x"))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _stems(words) -> Optional["re.Pattern[str]"]:
+    """Regex 'una delle radici a inizio parola' (None se la lista è vuota)."""
+    words = [_norm(w) for w in words or () if w and w.strip()]
+    return re.compile(r"\b(?:" + "|".join(re.escape(w) for w in words) + ")") if words else None
+
+
+def load_catalog(path: str, section: str) -> List[str]:
+    """Codici della sezione '=== <section> —' (una riga per codice, fino alla sezione successiva)."""
+    codes: List[str] = []
+    current = None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            m = _SECTION.match(line)
+            if m:
+                current = m.group(1)
+                continue
+            code = line.strip().split()[0] if line.strip() else ""
+            if current == section and re.fullmatch(rf"{re.escape(section)}\d+", code):
+                codes.append(code)
+    return codes
+
+
+class TemplateSet:
+    def __init__(self, path: str = TEMPLATES_PATH) -> None:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.family = data.get("family", "CTF")
+        self.slots = data["slots"]
+        self.templates = sorted(data["templates"], key=lambda t: -t.get("priority", 0))
+
+        self._extract: Dict[str, Any] = {}
+        self.catalog: Dict[str, List[str]] = {}
+        for name, spec in self.slots.items():
+            if spec["type"] == "catalog":
+                codes = load_catalog(os.path.join(_BASE_DIR, *data["catalog"].split("/")), spec["section"])
+                self.catalog[name] = codes
+                self._extract[name] = (re.compile(spec["pattern"]), {int(c[len(spec["section"]):]): c for c in codes})
+            else:
+                self._extract[name] = [(value, re.compile(v["pattern"])) for value, v in spec["values"].items()]
+        self._excludes = _stems(data.get("excludes"))
+        self._keywords = [(t, _stems(t.get("keywords")), _stems(t.get("excludes"))) for t in self.templates]
+
+    # ---------------- slot ----------------
+
+    def extract(self, q: str) -> Dict[str, Optional[str]]:
+        """Valori degli slot trovati nella domanda normalizzata (None = non specificato o fuori catalogo)."""
+        out: Dict[str, Optional[str]] = {}
+        for name, ex in self._extract.items():
+            if isinstance(ex, tuple):
+                pat, by_num = ex
+                m = pat.search(q)
+                out[name] = by_num.get(int(m.group(1))) if m else None
+            else:
+                out[name] = next((value for value, pat in ex if pat.search(q)), None)
+        return out
+
+    def _values(self, slots: Dict[str, Optional[str]]) -> Dict[str, str]:
+        vals: Dict[str, str] = {}
+        for name, spec in self.slots.items():
+            v = slots.get(name)
+            if spec["type"] == "catalog":
+                vals[name] = v or ""
+                if v:
+                    vals["height"] = str(int(v[len(spec["section"]):]))
+            else:
+                vals[name] = spec["values"][v]["label"] if v else spec.get("default", "")
+        return vals
+
+    # ---------------- render / match ----------------
+
+    def render(self, tpl: Dict[str, Any], slots: Dict[str, Optional[str]]) -> str:
+        vals = self._values(slots)
+        if "{catalog}" in tpl["answer_it"]:
+            spec_name = next(n for n, s in self.slots.items() if s["type"] == "catalog")
+            section = self.slots[spec_name]["section"]
+            vals["catalog"] = "\n".join(
+                tpl["catalog_line"].format(**{spec_name: c, "height": int(c[len(section):])})
+                for c in self.catalog[spec_name])
+        return tpl["answer_it"].format_map(vals)
+
+    def match(self, question: str) -> Optional[TemplateHit]:
+        q = _norm(question)
+        if self.family.lower() not in q or (self._excludes is not None and self._excludes.search(q)):
+            return None
+        slots = self.extract(q)
+        for tpl, kws, excl in self._keywords:
+            if kws is None or not kws.search(q) or (excl is not None and excl.search(q)):
+                continue
+            if any(not slots.get(r) for r in tpl.get("requires") or ()):
+                continue
+            used = [n for n in self.slots if "{" + n + "}" in tpl["question_it"]]
+            score = sum(1 for n in used if slots.get(n)) / len(used) if used else 1.0
+            return TemplateHit(
+                id=tpl["id"], family=tpl.get("family", self.family), intent=tpl["intent"],
+                answer=self.render(tpl, slots), question=tpl["question_it"].format_map(self._values(slots)),
+                slots={n: slots.get(n) for n in used}, score=round(score, 3),
+            )
+        return None
+
+
+_TEMPLATES: Optional[TemplateSet] = None
+
+
+def get_templates() -> Optional[TemplateSet]:
+    """None se il file dei template o il catalogo non sono disponibili."""
+    global _TEMPLATES
+    if _TEMPLATES is None and os.path.exists(TEMPLATES_PATH):
+        _TEMPLATES = TemplateSet()
+    return _TEMPLATES
+
+
+# ============================================================
+# CLI: casi di regressione (static/data/tests/ctf_templates_cases.json)
+# ============================================================
+
+def main() -> None:
+    import argparse
+    import sys
+
+    ap = argparse.ArgumentParser(description="Template CTF parametrici")
+    ap.add_argument("--check", action="store_true", help="esegue i casi di regressione (exit 1 se falliscono)")
+    ap.add_argument("--cases", default=CASES_PATH)
+    a = ap.parse_args()
+    if not a.check:
+        ap.print_help()
+        return
+
+    import applastversion  # gate completo: excludes + confronto col miglior blocco lessicale
+
+    with open(a.cases, "r", encoding="utf-8") as f:
+        cases = json.load(f)["cases"]
+    failed = 0
+    for c in cases:
+        hit = applastversion.match_template(c["q"], applastversion.S)
+        got = hit.id if hit is not None else None
+        ok = got == c.get("template")
+        failed += not ok
+        print(f"{'ok ' if ok else 'KO '} {c['q']!r}: template={got} atteso={c.get('template')}")
+    print(f"{len(cases) - failed}/{len(cases)} casi ok")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
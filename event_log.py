@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+event_log.py
+------------
+Log strutturato degli eventi (NDJSON), senza I/O sul percorso della richiesta.
+
+- emit(kind, **campi): append O(1) su un ring buffer in memoria (deque);
+  a buffer pieno si perde l'evento più vecchio (contato in "dropped")
+- un thread in background svuota il buffer a lotti e scrive su file NDJSON
+  ruotati per dimensione: EVENTLOG_DIR/events.<pid>.ndjson (.1, .2, ...)
+  un file per processo: i worker gunicorn non si contendono la rotazione
+- campionamento: gli eventi "ask" sono tenuti con probabilità EVENTLOG_SAMPLE;
+  errori, warning e richieste lente (>= EVENTLOG_SLOW_MS) sono tenuti sempre
+- diag(tag, msg, level): diagnostica al posto di print(); l'eco su stdout
+  (formato "[TAG] msg" di sempre) lo fa il thread, non il chiamante
+
+Il thread parte al primo emit nel processo che scrive: con gunicorn --preload
+il master non se lo porta dietro nel fork.
+
+Lag dell'event loop dell'app: start_loop_lag() (startup, dentro il loop) campiona
+ogni EVENTLOG_LAG_INTERVAL_S lo sforamento di una sleep; loop_lag_stats(window_s)
+dà p50/p99/max sulla finestra, esposti da /api/status e /health (per worker).
+
+Env:
+    EVENTLOG_ENABLE (1)       EVENTLOG_DIR (logs)
+    EVENTLOG_SAMPLE (1.0)     EVENTLOG_SLOW_MS (2000)
+    EVENTLOG_RING (10000)     EVENTLOG_BATCH (500)     EVENTLOG_FLUSH_S (1.0)
+    EVENTLOG_MAX_BYTES (10485760)  EVENTLOG_BACKUPS (5)
+    EVENTLOG_ECHO (1)         eco su stdout dei diag
+    EVENTLOG_LAG_INTERVAL_S (0.05)  EVENTLOG_LAG_RING (12000)
+"""
+
+from __future__ import annotations
+import asyncio
+import atexit
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from jsonfast import dumps
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+EVENTLOG_ENABLE = os.getenv("EVENTLOG_ENABLE", "1") == "1"
+EVENTLOG_DIR = os.getenv("EVENTLOG_DIR", os.path.join(_BASE_DIR, "logs"))
+EVENTLOG_SAMPLE = float(os.getenv("EVENTLOG_SAMPLE", "1.0"))
+EVENTLOG_SLOW_MS = float(os.getenv("EVENTLOG_SLOW_MS", "2000"))
+EVENTLOG_RING = int(os.getenv("EVENTLOG_RING", "10000"))
+EVENTLOG_BATCH = int(os.getenv("EVENTLOG_BATCH", "500"))
+EVENTLOG_FLUSH_S = float(os.getenv("EVENTLOG_FLUSH_S", "1.0"))
+EVENTLOG_MAX_BYTES = int(os.getenv("EVENTLOG_MAX_BYTES", str(10 * 1024 * 1024)))
+EVENTLOG_BACKUPS = int(os.getenv("EVENTLOG_BACKUPS", "5"))
+EVENTLOG_ECHO = os.getenv("EVENTLOG_ECHO", "1") == "1"
+EVENTLOG_LAG_INTERVAL_S = float(os.getenv("EVENTLOG_LAG_INTERVAL_S", "0.05"))
+EVENTLOG_LAG_RING = int(os.getenv("EVENTLOG_LAG_RING", "12000"))
+
+ALWAYS_KEEP = {"warn", "error"}
+
+
+class Timer:
+    """Tempi per fase di una richiesta: lap("kb") = ms dall'ultima lap."""
+
+    __slots__ = ("t0", "_last", "stages")
+
+    def __init__(self) -> None:
+        self.t0 = self._last = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.stages[stage] = round(self.stages.get(stage, 0.0) + (now - self._last) * 1000, 3)
+        self._last = now
+
+    def total_ms(self) -> float:
+        return round((time.perf_counter() - self.t0) * 1000, 3)
+
+
+class EventLog:
+    def __init__(self, directory: str = EVENTLOG_DIR, ring: int = EVENTLOG_RING,
+                 sample: float = EVENTLOG_SAMPLE) -> None:
+        self.directory = directory
+        self.sample = sample
+        self._buf: Deque[Dict[str, Any]] = deque(maxlen=max(1, ring))
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+        self._fh = None
+        self._size = 0
+        self.stats_ = {"emitted": 0, "sampled_out": 0, "dropped": 0, "written": 0, "write_errors": 0}
+
+    # ---------------- percorso della richiesta ----------------
+
+    def emit(self, kind: str, level: str = "info", **fields: Any) -> None:
+        if not EVENTLOG_ENABLE:
+            return
+        if (kind == "ask" and level not in ALWAYS_KEEP and self.sample < 1.0
+                and fields.get("total_ms", 0) < EVENTLOG_SLOW_MS and random.random() >= self.sample):
+            self.stats_["sampled_out"] += 1
+            return
+        if self._pid != os.getpid():
+            self._start()
+        if len(self._buf) == self._buf.maxlen:
+            self.stats_["dropped"] += 1
+        fields["ts"] = round(time.time(), 3)
+        fields["kind"] = kind
+        fields["level"] = level
+        self._buf.append(fields)
+        self.stats_["emitted"] += 1
+        if len(self._buf) >= EVENTLOG_BATCH:
+            self._wake.set()
+
+    def recent(self, n: int = 50) -> List[Dict[str, Any]]:
+        """Ultimi eventi ancora nel buffer (non ancora scritti)."""
+        return list(self._buf)[-n:]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": EVENTLOG_ENABLE, "sample": self.sample, "buffered": len(self._buf),
+                "file": self._path() if self._pid else None, **self.stats_}
+
+    # ---------------- thread di scrittura ----------------
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # dopo un fork: stato del padre da buttare (thread e file non esistono qui;
+            # gli eventi ancora in buffer li scrive il padre)
+            if self._pid is not None:
+                self._buf.clear()
+            self._pid = os.getpid()
+            self._fh = None
+            self._wake = threading.Event()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+            self._thread.start()
+
+    def _path(self) -> str:
+        return os.path.join(self.directory, f"events.{self._pid}.ndjson")
+
+    def _open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._fh = open(self._path(), "ab")
+        self._size = self._fh.tell()
+
+    def _rotate(self) -> None:
+        self._fh.close()
+        base = self._path()
+        for i in range(EVENTLOG_BACKUPS - 1, 0, -1):
+            if os.path.exists(f"{base}.{i}"):
+                os.replace(f"{base}.{i}", f"{base}.{i + 1}")
+        if EVENTLOG_BACKUPS > 0:
+            os.replace(base, f"{base}.1")
+        else:
+            os.remove(base)
+        self._open()
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        lines = []
+        for ev in batch:
+            if EVENTLOG_ECHO and ev["kind"] == "diag":
+                tag = ev.get("tag") or "LOG"
+                lvl = "" if ev["level"] == "info" else f"[{ev['level'].upper()}]"
+                print(f"[{tag}]{lvl} {ev.get('msg', '')}", flush=True)
+            try:
+                lines.append(dumps(ev))
+            except Exception:
+                lines.append(dumps({k: str(v) for k, v in ev.items()}))
+        data = b"\n".join(lines) + b"\n"
+        try:
+            if self._fh is None:
+                self._open()
+            elif self._size + len(data) > EVENTLOG_MAX_BYTES and self._size > 0:
+                self._rotate()
+            self._fh.write(data)
+            self._fh.flush()
+            self._size += len(data)
+            self.stats_["written"] += len(batch)
+        except Exception as e:
+            self.stats_["write_errors"] += 1
+            print(f"[EVENTLOG][WARN] scrittura {self.directory}: {e}", file=sys.stderr, flush=True)
+
+    def _drain(self) -> None:
+        while self._buf:
+            batch = []
+            while self._buf and len(batch) < EVENTLOG_BATCH:
+                batch.append(self._buf.popleft())
+            self._write(batch)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(EVENTLOG_FLUSH_S)
+            self._wake.clear()
+            self._drain()
+
+    def flush(self) -> None:
+        """Scrittura sincrona di quanto in buffer (uscita del processo, script batch)."""
+        if self._pid == os.getpid():
+            self._stop.set()
+            self._wake.set()
+            if self._thread is not None and self._thread is not threading.current_thread():
+                self._thread.join(timeout=5)
+            self._drain()
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            self._pid = None  # un emit successivo riparte col thread
+
+
+_LOG = EventLog()
+atexit.register(_LOG.flush)
+
+
+def get_event_log() -> EventLog:
+    return _LOG
+
+
+def emit(kind: str, level: str = "info", **fields: Any) -> None:
+    _LOG.emit(kind, level, **fields)
+
+
+def diag(tag: str, msg: str, level: str = "info", **fields: Any) -> None:
+    """Al posto di print(f"[TAG] ..."): evento "diag" + eco su stdout dal thread di scrittura."""
+    if not EVENTLOG_ENABLE:
+        lvl = "" if level == "info" else f"[{level.upper()}]"
+        print(f"[{tag}]{lvl} {msg}", flush=True)
+        return
+    _LOG.emit("diag", level, tag=tag, msg=msg, **fields)
+
+
+class LoopLag:
+    """Sforamento di asyncio.sleep(interval) sul loop dell'app: (istante, ms) in un ring."""
+
+    def __init__(self, interval_s: float = EVENTLOG_LAG_INTERVAL_S, ring: int = EVENTLOG_LAG_RING) -> None:
+        self.interval_s = interval_s
+        self.samples: Deque[tuple] = deque(maxlen=max(1, ring))
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            t = time.perf_counter()
+            await asyncio.sleep(self.interval_s)
+            now = time.perf_counter()
+            self.samples.append((now, max(0.0, (now - t - self.interval_s) * 1000)))
+
+    def start(self) -> None:
+        """Da chiamare dentro il loop (evento startup); idempotente."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stats(self, window_s: Optional[float] = None) -> Dict[str, Any]:
+        since = time.perf_counter() - window_s if window_s else None
+        vals = sorted(ms for t, ms in list(self.samples) if since is None or t >= since)
+        if not vals:
+            return {"samples": 0, "p50_ms": None, "p99_ms": None, "max_ms": None}
+        pick = lambda p: round(vals[min(len(vals) - 1, int(p / 100.0 * (len(vals) - 1) + 0.5))], 2)
+        return {"samples": len(vals), "p50_ms": pick(50), "p99_ms": pick(99), "max_ms": round(vals[-1], 2)}
+
+
+_LAG = LoopLag()
+
+
+def start_loop_lag() -> None:
+    _LAG.start()
+
+
+def loop_lag_stats(window_s: Optional[float] = None) -> Dict[str, Any]:
+    return _LAG.stats(window_s)
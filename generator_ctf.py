@@ -1,95 +1,125 @@
 # generator_ctf.py
+# Blocchi CTF PARAMETRICI: un blocco per template con slot tipizzati (model, material, lamina),
+# riempiti dalla domanda a runtime (ctf_templates.py). Prima si materializzava ogni combinazione
+# modello × acciaio × lamiera × template: la KB cresceva in modo moltiplicativo a ogni dimensione.
+# I modelli vengono dal catalogo (documenti_gTab/Prodotti_Elenco.txt), non da qui.
 import json
-from itertools import product
-from uuid import uuid4
+import os
 
-families = []
-models = [("CTF020",20),("CTF040",40),("CTF060",60),("CTF080",80)]
-materials = ["S235","S275","S355"]
-laminas = ["no lamiera","1x1.5 mm","2x1.0 mm"]
-questions = []
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_PATH = os.path.join(BASE_DIR, "static", "data", "ctf_templates.json")
 
-# templates
-q_templates = [
-    "Quali sono i codici e modelli dei connettori CTF?",
-    "Come si posa un {model} su trave in acciaio {material} con {lamina}?",
-    "Come tarare P560 per posa di {model} su {material}?",
-    "Come verifico in cantiere che i chiodi HSBR14 di {model} sono entrati correttamente?",
-    "Quali errori evitare nella posa di {model} su {lamina}?"
-]
-
-answers = {
-    "code_list": lambda: ("**CTF – Codici e modelli**\n\n" +
-                         "\n".join([f"- {m[0]}: altezza {m[1]} mm; 2 chiodi HSBR14" for m in models]) +
-                         "\n\nUso: SPIT P560 + kit Tecnaria; nessuna resina."),
-    "posa": lambda model, material, lamina: (f"Posa del {model} su trave {material} con {lamina}:\n"
-                                            "1) Tracciare maglia; 2) pulire; 3) posare piastra; 4) doppia chiodatura P560; "
-                                            "5) verificare piastra aderente; 6) registrare parametri."),
-    "taratura": lambda model, material, lamina: ("Eseguire 2-3 tiri di prova sul medesimo acciaio; verificare sporgenza <1mm; "
-                                                "annotare potenza e lotto."),
-    "verifica": lambda model, material, lamina: ("Controllo visivo e campione: foto, prova di trazione su 10-15 pezzi; "
-                                                 "se >5% non conforme, ritarare."),
-    "errori": lambda model, material, lamina: ("Errori comuni: potenza insufficiente, lamiera non serrata, connettore disassato, colpo a vuoto.")
+# slot tipizzati: "catalog" = codici della sezione CTF del catalogo; "enum" = valori con pattern (regex
+# sulla domanda normalizzata) ed etichetta usata nel testo; "default" se la domanda non lo specifica
+slots = {
+    "model": {"type": "catalog", "section": "CTF", "pattern": r"\bctf\s*-?\s*(\d{2,3})\b"},
+    "material": {
+        "type": "enum",
+        "default": "acciaio da progetto",
+        "values": {
+            "S235": {"pattern": r"\bs\s*-?\s*235\b", "label": "S235"},
+            "S275": {"pattern": r"\bs\s*-?\s*275\b", "label": "S275"},
+            "S355": {"pattern": r"\bs\s*-?\s*355\b", "label": "S355"},
+        },
+    },
+    "lamina": {
+        "type": "enum",
+        "default": "lamiera come da progetto",
+        "values": {
+            "no lamiera": {"pattern": r"\b(no|senza)\s+lamiera\b|\btrave\s+nuda\b|\bdirettamente\s+sulla\s+trave\b",
+                           "label": "senza lamiera (piastra direttamente sulla trave)"},
+            "1x1.5 mm": {"pattern": r"\b1\s*x\s*1[.,]5\b|\blamiera\s+(singola\s+)?(da\s+)?1[.,]5\b",
+                         "label": "una lamiera da 1,5 mm"},
+            "2x1.0 mm": {"pattern": r"\b2\s*x\s*1(?:[.,]0)?(?![.,]?\d)|\b(doppia\s+lamiera|due\s+lamiere)\b",
+                         "label": "due lamiere da 1,0 mm"},
+        },
+    },
 }
 
-out = []
-
-# Add base codici entry
-out.append({
-    "id": "CTF-CODICI-001",
-    "family": "CTF",
-    "question": "Mi dici i codici dei connettori CTF?",
-    "answer": answers["code_list"](),
-    "tags": ["CTF","codici","catalogo"],
-    "source": "gold"
-})
-
-# generate combinations
-ctr = 2
-for model,material,lamina in product([m[0] for m in models], materials, laminas):
-    # pose question
-    out.append({
-        "id": f"CTF-{ctr:04d}",
-        "family": "CTF",
-        "question": q_templates[1].format(model=model, material=material, lamina=lamina),
-        "answer": answers["posa"](model, material, lamina),
-        "tags": ["CTF","posa",model,material,lamina],
-        "source": "gold"
-    })
-    ctr += 1
-
-    out.append({
-        "id": f"CTF-{ctr:04d}",
-        "family": "CTF",
-        "question": q_templates[2].format(model=model, material=material, lamina=lamina),
-        "answer": answers["taratura"](model, material, lamina),
-        "tags": ["P560","taratura",model],
-        "source": "gold"
-    })
-    ctr += 1
-
-    out.append({
-        "id": f"CTF-{ctr:04d}",
-        "family": "CTF",
-        "question": q_templates[3].format(model=model, material=material, lamina=lamina),
-        "answer": answers["verifica"](model, material, lamina),
-        "tags": ["verifica",model],
-        "source": "gold"
-    })
-    ctr += 1
+# radici che escludono TUTTI i template: supporti diversi dalla trave in acciaio, calcolo/verifiche
+# strutturali, geometria di posa e scelta del prodotto hanno blocchi curati nel master (o servono
+# dati che il template non ha)
+excludes = [
+    "legno", "calcestruzz", "cls", "laterocement", "muratur",
+    "interass", "passo", "distanz", "taglio", "resistenz", "portat", "calcol", "fuoco",
+    "sceglier", "scelt", "uso", "usar", "conviene",
+]
 
-    out.append({
-        "id": f"CTF-{ctr:04d}",
-        "family": "CTF",
-        "question": q_templates[4].format(model=model, material=material, lamina=lamina),
-        "answer": answers["errori"](model, material, lamina),
-        "tags": ["errori",model],
-        "source": "gold"
-    })
-    ctr += 1
+# templates (stessi testi del generatore a combinazioni); keywords = radici cercate a inizio parola
+# nella domanda, excludes = radici che escludono il template, priority più alta vince quando più
+# template corrispondono (es. "errori nella posa")
+templates = [
+    {
+        "id": "CTF-TPL-CODICI",
+        "intent": "code_list",
+        "priority": 5,
+        "keywords": ["codic", "modell", "elenco", "catalog"],
+        # chiodi/ricambi/confronti/dimensionamento: blocchi del master
+        "excludes": ["chiod", "p560", "ricamb", "differenz", "quale", "soletta", "spessor"],
+        "requires": [],
+        "question_it": "Quali sono i codici e modelli dei connettori CTF?",
+        "answer_it": ("**CTF – Codici e modelli**\n\n{catalog}\n\n"
+                      "Uso: SPIT P560 + kit Tecnaria; nessuna resina."),
+        "catalog_line": "- {model}: altezza {height} mm; 2 chiodi HSBR14",
+        "tags": ["CTF", "codici", "catalogo"],
+    },
+    {
+        "id": "CTF-TPL-POSA",
+        "intent": "posa",
+        "priority": 10,
+        "keywords": ["posa", "posar", "poso", "montar", "install", "fissar"],
+        "requires": ["model"],
+        "question_it": "Come si posa un {model} su trave in acciaio {material} con {lamina}?",
+        "answer_it": ("Posa del {model} (altezza {height} mm) su trave {material}, {lamina}:\n"
+                      "1) Tracciare maglia; 2) pulire; 3) posare piastra; 4) doppia chiodatura P560; "
+                      "5) verificare piastra aderente; 6) registrare parametri."),
+        "tags": ["CTF", "posa"],
+    },
+    {
+        "id": "CTF-TPL-TARATURA",
+        "intent": "taratura",
+        "priority": 20,
+        "keywords": ["tarar", "taratur", "potenz", "regolar"],
+        "requires": ["model"],
+        "question_it": "Come tarare P560 per posa di {model} su {material}?",
+        "answer_it": ("Taratura P560 per {model} su {material}: eseguire 2-3 tiri di prova sul medesimo acciaio; "
+                      "verificare sporgenza <1mm; annotare potenza e lotto."),
+        "tags": ["P560", "taratura"],
+    },
+    {
+        "id": "CTF-TPL-VERIFICA",
+        "intent": "verifica",
+        "priority": 30,
+        "keywords": ["verific", "controll", "entrat", "collaud"],
+        "requires": ["model"],
+        "question_it": "Come verifico in cantiere che i chiodi HSBR14 di {model} sono entrati correttamente?",
+        "answer_it": ("Verifica chiodatura {model}: controllo visivo e campione: foto, prova di trazione su 10-15 pezzi; "
+                      "se >5% non conforme, ritarare."),
+        "tags": ["verifica"],
+    },
+    {
+        "id": "CTF-TPL-ERRORI",
+        "intent": "errori",
+        "priority": 40,
+        "keywords": ["error", "evitar", "sbagl"],
+        "requires": ["model"],
+        "question_it": "Quali errori evitare nella posa di {model} su {lamina}?",
+        "answer_it": ("Errori da evitare nella posa di {model} ({lamina}): potenza insufficiente, "
+                      "lamiera non serrata, connettore disassato, colpo a vuoto."),
+        "tags": ["errori"],
+    },
+]
 
-# Save
-with open("ctf_gold_generated.json","w",encoding="utf-8") as f:
-    json.dump(out,f,ensure_ascii=False,indent=2)
+out = {
+    "version": 1,
+    "family": "CTF",
+    "catalog": "documenti_gTab/Prodotti_Elenco.txt",
+    "slots": slots,
+    "excludes": excludes,
+    "templates": [dict(t, family="CTF", mode="gold", lang="it") for t in templates],
+}
 
-print("Generated", len(out), "items -> ctf_gold_generated.json")
+if __name__ == "__main__":
+    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
+        json.dump(out, f, ensure_ascii=False, indent=2)
+    print("Generated", len(out["templates"]), "template blocks ->", OUTPUT_PATH)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Job offline: pre-genera le risposte GOLD (SYSTEM_PROMPT_GOLD, stesso modello e
+temperatura del percorso live) per:
+- tutte le question_it dei blocchi del master GOLD
+- le domande più frequenti arrivate al percorso LLM (log eventi, route "llm"/"pregen")
+
+Output: static/data/gold_pregen.json
+    {"prompt_version": "...", "kb_generation": "...", "generated_at": "...",
+     "answers": {"<domanda normalizzata>": {"q": "...", "answer": "...", "kb_id": "...", "origin": "kb"|"log"}}}
+
+app.py lo carica all'avvio solo se prompt_version e kb_generation coincidono con
+quelli correnti: una domanda (normalizzata) presente in tabella ha risposta immediata,
+senza chiamata esterna. Augment e post-check delle regole restano a runtime.
+
+Incrementale: con prompt e KB invariati si generano solo le domande mancanti;
+se cambiano, la tabella riparte da zero. Le chiamate fallite non vengono salvate
+(la riesecuzione le riprova).
+
+Uso:
+    python gold_pregen.py                      # KB + top 200 domande dai log
+    python gold_pregen.py --top 0              # solo KB
+    python gold_pregen.py --concurrency 4 --force
+    python gold_pregen.py --check              # exit 1 se la tabella va rigenerata
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from glob import glob
+
+import app
+import event_log
+
+MIN_LOG_COUNT = 2  # domande viste una volta sola: non vale la pena pre-generarle
+
+
+def load_table():
+    try:
+        with open(app.PREGEN_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        return None
+    return data if isinstance(data, dict) and isinstance(data.get("answers"), dict) else None
+
+
+def is_current(data):
+    return (data is not None
+            and data.get("prompt_version") == app.GOLD_PROMPT_VERSION
+            and data.get("kb_generation") == app.KB_GENERATION)
+
+
+def kb_questions():
+    """domanda normalizzata → (domanda, kb_id, "kb")"""
+    out = {}
+    for b in app.KB_BLOCKS:
+        q = (b.get("question_it") or "").strip()
+        if q:
+            out.setdefault(app.normalize(q), (q, b.get("id"), "kb"))
+    return out
+
+
+def logged_questions(top, log_dir=event_log.EVENTLOG_DIR):
+    """Le `top` domande più frequenti sul percorso LLM nei file NDJSON del log eventi."""
+    if top <= 0:
+        return {}
+    counts = Counter()
+    first = {}
+    for path in glob(os.path.join(log_dir, "events.*.ndjson*")):
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                try:
+                    ev = json.loads(line)
+                except ValueError:
+                    continue
+                if ev.get("kind") != "ask" or ev.get("route") not in ("llm", "pregen") or not ev.get("q"):
+                    continue
+                key = app.normalize(ev["q"])
+                counts[key] += 1
+                first.setdefault(key, (ev["q"], ev.get("kb_id")))
+    return {k: (first[k][0], first[k][1], "log")
+            for k, n in counts.most_common(top) if n >= MIN_LOG_COUNT}
+
+
+def generate(todo, concurrency):
+    """todo: {chiave: (domanda, kb_id, origin)} → {chiave: voce}; concorrenza limitata anche da llm_gateway."""
+    done = {}
+    failed = 0
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+        futs = {ex.submit(app.call_openai_info, app.SYSTEM_PROMPT_GOLD, q, app.GOLD_TEMPERATURE): (k, q, kb_id, origin)
+                for k, (q, kb_id, origin) in todo.items()}
+        for i, fut in enumerate(as_completed(futs), 1):
+            k, q, kb_id, origin = futs[fut]
+            try:
+                answer, info = fut.result()
+            except Exception as e:
+                answer, info = None, {"ok": False}
+                print(f"[PREGEN][WARN] {q[:60]}: {e}")
+            if info.get("ok") and answer:
+                done[k] = {"q": q, "answer": answer, "kb_id": kb_id, "origin": origin}
+            else:
+                failed += 1
+            if i % 20 == 0 or i == len(futs):
+                print(f"[PREGEN] {i}/{len(futs)} ({time.perf_counter() - t0:.0f}s, falliti={failed})")
+    return done, failed
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pre-generazione risposte GOLD")
+    ap.add_argument("--top", type=int, default=200, help="domande più frequenti dai log (0 = nessuna)")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--force", action="store_true", help="rigenera tutto")
+    ap.add_argument("--check", action="store_true", help="solo verifica: exit 1 se da rigenerare")
+    a = ap.parse_args()
+
+    current = load_table()
+    print(f"prompt={app.GOLD_PROMPT_VERSION} kb={app.KB_GENERATION} "
+          f"tabella={'aggiornata' if is_current(current) else 'obsoleta o assente'}")
+
+    targets = logged_questions(a.top)
+    targets.update(kb_questions())  # a parità di chiave vince il blocco KB (kb_id certo)
+    keep = {} if a.force or not is_current(current) else current["answers"]
+    answers = {k: v for k, v in keep.items() if k in targets}
+    todo = {k: v for k, v in targets.items() if k not in answers}
+    print(f"domande: {len(targets)} (kb={sum(1 for v in targets.values() if v[2] == 'kb')}, "
+          f"log={sum(1 for v in targets.values() if v[2] == 'log')}) | riusate={len(answers)} da generare={len(todo)}")
+
+    if a.check:
+        sys.exit(1 if todo else 0)
+    if not todo and is_current(current) and len(answers) == len(current["answers"]):
+        print("niente da fare")
+        return
+    if todo and not app.llm_gateway.is_configured():
+        sys.exit("OPENAI_API_KEY mancante")
+
+    done, failed = generate(todo, a.concurrency)
+    answers.update(done)
+
+    data = {"prompt_version": app.GOLD_PROMPT_VERSION, "kb_generation": app.KB_GENERATION,
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "answers": answers}
+    tmp = app.PREGEN_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp, app.PREGEN_PATH)
+    print(f"generate={len(done)} fallite={failed} totale={len(answers)} → {app.PREGEN_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+guardrails_engine.py
+--------------------
+Motore unico per le regole regex del progetto:
+- rules_meta_ctf_diapason_ctl_vceme.json / sinapsi_brain.json → {id, priority?, pattern, mode, answer}
+  mode="override": risposta curata che sostituisce il motore esterno,
+  mode="augment":  testo aggiunto in coda alla risposta.
+- rules_guardrails.json → post-check domanda/risposta:
+  trigger_any_q / exclude_any_q sulla domanda,
+  require_if_missing_add_note.must_include_a, forbid_a, ensure_any_a sulla risposta.
+
+Tutti i pattern sono registrati in un prefiltro multi-pattern (regex_prefilter):
+per ogni lato (domanda, risposta) si fa UNA scansione del testo e si valutano solo
+le regex le cui ancore compaiono. Il costo resta piatto anche con centinaia di regole.
+
+Uso tipico:
+    eng = get_engine()
+    hit = eng.route(domanda)                       # override / augment
+    risposta, ids = eng.post_check(domanda, risposta, hit.q_hits)   # domanda non riscansionata
+"""
+
+from __future__ import annotations
+from pathlib import Path
+import json
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from regex_prefilter import LiteralPrefilter
+
+_BASE_DIR = Path(__file__).resolve().parent
+_CRITICI_DIR = _BASE_DIR / "static" / "static" / "data" / "critici"
+
+DEFAULT_PATTERN_PATHS = [
+    _BASE_DIR / "rules_meta_ctf_diapason_ctl_vceme.json",
+    _CRITICI_DIR / "sinapsi_brain.json",
+]
+DEFAULT_GUARDRAIL_PATHS = [_BASE_DIR / "rules_guardrails.json"]
+
+MAX_AUGMENT = int(os.getenv("RULES_MAX_AUGMENT", "1"))
+
+
+class PatternRule(NamedTuple):
+    order: int
+    id: str
+    priority: int
+    mode: str
+    lang: str
+    answer: str
+    regex: Any
+
+
+class GuardrailRule(NamedTuple):
+    order: int
+    id: str
+    trigger_q: Tuple[Any, ...]
+    exclude_q: Tuple[Any, ...]
+    must_a: Tuple[Any, ...]
+    must_note: str
+    forbid_a: Tuple[Any, ...]
+    forbid_note: str
+    ensure_a: Tuple[Any, ...]
+    ensure_note: str
+
+
+class RouteResult(NamedTuple):
+    override: Optional[PatternRule]
+    augment: Tuple[PatternRule, ...]
+    # chiavi regex matchate sulla domanda: post_check le riusa senza riscansionare
+    q_hits: frozenset = frozenset()
+
+
+def _load_list(path: Path) -> List[Dict[str, Any]]:
+    if not path.exists():
+        print(f"[RULES][WARN] file regole non trovato: {path}")
+        return []
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"[RULES][WARN] errore lettura {path}: {e}")
+        return []
+    if isinstance(data, dict):
+        data = data.get("rules") or data.get("items") or []
+    return [r for r in data if isinstance(r, dict)]
+
+
+def _compile(pattern: str, flags: int = 0) -> Optional[Any]:
+    try:
+        return re.compile(pattern, flags)
+    except re.error as e:
+        print(f"[RULES][WARN] pattern non valido {pattern!r}: {e}")
+        return None
+
+
+class RuleEngine:
+    """Regole compilate una volta; domanda e risposta scansionate una volta ciascuna."""
+
+    def __init__(self,
+                 pattern_paths: Optional[List[Path]] = None,
+                 guardrail_paths: Optional[List[Path]] = None) -> None:
+        self.patterns: List[PatternRule] = []
+        self.guardrails: List[GuardrailRule] = []
+        # chiavi: ("p", i) pattern rule, ("t"|"x", i, j) trigger/exclude domanda,
+        #         ("m"|"f"|"e", i, j) must/forbid/ensure risposta
+        self._q_filter = LiteralPrefilter()
+        self._a_filter = LiteralPrefilter()
+        self._regex: Dict[Tuple, Any] = {}
+
+        for p in (pattern_paths if pattern_paths is not None else DEFAULT_PATTERN_PATHS):
+            for r in _load_list(Path(p)):
+                self._add_pattern_rule(r)
+        for p in (guardrail_paths if guardrail_paths is not None else DEFAULT_GUARDRAIL_PATHS):
+            for r in _load_list(Path(p)):
+                self._add_guardrail(r)
+        print(f"[RULES] caricate: pattern={len(self.patterns)} guardrail={len(self.guardrails)}")
+
+    # ---- build ----
+    def _add_pattern_rule(self, r: Dict[str, Any]) -> None:
+        rx = _compile(r.get("pattern") or "")
+        if rx is None or not r.get("answer"):
+            return
+        try:
+            priority = int(r.get("priority") or 0)
+        except (TypeError, ValueError):
+            print(f"[RULES][WARN] priority non valida {r.get('priority')!r} nella regola {r.get('id')!r}: scartata")
+            return
+        rule = PatternRule(
+            order=len(self.patterns),
+            id=str(r.get("id") or f"rule-{len(self.patterns)}"),
+            priority=priority,
+            mode=(r.get("mode") or "augment").lower(),
+            lang=(r.get("lang") or "it").lower(),
+            answer=str(r.get("answer")).strip(),
+            regex=rx,
+        )
+        self.patterns.append(rule)
+        key = ("p", rule.order)
+        self._regex[key] = rx
+        self._q_filter.add(key, rx.pattern)
+
+    def _register(self, filt: LiteralPrefilter, kind: str, idx: int, pats: List[str]) -> Tuple[Any, ...]:
+        out = []
+        for j, pat in enumerate(pats or []):
+            rx = _compile(pat, re.IGNORECASE)
+            if rx is None:
+                continue
+            key = (kind, idx, j)
+            self._regex[key] = rx
+            filt.add(key, pat)
+            out.append(key)
+        return tuple(out)
+
+    def _add_guardrail(self, r: Dict[str, Any]) -> None:
+        i = len(self.guardrails)
+        req = r.get("require_if_missing_add_note") or {}
+        self.guardrails.append(GuardrailRule(
+            order=i,
+            id=str(r.get("id") or f"guard-{i}"),
+            trigger_q=self._register(self._q_filter, "t", i, r.get("trigger_any_q")),
+            exclude_q=self._register(self._q_filter, "x", i, r.get("exclude_any_q")),
+            must_a=self._register(self._a_filter, "m", i, req.get("must_include_a")),
+            must_note=str(req.get("note") or "").strip(),
+            forbid_a=self._register(self._a_filter, "f", i, r.get("forbid_a")),
+            forbid_note=str(r.get("forbid_note") or "").strip(),
+            ensure_a=self._register(self._a_filter, "e", i, r.get("ensure_any_a")),
+            ensure_note=str(r.get("ensure_note") or "").strip(),
+        ))
+
+    # ---- match ----
+    def _scan(self, filt: LiteralPrefilter, text: str) -> set:
+        """Una scansione del testo → insieme delle chiavi regex effettivamente matchate."""
+        text = text or ""
+        return {k for k in filt.candidates(text) if self._regex[k].search(text)}
+
+    def route(self, question: str, lang: str = "it") -> RouteResult:
+        """Override a priorità massima (a parità: ordine di caricamento) + augment ordinati."""
+        hits = frozenset(self._scan(self._q_filter, question))
+        matched = [self.patterns[k[1]] for k in hits if k[0] == "p"]
+        matched = [r for r in matched if r.lang == (lang or "it").lower()]
+        matched.sort(key=lambda r: (-r.priority, r.order))
+        override = next((r for r in matched if r.mode == "override"), None)
+        augment = tuple(r for r in matched if r.mode == "augment")[:max(0, MAX_AUGMENT)]
+        return RouteResult(override, augment, hits)
+
+    def post_check(self, question: str, answer: str, q_hits: Optional[frozenset] = None) -> Tuple[str, List[str]]:
+        """
+        Applica i guardrail: note aggiunte in coda, mai testo rimosso.
+        `q_hits` = RouteResult.q_hits della stessa domanda (altrimenti la domanda viene scansionata qui).
+        """
+        if q_hits is None:
+            q_hits = self._scan(self._q_filter, question)
+        active = sorted({k[1] for k in q_hits if k[0] == "t"} - {k[1] for k in q_hits if k[0] == "x"})
+        if not active:
+            return answer, []
+
+        a_hits = self._scan(self._a_filter, answer)
+        notes: List[str] = []
+        applied: List[str] = []
+        for i in active:
+            g = self.guardrails[i]
+            before = len(notes)
+            if g.must_a and g.must_note and not all(k in a_hits for k in g.must_a):
+                notes.append(g.must_note)
+            if g.forbid_a and g.forbid_note and any(k in a_hits for k in g.forbid_a):
+                notes.append(g.forbid_note)
+            if g.ensure_a and g.ensure_note and not any(k in a_hits for k in g.ensure_a):
+                notes.append(g.ensure_note)
+            if len(notes) > before:
+                applied.append(g.id)
+
+        notes = [n for n in dict.fromkeys(notes) if n not in answer]
+        if not notes:
+            return answer, applied
+        return f"{answer.rstrip()}\n\n" + "\n".join(notes), applied
+
+
+_ENGINE: Optional[RuleEngine] = None
+
+
+def get_engine() -> RuleEngine:
+    """Istanza condivisa, compilata al primo uso."""
+    global _ENGINE
+    if _ENGINE is None:
+        _ENGINE = RuleEngine()
+    return _ENGINE
+
+
+def reload_engine() -> RuleEngine:
+    global _ENGINE
+    _ENGINE = RuleEngine()
+    return _ENGINE
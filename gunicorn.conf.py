@@ -0,0 +1,19 @@
+# gunicorn.conf.py — avvio: app importata e scaldata nel master, poi fork dei worker
+# (modello lingua, trie, regex e moduli pesanti condivisi copy-on-write).
+import os
+
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+
+def when_ready(server):
+    # chiamato nel master dopo il preload dell'app, prima del fork dei worker
+    import startup
+    startup.warmup()
+    rep = startup.report()
+    server.log.info("startup: ready=%s by_phase_ms=%s", rep["ready"], rep["by_phase_ms"])
+    for s in rep["steps"]:
+        server.log.info("startup: %-8s %-45s %8.2f ms", s["phase"], s["name"], s["ms"])
+    # log eventi: buffer scritto e thread fermato prima del fork (ogni worker riparte col suo)
+    import event_log
+    event_log.get_event_log().flush()
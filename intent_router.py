@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+intent_router.py
+----------------
+Router di intenti deterministico per GET /api/ask (tecnaria_api).
+
+Le frasi-trigger di static/data/index_tecnaria.json e dei file famiglia
+(CTL, CTL_MAXI, CTCEM, VCEM, DIAPASON, COMM, tecnaria_gold) vengono normalizzate
+(scraper_tecnaria.normalize_text) e compilate in un trie per token. La domanda
+viene percorsa una volta da ogni posizione: costo proporzionale alla lunghezza
+della domanda, non al numero di frasi → ben sotto il millisecondo.
+
+Punteggio di un intento = massimo tra
+- frase intera: peso × (token della domanda coperti dalle sue frasi / token della domanda);
+- sovrapposizione parziale: peso × Dice pesato IDF tra token della domanda e token della frase
+  (2·Σidf(comuni) / (Σidf(domanda) + Σidf(frase))), calcolato via indice invertito token → frasi;
+  i token della domanda assenti dal vocabolario pesano come i più rari.
+A parità vince la frase più lunga, poi la sorgente più specifica (index > file famiglia).
+L'HTML della risposta è pre-renderizzato in fase di build.
+"""
+
+from __future__ import annotations
+import html
+import json
+import math
+import os
+import re
+from collections import defaultdict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from scraper_tecnaria import normalize_text
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(_BASE_DIR, "static", "data")
+
+INDEX_FILE = "index_tecnaria.json"
+FAMILY_FILES = ["tecnaria_gold.json", "COMM.json", "CTL.json", "CTL_MAXI.json",
+                "CTCEM.json", "VCEM.json", "DIAPASON.json"]
+
+MIN_SCORE = float(os.getenv("INTENT_MIN_SCORE", "0.25"))
+
+# peso per tipo di frase (i trigger curati contano più dei tag generici)
+W_TRIGGER = 1.0
+W_QUESTION = 0.9
+W_TAG = 0.5
+
+_BOLD = re.compile(r"\*\*(.+?)\*\*")
+
+
+class Intent(NamedTuple):
+    order: int
+    id: str
+    family: str
+    intent: str
+    source: str
+    text: str
+    html: str
+
+
+def render_html(text: str) -> str:
+    """Testo → HTML: escape, **grassetto**, paragrafi su riga vuota, <br> sugli a capo."""
+    paras = [p.strip() for p in re.split(r"\n\s*\n", text or "") if p.strip()]
+    out = []
+    for p in paras:
+        p = _BOLD.sub(r"<strong>\1</strong>", html.escape(p))
+        out.append("<p>" + p.replace("\n", "<br>") + "</p>")
+    return "".join(out)
+
+
+def _answer_text(item: Dict[str, Any]) -> str:
+    for k in ("answer_it", "gold_answer_it", "risposta", "answer"):
+        if isinstance(item.get(k), str) and item[k].strip():
+            return item[k].strip()
+    rv = item.get("response_variants") or {}
+    gold = rv.get("gold")
+    if isinstance(gold, dict) and gold.get("it"):
+        return str(gold["it"]).strip()
+    if isinstance(gold, str) and gold.strip():
+        return gold.strip()
+    for v in rv.values():
+        if isinstance(v, str) and v.strip():
+            return v.strip()
+    return ""
+
+
+def _phrases(item: Dict[str, Any]) -> List[Tuple[str, float]]:
+    out: List[Tuple[str, float]] = []
+    trig = item.get("triggers")
+    if isinstance(trig, list):
+        out += [(t, W_TRIGGER) for t in trig if isinstance(t, str)]
+    trig = item.get("trigger")
+    if isinstance(trig, dict):
+        w = float(trig.get("peso") or 1.0)
+        out += [(t, W_TRIGGER * w) for t in trig.get("keywords") or [] if isinstance(t, str)]
+    for k in ("question_it", "question", "domanda"):
+        if isinstance(item.get(k), str):
+            out.append((item[k], W_QUESTION))
+    out += [(q, W_QUESTION) for q in item.get("question_examples") or [] if isinstance(q, str)]
+    out += [(t.replace("-", " "), W_TAG) for t in item.get("tags") or [] if isinstance(t, str)]
+    return out
+
+
+def _items(data: Any) -> List[Dict[str, Any]]:
+    if isinstance(data, dict):
+        data = data.get("items") or data.get("blocks") or []
+    return [i for i in data if isinstance(i, dict) and i.get("id")] if isinstance(data, list) else []
+
+
+class IntentRouter:
+    """Trie per token: nodo = dict {token: nodo}, terminale in nodo[_END] = [(intent, peso, n_token)]."""
+
+    _END = "\x00"
+
+    def __init__(self, data_dir: str = DATA_DIR) -> None:
+        self.intents: List[Intent] = []
+        self.bag: Dict[str, Any] = {}
+        self.phrases = 0
+        self._root: Dict[str, Any] = {}
+        self._by_id: Dict[str, int] = {}
+        # indice invertito per il punteggio parziale: token → id frase; frase = (intento, peso, n_token, massa IDF)
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        self._ptoks: List[Tuple[int, float, frozenset]] = []
+        self._pmeta: List[Tuple[int, float, int, float]] = []
+        self._idf: Dict[str, float] = {}
+        self._idf_unk = 0.0
+
+        for name in [INDEX_FILE] + FAMILY_FILES:
+            path = os.path.join(data_dir, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.bag[name] = json.load(f)
+            except Exception as e:
+                print(f"[INTENT][WARN] {name}: {e}")
+                continue
+            for item in _items(self.bag[name]):
+                self._add(name, item)
+        self._build_idf()
+        print(f"[INTENT] intenti={len(self.intents)} frasi={self.phrases} file={len(self.bag)}")
+
+    def _add(self, source: str, item: Dict[str, Any]) -> None:
+        iid = str(item["id"])
+        idx = self._by_id.get(iid)
+        if idx is None:
+            text = _answer_text(item)
+            tags = item.get("tags") or []
+            intent = item.get("intent") or item.get("topic") or (tags[0] if tags else "") or ""
+            idx = len(self.intents)
+            self.intents.append(Intent(idx, iid, str(item.get("family") or ""), str(intent),
+                                       source, text, render_html(text)))
+            self._by_id[iid] = idx
+        elif not self.intents[idx].text:
+            # stesso id in un file famiglia: completa la risposta mancante (es. voci di index_tecnaria)
+            text = _answer_text(item)
+            if text:
+                self.intents[idx] = self.intents[idx]._replace(text=text, html=render_html(text))
+
+        for phrase, w in _phrases(item):
+            toks = normalize_text(phrase).split()
+            if not toks:
+                continue
+            node = self._root
+            for t in toks:
+                node = node.setdefault(t, {})
+            node.setdefault(self._END, []).append((idx, w, len(toks)))
+            self.phrases += 1
+            pid = len(self._ptoks)
+            uniq = frozenset(toks)
+            self._ptoks.append((idx, w, uniq))
+            for t in uniq:
+                self._postings[t].append(pid)
+
+    def _build_idf(self) -> None:
+        n = len(self._ptoks)
+        self._idf = {t: math.log(1 + n / len(pids)) for t, pids in self._postings.items()}
+        self._idf_unk = math.log(1 + n) if n else 0.0
+        self._pmeta = [(idx, w, len(toks), sum(self._idf[t] for t in toks))
+                       for idx, w, toks in self._ptoks]
+        self._postings = dict(self._postings)
+
+    def _partial(self, toks: List[str]) -> Dict[int, Tuple[float, int]]:
+        """Intento → (miglior punteggio di sovrapposizione parziale, lunghezza di quella frase)."""
+        qset = set(toks)
+        qmass = sum(self._idf.get(t, self._idf_unk) for t in qset)
+        common: Dict[int, float] = defaultdict(float)
+        for t in qset:
+            for pid in self._postings.get(t, ()):
+                common[pid] += self._idf[t]
+        best: Dict[int, Tuple[float, int]] = {}
+        for pid, ov in common.items():
+            idx, w, n, pmass = self._pmeta[pid]
+            score = w * 2.0 * ov / (qmass + pmass)
+            if score > best.get(idx, (0.0, 0))[0]:
+                best[idx] = (score, n)
+        return best
+
+    def route(self, question: str) -> Optional[Dict[str, Any]]:
+        toks = normalize_text(question).split()
+        if not toks:
+            return None
+        # intento → (posizioni coperte, peso massimo, frase più lunga)
+        cover: Dict[int, Tuple[set, float, int]] = {}
+        end = self._END
+        for i in range(len(toks)):
+            node = self._root
+            for j in range(i, len(toks)):
+                node = node.get(toks[j])
+                if node is None:
+                    break
+                for idx, w, n in node.get(end, ()):
+                    pos, bw, bl = cover.get(idx) or (set(), 0.0, 0)
+                    pos.update(range(i, j + 1))
+                    cover[idx] = (pos, max(bw, w), max(bl, n))
+
+        # intento → (punteggio, frase più lunga): frase intera o sovrapposizione parziale, il migliore
+        cand = self._partial(toks)
+        for idx, (pos, w, longest) in cover.items():
+            full = w * len(pos) / len(toks)
+            score, n = cand.get(idx, (0.0, 0))
+            cand[idx] = (max(full, score), max(longest, n))
+        if not cand:
+            return None
+
+        idx, (score, _) = min(cand.items(), key=lambda kv: (-kv[1][0], -kv[1][1], kv[0]))
+        score = round(score, 4)
+        if score < MIN_SCORE:
+            return None
+        it = self.intents[idx]
+        return {"match_id": it.id, "family": it.family, "intent": it.intent, "score": score,
+                "text": it.text, "html": it.html, "lang": "it", "source": it.source}
+
+
+_ROUTER: Optional[IntentRouter] = None
+
+
+def get_router() -> IntentRouter:
+    global _ROUTER
+    if _ROUTER is None:
+        _ROUTER = IntentRouter()
+    return _ROUTER
+
+
+def reload_router() -> IntentRouter:
+    global _ROUTER
+    _ROUTER = IntentRouter()
+    return _ROUTER
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+json_fragments.py
+-----------------
+Serializzazione JSON veloce per le API (orjson) + frammenti pre-codificati.
+
+Le risposte GOLD/COMM sono stringhe fisse note al caricamento: le codifichiamo una
+volta (fragment) e a ogni richiesta il corpo viene solo concatenato (assemble),
+senza validazione Pydantic né encoder JSON sul testo lungo.
+
+    FRAG = fragment(risposta)                       # al load
+    body = assemble(answer=FRAG, source="json_comm", meta={"comm_id": cid})
+    return RawJSONResponse(body)
+"""
+
+from __future__ import annotations
+from functools import lru_cache
+from typing import Any
+
+from fastapi.responses import JSONResponse, Response
+
+from jsonfast import dumps  # riesportato: dumps serve anche fuori dalle API (event_log)
+
+
+class Fragment(bytes):
+    """JSON già codificato: assemble() lo inserisce così com'è."""
+
+
+def fragment(obj: Any) -> Fragment:
+    return Fragment(dumps(obj))
+
+
+@lru_cache(maxsize=2048)
+def cached_fragment(text: str) -> Fragment:
+    """Stringhe fisse riusate (risposte curate, intenti): stesso oggetto str → hash in cache, bytes pronti."""
+    return fragment(text)
+
+
+def assemble(**fields: Any) -> bytes:
+    """Oggetto JSON da campi: i Fragment sono copiati, il resto codificato al volo."""
+    parts = []
+    for k, v in fields.items():
+        parts.append(dumps(k) + b":" + (v if isinstance(v, Fragment) else dumps(v)))
+    return b"{" + b",".join(parts) + b"}"
+
+
+class FastJSONResponse(JSONResponse):
+    """default_response_class delle app: orjson al posto dell'encoder stdlib."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RawJSONResponse(Response):
+    """Corpo già serializzato (bytes da assemble)."""
+
+    media_type = "application/json"
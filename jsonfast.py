@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+jsonfast.py
+-----------
+dumps() JSON compatto in bytes: orjson se disponibile, altrimenti stdlib.
+
+Senza dipendenze web: lo usano event_log (e quindi scraper, cache LLM, tool CLI,
+worker di parsing) senza caricare fastapi. json_fragments lo riesporta per le API.
+"""
+
+from __future__ import annotations
+import json
+from typing import Any
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
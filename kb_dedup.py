@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+kb_dedup.py
+-----------
+Quasi-duplicati tra blocchi KB con MinHash + LSH (tempo sub-quadratico).
+
+Documento di un blocco = question_it + triggers + answer_it (o domanda/risposta), normalizzato;
+insieme di shingle = k-grammi di parole (k=3). Firma MinHash di NUM_PERM
+permutazioni; LSH a bande (BANDS × ROWS): due blocchi diventano candidati
+solo se coincidono su almeno una banda, poi la Jaccard stimata dalle firme
+deve superare la soglia. Cluster = componenti connesse (union-find).
+
+Canonico suggerito di un cluster = medoide (massima similarità media con gli
+altri membri); a parità, il blocco più ricco (trigger + lunghezza risposta).
+
+Uso offline (sorgenti di merge_ctf_kb: master + overlays + patches):
+    python kb_dedup.py                       # report su stdout + static/data/kb_dedup.report.json
+    python kb_dedup.py --threshold 0.7 --extra static/data/tecnaria_gold.json
+
+A indice: cluster_map(blocchi) → id del blocco ("CTF-0015") → id del canonico;
+applastversion la usa per far contribuire ogni cluster con un solo candidato al
+rerank. Chiavi stringa, non id() Python: la mappa resta valida anche se i dict
+dei blocchi vengono ricreati (reload).
+
+Env: KB_DEDUP_THRESHOLD (0.8)
+"""
+
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import re
+import struct
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+THRESHOLD = float(os.getenv("KB_DEDUP_THRESHOLD", "0.8"))
+NUM_PERM = 128
+BANDS, ROWS = 32, 4  # soglia LSH ≈ (1/32)^(1/4) ≈ 0.42: ampia, il filtro vero è la Jaccard stimata
+SHINGLE_K = 3
+_MERSENNE = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+_WORD = re.compile(r"[0-9a-zàèéìòóùç]+")
+
+
+def _perms(num_perm: int = NUM_PERM, seed: int = 1):
+    """Coefficienti (a, b) delle permutazioni, deterministici: firme confrontabili tra esecuzioni."""
+    out, i = [], 0
+    while len(out) < num_perm:
+        d = hashlib.sha256(f"{seed}:{i}".encode()).digest()
+        a, b = struct.unpack("<QQ", d[:16])
+        out.append(((a % (_MERSENNE - 1)) + 1, b % _MERSENNE))
+        i += 1
+    return out
+
+
+_PERMS = _perms()
+if np is not None:
+    _PA = np.array([a for a, _ in _PERMS], dtype=np.uint64)
+    _PB = np.array([b for _, b in _PERMS], dtype=np.uint64)
+
+
+def block_text(block: Dict[str, Any]) -> str:
+    return " ".join([
+        block.get("question_it") or block.get("question") or block.get("domanda") or "",
+        " ".join(block.get("triggers") or []),
+        block.get("answer_it") or block.get("answer") or block.get("risposta") or "",
+    ])
+
+
+def shingles(text: str, k: int = SHINGLE_K) -> List[int]:
+    words = _WORD.findall(text.lower())
+    if len(words) < k:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + k]) for i in range(len(words) - k + 1)]
+    return sorted({struct.unpack("<I", hashlib.blake2b(g.encode("utf-8"), digest_size=4).digest())[0]
+                   for g in grams})
+
+
+def minhash(sh: Sequence[int]) -> Tuple[int, ...]:
+    if not sh:
+        return tuple([_MAX_HASH] * NUM_PERM)
+    if np is not None:
+        h = np.array(sh, dtype=np.uint64)[:, None]
+        # (a*h + b) mod p con a < 2^61 e h < 2^32: il prodotto sta nei 64 bit solo modulo 2^64,
+        # come in datasketch; per una famiglia di hash va bene uguale
+        v = ((h * _PA + _PB) % np.uint64(_MERSENNE)) & np.uint64(_MAX_HASH)
+        return tuple(int(x) for x in v.min(axis=0))
+    mask = (1 << 64) - 1
+    return tuple(min(((((a * x) & mask) + b) & mask) % _MERSENNE & _MAX_HASH for x in sh) for a, b in _PERMS)
+
+
+def jaccard_est(s1: Sequence[int], s2: Sequence[int]) -> float:
+    return sum(1 for x, y in zip(s1, s2) if x == y) / len(s1)
+
+
+class _UF:
+    def __init__(self, n: int) -> None:
+        self.p = list(range(n))
+
+    def find(self, x: int) -> int:
+        while self.p[x] != x:
+            self.p[x] = self.p[self.p[x]]
+            x = self.p[x]
+        return x
+
+    def union(self, a: int, b: int) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.p[max(ra, rb)] = min(ra, rb)
+
+
+def _richness(block: Dict[str, Any]) -> Tuple[int, int]:
+    return len(block.get("triggers") or []), len(block.get("answer_it") or block.get("answer") or "")
+
+
+def find_clusters(blocks: List[Dict[str, Any]], threshold: float = THRESHOLD) -> List[Dict[str, Any]]:
+    """
+    Cluster di quasi-duplicati (solo quelli con ≥ 2 membri):
+    [{"canonical": i, "members": [i, ...], "similarity": {i: jaccard col canonico}}]  (i = indice in blocks)
+    """
+    sigs = [minhash(shingles(block_text(b))) for b in blocks]
+    empty = tuple([_MAX_HASH] * NUM_PERM)  # blocco senza testo: firma identica per tutti, mai in cluster
+    uf = _UF(len(blocks))
+    pairs: Dict[Tuple[int, int], float] = {}
+    for band in range(BANDS):
+        lo = band * ROWS
+        buckets: Dict[Tuple[int, ...], List[int]] = {}
+        for i, s in enumerate(sigs):
+            if s == empty:
+                continue
+            buckets.setdefault(s[lo:lo + ROWS], []).append(i)
+        for idx in buckets.values():
+            if len(idx) < 2:
+                continue
+            for x in range(len(idx)):
+                for y in range(x + 1, len(idx)):
+                    key = (idx[x], idx[y])
+                    if key in pairs:
+                        continue
+                    j = pairs[key] = jaccard_est(sigs[key[0]], sigs[key[1]])
+                    if j >= threshold:
+                        uf.union(*key)
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(blocks)):
+        groups.setdefault(uf.find(i), []).append(i)
+
+    out = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        sim = {(a, b): jaccard_est(sigs[a], sigs[b]) for a in members for b in members if a != b}
+        canonical = max(members, key=lambda m: (sum(sim[(m, o)] for o in members if o != m), _richness(blocks[m])))
+        out.append({"canonical": canonical, "members": sorted(members),
+                    "similarity": {m: round(sim[(canonical, m)], 3) for m in members if m != canonical}})
+    out.sort(key=lambda c: (-len(c["members"]), c["canonical"]))
+    return out
+
+
+def cluster_map(blocks: List[Dict[str, Any]], threshold: float = THRESHOLD) -> Dict[str, str]:
+    """
+    id del blocco → id del canonico, solo per i blocchi in un cluster. Blocchi senza
+    id, o con id ripetuto tra più blocchi, restano fuori (mai collassati).
+    """
+    counts: Dict[str, int] = {}
+    for b in blocks:
+        if b.get("id"):
+            counts[b["id"]] = counts.get(b["id"], 0) + 1
+    out: Dict[str, str] = {}
+    for c in find_clusters(blocks, threshold):
+        members = [blocks[m]["id"] for m in c["members"] if counts.get(blocks[m].get("id")) == 1]
+        if len(members) < 2:
+            continue
+        canon = blocks[c["canonical"]].get("id")
+        canon = canon if canon in members else members[0]
+        for bid in members:
+            out[bid] = canon
+    return out
+
+
+def collapse_scored(scored: Iterable[Tuple[float, Dict[str, Any]]],
+                    clusters: Dict[str, str]) -> List[Tuple[float, Dict[str, Any]]]:
+    """Candidati (punteggio, blocco) già ordinati: un solo candidato per cluster, il primo (migliore)."""
+    seen = set()
+    out = []
+    for s, b in scored:
+        bid = b.get("id")
+        key = clusters.get(bid, bid) if bid else id(b)
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append((s, b))
+    return out
+
+
+# ============================================================
+# CLI (offline)
+# ============================================================
+
+def _load_blocks(extra: List[str]) -> List[Dict[str, Any]]:
+    import merge_ctf_kb
+    blocks, _ = merge_ctf_kb.compile_kb(merge_ctf_kb.iter_sources(merge_ctf_kb.source_files()))
+    for p in extra:
+        data = merge_ctf_kb.load_json(p)
+        for raw in merge_ctf_kb._entries(data):
+            b = merge_ctf_kb.normalize_block(raw)
+            if b and b.get("id"):
+                b["_source"] = os.path.basename(p)
+                blocks.append(b)
+    return blocks
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Quasi-duplicati KB (MinHash + LSH)")
+    ap.add_argument("--threshold", type=float, default=THRESHOLD)
+    ap.add_argument("--extra", action="append", default=[], help="altri file di blocchi (es. static/data/tecnaria_gold.json)")
+    ap.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                  "static", "data", "kb_dedup.report.json"))
+    a = ap.parse_args()
+
+    blocks = _load_blocks(a.extra)
+    t0 = time.perf_counter()
+    clusters = find_clusters(blocks, a.threshold)
+    dt = time.perf_counter() - t0
+
+    report = {
+        "threshold": a.threshold, "num_perm": NUM_PERM, "bands": BANDS, "rows": ROWS,
+        "blocks": len(blocks), "clusters": len(clusters),
+        "collapsible": sum(len(c["members"]) - 1 for c in clusters),
+        "items": [{
+            "canonical": blocks[c["canonical"]]["id"],
+            "members": [{"id": blocks[m]["id"], "family": blocks[m].get("family"),
+                         "similarity": c["similarity"].get(m, 1.0)} for m in c["members"]],
+        } for c in clusters],
+    }
+    os.makedirs(os.path.dirname(a.out), exist_ok=True)
+    with open(a.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"blocchi={len(blocks)} cluster={len(clusters)} collassabili={report['collapsible']} "
+          f"soglia={a.threshold} ({dt * 1000:.0f} ms, numpy={'sì' if np is not None else 'no'})")
+    for it in report["items"][:30]:
+        others = ", ".join(f"{m['id']}({m['similarity']})" for m in it["members"] if m["id"] != it["canonical"])
+        print(f"  [{it['canonical']}] ← {others}")
+    print(f"report → {a.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,9 @@ fornisce utility per:
 - costruire una "nota tecnica" pronta da appendere sotto la risposta di ChatGPT,
 - arricchire automaticamente una risposta con le note tecniche quando disponibili.
 
+Il catalogo viene compilato una volta per generazione (mtime) del JSON in mappe
+nome esatto / sigla+misura ("CTF 12/40" == "CTF040") / token, con note memoizzate.
+
 Dipendenze: solo libreria standard.
 Posizionare questo file nella root del progetto `Tecnaria_V3/` oppure in un package importabile.
 """
@@ -71,6 +74,36 @@ def load_connettori_data(json_path: Optional[Path] = None) -> Dict[str, Any]:
     return _CACHE["data"]
 
 
+_SIGLAS = {"ctf", "ctl", "gts", "vcem", "vceme", "ctcem", "minicem", "nanoceme", "diapason", "omega"}
+_BOOST_SIGLAS = ["ctf", "ctl", "gts", "vcem", "vceme", "ctcem"]
+_BOOST_PREFIXES = tuple(["ctf", "ctl", "gts", "v cem", "v cem-e", "ct cem"])
+
+# "CTF 12/40", "ctf040", "CTLB 060", "ctl maxi 12/040" → (sigla, variante, diametro, altezza)
+_SIGLA_SIZE_RE = re.compile(
+    r"\b(ctf|ctlb|ctlm|ctl|gts|vceme|vcem|ctcem|minicem|nanoceme|diapason|omega)"
+    r"(?:\s*[-_]?\s*(maxi|base))?\s*[-_]?\s*(?:(\d{1,3})\s*/\s*)?(\d{2,3})\b"
+)
+_SIGLA_VARIANT = {"ctlb": ("ctl", "base"), "ctlm": ("ctl", "maxi")}
+_AMBIGUOUS = -1
+
+
+def _sigla_size_keys(text: str) -> List[str]:
+    """
+    Chiavi canoniche sigla+variante(+diametro)+misura, dalla più specifica:
+    'CTL MAXI 12/040' → ['ctl-maxi:12:40', 'ctl-maxi:40']; 'CTF040' → ['ctf:40'].
+    BASE e MAXI (e diametri diversi) non collidono mai sulla chiave completa.
+    """
+    m = _SIGLA_SIZE_RE.search(text.lower())
+    if not m:
+        return []
+    sigla, variant = _SIGLA_VARIANT.get(m.group(1), (m.group(1), None))
+    variant = m.group(2) or variant
+    stem = f"{sigla}-{variant}" if variant else sigla
+    height = int(m.group(4))
+    keys = [f"{stem}:{int(m.group(3))}:{height}"] if m.group(3) else []
+    return keys + [f"{stem}:{height}"]
+
+
 def _score_candidate(query_tokens: List[str], name: str) -> float:
     """
     Scoring semplice per il matching:
@@ -81,13 +114,117 @@ def _score_candidate(query_tokens: List[str], name: str) -> float:
     overlap = len(set(query_tokens) & set(name_tokens))
     exact_bonus = 1.0 if _normalize(" ".join(query_tokens)) == _normalize(name) else 0.0
     # Bonus per coppie "sigla + numero" tipiche: CTF, CTL, GTS e altezze/diametri
-    siglas = {"ctf", "ctl", "gts", "vcem", "vceme", "ctcem", "minicem", "nanoceme", "diapason", "omega"}
     bonus = 0.0
-    if any(s in query_tokens for s in siglas) and any(t.isdigit() for t in query_tokens):
+    if any(s in query_tokens for s in _SIGLAS) and any(t.isdigit() for t in query_tokens):
         bonus += 0.5
     return overlap + exact_bonus + bonus
 
 
+class _CatalogIndex:
+    """
+    Catalogo compilato una volta per generazione (mtime) del JSON:
+    - exact:  nome normalizzato → connettore
+    - sized:  sigla+variante(+diametro)+misura ('ctf:40', 'ctl-maxi:12:40') → connettore;
+              chiavi condivise da più connettori sono ambigue e passano allo scoring
+    - tokens: token del nome → posizioni dei connettori
+    - note tecniche renderizzate una sola volta per connettore.
+    """
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.data = data
+        self.items: List[Dict[str, Any]] = list(data.get("connettori", []) or [])
+        self.exact: Dict[str, int] = {}
+        self.sized: Dict[str, int] = {}
+        self.tokens: Dict[str, List[int]] = {}
+        self.name_norm: List[str] = []
+        self.name_tokens: List[frozenset] = []
+        self.boostable: List[bool] = []
+        self._notes: Dict[int, str] = {}
+
+        for i, c in enumerate(self.items):
+            name = c.get("name", "") or ""
+            norm = _normalize(name)
+            toks = frozenset(_tokenize(name))
+            self.name_norm.append(norm)
+            self.name_tokens.append(toks)
+            self.boostable.append(name.lower().startswith(_BOOST_PREFIXES))
+            self.exact.setdefault(norm, i)
+            for key in _sigla_size_keys(name):
+                j = self.sized.get(key)
+                if j is None:
+                    self.sized[key] = i
+                elif j != _AMBIGUOUS and norm != self.name_norm[j]:
+                    self.sized[key] = _AMBIGUOUS
+            for t in toks:
+                self.tokens.setdefault(t, []).append(i)
+
+        # miglior candidato "senza overlap" (a parità di punteggio vince l'ordine del file)
+        self.first_any = 0 if self.items else None
+        self.first_boostable = next((i for i, b in enumerate(self.boostable) if b), None)
+
+    def find(self, query: str) -> Optional[Dict[str, Any]]:
+        if not self.items:
+            return None
+
+        # 1) Match esatto su normalizzato
+        i = self.exact.get(_normalize(query))
+        if i is not None:
+            return self.items[i]
+
+        # 2) Sigla + variante + misura (CTF 12/40 == CTF040); chiave ambigua → scoring
+        for key in _sigla_size_keys(query):
+            j = self.sized.get(key)
+            if j is not None:
+                if j != _AMBIGUOUS:
+                    return self.items[j]
+                break
+
+        # 3) Best score su overlap token, solo sui connettori che condividono token
+        q_tokens = _tokenize(query)
+        q_set = set(q_tokens)
+        q_norm = _normalize(" ".join(q_tokens))
+        base = 0.0
+        if not q_set.isdisjoint(_SIGLAS) and any(t.isdigit() for t in q_tokens):
+            base += 0.5
+        sig_boost = not q_set.isdisjoint(_BOOST_SIGLAS)
+
+        cand = sorted({j for t in q_set for j in self.tokens.get(t, ())})
+        # senza overlap il punteggio vale solo i bonus: basta il primo di ciascun gruppo
+        extra = [j for j in (self.first_any if base > 0 else None,
+                             self.first_boostable if sig_boost else None) if j is not None]
+        if extra:
+            cand = sorted(set(cand).union(extra))
+
+        best_i, best_s = None, 0.0
+        for j in cand:
+            score = len(q_set & self.name_tokens[j]) + base
+            if q_norm == self.name_norm[j]:
+                score += 1.0
+            if sig_boost and self.boostable[j]:
+                score += 0.25
+            if score > best_s:
+                best_i, best_s = j, score
+        return self.items[best_i] if best_i is not None else None
+
+    def nota(self, c: Dict[str, Any]) -> str:
+        key = id(c)
+        nota = self._notes.get(key)
+        if nota is None:
+            nota = build_nota_tecnica(c)
+            self._notes[key] = nota
+        return nota
+
+
+_INDEX_CACHE: Dict[str, Any] = {"data": None, "index": None}
+
+
+def _catalog_index(data: Dict[str, Any]) -> _CatalogIndex:
+    """Indice del catalogo, ricompilato solo quando cambia il dict dati (cioè l'mtime)."""
+    if _INDEX_CACHE["data"] is not data:
+        _INDEX_CACHE.update({"data": data, "index": _CatalogIndex(data)})
+    return _INDEX_CACHE["index"]
+
+
 def find_connettore(query_or_name: str, data: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
     """
     Trova il connettore più pertinente rispetto a una query o un nome.
@@ -96,28 +233,7 @@ def find_connettore(query_or_name: str, data: Optional[Dict[str, Any]] = None) -
     if not query_or_name:
         return None
     data = data or load_connettori_data()
-    items = data.get("connettori", [])
-    q_tokens = _tokenize(query_or_name)
-
-    # 1) Match esatto su normalizzato
-    target_norm = _normalize(query_or_name)
-    for c in items:
-        if _normalize(c.get("name", "")) == target_norm:
-            return c
-
-    # 2) Best score su overlap token
-    scored: List[Tuple[float, Dict[str, Any]]] = []
-    for c in items:
-        score = _score_candidate(q_tokens, c.get("name", ""))
-        # leggero boost se la sigla coincide (es. "ctf" in query e "CTF 12/40" nel nome)
-        if any(sig in q_tokens for sig in ["ctf", "ctl", "gts", "vcem", "vceme", "ctcem"]) and \
-           c.get("name", "").lower().startswith(tuple(["ctf", "ctl", "gts", "v cem", "v cem-e", "ct cem"])):
-            score += 0.25
-        scored.append((score, c))
-
-    scored.sort(key=lambda x: x[0], reverse=True)
-    best = scored[0][1] if scored and scored[0][0] > 0 else None
-    return best
+    return _catalog_index(data).find(query_or_name)
 
 
 def build_nota_tecnica(c: Dict[str, Any]) -> str:
@@ -193,7 +309,7 @@ def enrich_response_with_internal_notes(answer: str,
     if not connettore:
         return answer
 
-    nota = build_nota_tecnica(connettore)
+    nota = _catalog_index(data).nota(connettore)
     if not nota.strip():
         return answer
 
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+lang_id.py
+----------
+Identificazione lingua offline con il modello fastText `lid.176.ftz` incluso nel repo.
+
+- modello caricato una sola volta per processo; chiamando warmup() prima del fork
+  (gunicorn --preload) le pagine del modello restano condivise tra i worker
+- detect_lang(testo) / detect_batch(testi): microsecondi, deterministico
+- cache LRU sui testi ripetuti (stesse domande)
+- dipendenza soft: senza `fasttext` si ripiega su langdetect (seed fisso) e poi sul default
+
+Env: LID_MODEL_PATH (default ./lid.176.ftz), LID_MIN_CONFIDENCE (default 0.40),
+     LID_CACHE_SIZE (default 4096)
+"""
+
+from __future__ import annotations
+import os
+import threading
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.getenv("LID_MODEL_PATH", os.path.join(_BASE_DIR, "lid.176.ftz"))
+MIN_CONFIDENCE = float(os.getenv("LID_MIN_CONFIDENCE", "0.40"))
+CACHE_SIZE = int(os.getenv("LID_CACHE_SIZE", "4096"))
+
+_MODEL = None
+_MODEL_LOCK = threading.Lock()
+_MODEL_FAILED = False
+
+
+def _import_fasttext():
+    # import lazy: fasttext porta con sé numpy, non serve finché non si classifica
+    try:
+        import fasttext
+        # fastText stampa un warning su stderr a ogni load_model: silenziato
+        fasttext.FastText.eprint = lambda *a, **k: None
+        return fasttext
+    except Exception:
+        return None
+
+
+def _model():
+    global _MODEL, _MODEL_FAILED
+    if _MODEL is None and not _MODEL_FAILED:
+        with _MODEL_LOCK:
+            if _MODEL is None and not _MODEL_FAILED:
+                fasttext = _import_fasttext()
+                if fasttext is None or not os.path.exists(MODEL_PATH):
+                    print(f"[LID][WARN] fastText non disponibile (modulo={fasttext is not None}, file={MODEL_PATH})")
+                    _MODEL_FAILED = True
+                else:
+                    _MODEL = fasttext.load_model(MODEL_PATH)
+    return _MODEL
+
+
+def warmup() -> bool:
+    """Carica il modello (da chiamare nella fase pre-fork). True se fastText è attivo."""
+    return _model() is not None
+
+
+def _clean(text: str) -> str:
+    # fastText non accetta newline nell'input di predict
+    return " ".join((text or "").split()).lower()
+
+
+def _fallback(text: str, default: str) -> Tuple[str, float]:
+    try:
+        from langdetect import DetectorFactory, detect_langs
+        DetectorFactory.seed = 0
+        best = detect_langs(text)[0]
+        return best.lang, float(best.prob)
+    except Exception:
+        return default, 0.0
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _predict_cached(clean: str) -> Tuple[str, float]:
+    m = _model()
+    if m is None:
+        return _fallback(clean, "")
+    # forma a lista: il ramo a stringa singola di fasttext-wheel 0.9.2 non è compatibile con numpy 2
+    labels, probs = m.predict([clean], k=1)
+    if not len(labels[0]):
+        return "", 0.0
+    return labels[0][0].replace("__label__", ""), float(probs[0][0])
+
+
+def detect_with_score(text: str, default: str = "it") -> Tuple[str, float]:
+    """(lingua ISO-639-1, confidenza). Sotto LID_MIN_CONFIDENCE restituisce il default."""
+    clean = _clean(text)
+    if not clean:
+        return default, 0.0
+    lang, p = _predict_cached(clean)
+    if not lang or p < MIN_CONFIDENCE:
+        return default, p
+    return lang, p
+
+
+def detect_lang(text: str, default: str = "it") -> str:
+    return detect_with_score(text, default)[0]
+
+
+def detect_batch(texts: Sequence[str], default: str = "it") -> List[str]:
+    """Classificazione in blocco (una sola chiamata al modello per i testi non in cache)."""
+    cleans = [_clean(t) for t in texts]
+    m = _model()
+    if m is None:
+        return [detect_lang(t, default) for t in texts]
+    todo = [c for c in dict.fromkeys(cleans) if c]
+    results = {}
+    if todo:
+        labels, probs = m.predict(todo, k=1)
+        for c, lab, p in zip(todo, labels, probs):
+            lang = lab[0].replace("__label__", "") if len(lab) else ""
+            results[c] = (lang, float(p[0]) if len(p) else 0.0)
+    out: List[str] = []
+    for c in cleans:
+        lang, p = results.get(c, ("", 0.0))
+        out.append(lang if lang and p >= MIN_CONFIDENCE else default)
+    return out
+
+
+def normalize_lang(lang: Optional[str], supported: Sequence[str], default: str = "it") -> str:
+    """Riduce la lingua a una di quelle supportate (es. 'en', 'fr', 'de', 'es', 'it')."""
+    lang = (lang or "").lower().split("-")[0].split("_")[0]
+    return lang if lang in supported else default
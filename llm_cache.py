@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+llm_cache.py
+------------
+Cache su disco (SQLite) delle risposte LLM, indirizzata per contenuto:
+chiave = sha256(model + messages + parametri), valore = testo + usage.
+
+Modalità (env LLM_CACHE_MODE):
+- off           nessuna cache
+- read-through  produzione: legge/scrive solo le chiamate deterministiche (temperature 0)
+- record        chiama sempre l'API e registra TUTTE le risposte (per preparare i replay)
+- replay        solo cache: un miss è un errore (test offline, load test senza API)
+
+Limiti: LLM_CACHE_MAX_ENTRIES (default 20000), LLM_CACHE_MAX_MB (default 200);
+oltre soglia si eliminano le voci usate meno di recente (LRU su last_access).
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from event_log import diag
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MODES = {"off", "read-through", "record", "replay"}
+CACHE_MODE = (os.getenv("LLM_CACHE_MODE", "read-through") or "off").strip().lower()
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(_BASE_DIR, ".cache", "llm_cache.sqlite"))
+MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+MAX_BYTES = int(float(os.getenv("LLM_CACHE_MAX_MB", "200")) * 1024 * 1024)
+_EVICT_EVERY = 100  # controllo limiti ogni N inserimenti
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    content TEXT NOT NULL,
+    usage TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access);
+"""
+
+
+class CachedResponse(NamedTuple):
+    content: str
+    model: str
+    usage: Dict[str, Any]
+
+
+def cache_key(model: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+    canon = json.dumps(
+        {"model": model, "messages": messages, "params": {k: v for k, v in params.items() if v is not None}},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(canon.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(params: Dict[str, Any]) -> bool:
+    t = params.get("temperature")
+    return t is not None and float(t) == 0.0
+
+
+class ResponseCache:
+    """Una connessione SQLite per thread, WAL per letture concorrenti tra worker."""
+
+    def __init__(self, path: str = CACHE_PATH, mode: str = CACHE_MODE,
+                 max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES) -> None:
+        if mode not in MODES:
+            diag("LLM-CACHE", f"modalità sconosciuta '{mode}', cache disattivata", "warn")
+            mode = "off"
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    # ---- policy ----
+    def should_read(self, params: Dict[str, Any]) -> bool:
+        if self.mode == "replay":
+            return True
+        return self.mode == "read-through" and is_deterministic(params)
+
+    def should_write(self, params: Dict[str, Any]) -> bool:
+        if self.mode == "record":
+            return True
+        return self.mode == "read-through" and is_deterministic(params)
+
+    # ---- accesso ----
+    def get(self, key: str) -> Optional[CachedResponse]:
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT content, model, usage FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return CachedResponse(row[0], row[1], json.loads(row[2] or "{}"))
+        except sqlite3.Error as e:
+            diag("LLM-CACHE", f"lettura: {e}", "warn")
+            return None
+
+    def put(self, key: str, model: str, content: str, usage: Optional[Dict[str, Any]] = None) -> None:
+        now = time.time()
+        usage_s = json.dumps(usage or {}, ensure_ascii=False)
+        size = len(content.encode("utf-8")) + len(usage_s)
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO responses(key, model, content, usage, size, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, content, usage_s, size, now, now),
+            )
+        except sqlite3.Error as e:
+            diag("LLM-CACHE", f"scrittura: {e}", "warn")
+            return
+        with self._lock:
+            self._writes += 1
+            check = self._writes % _EVICT_EVERY == 0
+        if check:
+            self.evict()
+
+    def evict(self) -> int:
+        """Elimina le voci meno usate di recente finché si rientra nei limiti."""
+        try:
+            conn = self._conn()
+            n, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            removed = 0
+            if n > self.max_entries:
+                extra = n - self.max_entries
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)", (extra,))
+                removed += extra
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            while total > self.max_bytes:
+                rows = conn.execute(
+                    "SELECT key, size FROM responses ORDER BY last_access ASC LIMIT 100").fetchall()
+                if not rows:
+                    break
+                conn.executemany("DELETE FROM responses WHERE key = ?", [(r[0],) for r in rows])
+                removed += len(rows)
+                total -= sum(r[1] for r in rows)
+            return removed
+        except sqlite3.Error as e:
+            diag("LLM-CACHE", f"eviction: {e}", "warn")
+            return 0
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            n, total = self._conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        except sqlite3.Error:
+            n, total = None, None
+        return {"mode": self.mode, "path": self.path, "entries": n, "bytes": total,
+                "hits": self.hits, "misses": self.misses}
+
+
+_CACHE: Optional[ResponseCache] = None
+
+
+def get_cache() -> ResponseCache:
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = ResponseCache()
+    return _CACHE
+
+
+def set_mode(mode: str) -> ResponseCache:
+    """Cambio modalità a runtime (es. nei test: set_mode('replay'))."""
+    global _CACHE
+    _CACHE = ResponseCache(mode=mode)
+    return _CACHE
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+llm_gateway.py
+--------------
+Gateway unico per tutto il traffico LLM in uscita (app.py, applastversion.py,
+configuratore_connettori.py), compatibile con l'API chat-completions OpenAI.
+
+- una sola requests.Session con pool di connessioni e keep-alive (niente handshake TLS per chiamata)
+- limiti di concorrenza globali e per "purpose" (gold, rerank, configuratore, ...)
+- retry su 429/5xx/errori di rete con backoff esponenziale + jitter (rispetta Retry-After)
+- timeout per chiamata e risposta uniforme (LLMResponse), mai eccezioni verso il chiamante
+- cache su disco delle risposte con record/replay (llm_cache, env LLM_CACHE_MODE)
+
+Configurazione via env:
+    OPENAI_API_KEY, OPENAI_BASE_URL (default https://api.openai.com/v1)
+    LLM_MAX_CONCURRENCY (default 16), LLM_CONCURRENCY_<PURPOSE> (es. LLM_CONCURRENCY_RERANK=8)
+    LLM_MAX_RETRIES (default 3), LLM_TIMEOUT_S (default 60), LLM_QUEUE_TIMEOUT_S (default 30)
+    LLM_BACKOFF_BASE_S (default 0.5), LLM_BACKOFF_MAX_S (default 8), LLM_POOL_SIZE (default 32)
+"""
+
+from __future__ import annotations
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import llm_cache
+from event_log import diag
+
+# `requests` (~100 ms di import) è caricato al primo uso o in warm-up (preload)
+requests = None
+
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))
+QUEUE_TIMEOUT_S = float(os.getenv("LLM_QUEUE_TIMEOUT_S", "30"))
+BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", "0.5"))
+BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", "8"))
+POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "32"))
+
+# limiti di default per purpose (sovrascrivibili con LLM_CONCURRENCY_<PURPOSE>)
+DEFAULT_PURPOSE_LIMITS = {"gold": 8, "rerank": 8, "configuratore": 4}
+
+_RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMResponse(NamedTuple):
+    ok: bool
+    content: str
+    model: str
+    status: Optional[int]
+    error: Optional[str]
+    attempts: int
+    latency_ms: float
+    usage: Dict[str, Any]
+    cached: bool = False
+
+
+_SESSION: Optional[Any] = None
+_SESSION_LOCK = threading.Lock()
+_GLOBAL_SEM = threading.BoundedSemaphore(max(1, MAX_CONCURRENCY))
+_PURPOSE_SEMS: Dict[str, threading.BoundedSemaphore] = {}
+_PURPOSE_LOCK = threading.Lock()
+
+
+def api_key() -> str:
+    return os.getenv("OPENAI_API_KEY", "").strip()
+
+
+def base_url() -> str:
+    """Letta a ogni chiamata, come api_key(): vale anche un .env caricato dopo l'import."""
+    return os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+
+
+def is_configured() -> bool:
+    """
+    Chiamate possibili: chiave presente, oppure LLM_CACHE_MODE=replay (risponde solo la
+    cache, senza rete né chiave: test offline e load test; un miss fallisce in chat()).
+    """
+    return bool(api_key()) or llm_cache.get_cache().mode == "replay"
+
+
+def preload() -> None:
+    """Import di requests (warm-up pre-fork). La sessione no: i socket non vanno condivisi tra processi."""
+    global requests
+    if requests is None:
+        import requests as _requests
+        requests = _requests
+
+
+def _session():
+    """Sessione condivisa (pool keep-alive), creata al primo uso."""
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                preload()
+                from requests.adapters import HTTPAdapter
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=0)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _SESSION = s
+    return _SESSION
+
+
+def _purpose_sem(purpose: str) -> threading.BoundedSemaphore:
+    sem = _PURPOSE_SEMS.get(purpose)
+    if sem is None:
+        with _PURPOSE_LOCK:
+            sem = _PURPOSE_SEMS.get(purpose)
+            if sem is None:
+                env = os.getenv(f"LLM_CONCURRENCY_{purpose.upper()}")
+                limit = int(env) if env else DEFAULT_PURPOSE_LIMITS.get(purpose, MAX_CONCURRENCY)
+                sem = threading.BoundedSemaphore(max(1, limit))
+                _PURPOSE_SEMS[purpose] = sem
+    return sem
+
+
+def _backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Full jitter: U(0, min(max, base * 2^attempt)); Retry-After vince se presente."""
+    if retry_after:
+        try:
+            return min(BACKOFF_MAX_S, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    return random.uniform(0.0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** attempt)))
+
+
+def _fail(model: str, error: str, status: Optional[int], attempts: int, t0: float) -> LLMResponse:
+    return LLMResponse(False, "", model, status, error, attempts, (time.perf_counter() - t0) * 1000, {})
+
+
+def chat(messages: List[Dict[str, str]],
+         model: str,
+         purpose: str = "default",
+         timeout: Optional[float] = None,
+         max_retries: Optional[int] = None,
+         **params: Any) -> LLMResponse:
+    """
+    Chiamata chat-completions. `params` passa invariati (temperature, top_p, max_tokens, ...).
+    Non solleva eccezioni: l'esito è sempre in LLMResponse.ok / .error.
+    """
+    t0 = time.perf_counter()
+    params = {k: v for k, v in params.items() if v is not None}
+
+    cache = llm_cache.get_cache()
+    ckey = None
+    if cache.mode != "off":
+        ckey = llm_cache.cache_key(model, messages, params)
+        if cache.should_read(params):
+            hit = cache.get(ckey)
+            if hit is not None:
+                return LLMResponse(True, hit.content, hit.model, 200, None, 0,
+                                   (time.perf_counter() - t0) * 1000, hit.usage, True)
+            if cache.mode == "replay":
+                return _fail(model, "cache miss (LLM_CACHE_MODE=replay)", None, 0, t0)
+
+    key = api_key()
+    if not key:
+        return _fail(model, "OPENAI_API_KEY mancante", None, 0, t0)
+
+    payload = {"model": model, "messages": messages}
+    payload.update(params)
+    headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
+    retries = MAX_RETRIES if max_retries is None else max_retries
+    url = f"{base_url()}/chat/completions"
+
+    try:
+        preload()
+    except ImportError as e:
+        diag("LLM", f"requests non disponibile: {e}", "error")
+        return _fail(model, f"ImportError: {e}", None, 0, t0)
+    p_sem = _purpose_sem(purpose)
+    if not p_sem.acquire(timeout=QUEUE_TIMEOUT_S):
+        return _fail(model, f"coda LLM piena (purpose={purpose})", None, 0, t0)
+    try:
+        if not _GLOBAL_SEM.acquire(timeout=QUEUE_TIMEOUT_S):
+            return _fail(model, "coda LLM piena (globale)", None, 0, t0)
+        try:
+            attempt = 0
+            while True:
+                attempt += 1
+                status: Optional[int] = None
+                retry_after: Optional[str] = None
+                try:
+                    resp = _session().post(url, headers=headers, json=payload, timeout=timeout or TIMEOUT_S)
+                    status = resp.status_code
+                    if status == 200:
+                        data = resp.json()
+                        content = (data["choices"][0]["message"].get("content") or "").strip()
+                        usage = data.get("usage") or {}
+                        if ckey is not None and cache.should_write(params):
+                            cache.put(ckey, data.get("model") or model, content, usage)
+                        return LLMResponse(True, content, data.get("model") or model, status, None, attempt,
+                                           (time.perf_counter() - t0) * 1000, usage)
+                    error = f"HTTP {status}: {resp.text[:300]}"
+                    retry_after = resp.headers.get("Retry-After")
+                    retryable = status in _RETRY_STATUS
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = f"{type(e).__name__}: {e}"
+                    retryable = True
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    retryable = False
+
+                if not retryable or attempt > retries:
+                    diag("LLM", f"purpose={purpose} model={model} tentativi={attempt}: {error}", "error")
+                    return _fail(model, error, status, attempt, t0)
+                time.sleep(_backoff(attempt - 1, retry_after))
+        finally:
+            _GLOBAL_SEM.release()
+    finally:
+        p_sem.release()
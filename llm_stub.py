@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+llm_stub.py
+-----------
+Server locale compatibile chat-completions OpenAI, per load test senza costi API.
+
+- latenza configurabile: fixed:MS | uniform:MIN:MAX | lognormal:MEDIANA_MS:SIGMA | exp:MEDIA_MS
+- errori iniettati: tasso complessivo, status scelti a caso tra --error-codes
+  (429/503 con Retry-After, come l'API vera)
+- streaming SSE (stream=true) con chunk "delta" e [DONE]
+- risposta deterministica per contenuto (stesso prompt → stesso testo)
+
+Avvio:
+    python llm_stub.py --port 8099 --latency lognormal:900:0.4 --error-rate 0.02
+App contro lo stub:
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=stub LLM_CACHE_MODE=off \\
+        gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker app:app
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from json_fragments import FastJSONResponse
+
+
+class StubConfig:
+    def __init__(self, latency: str = "fixed:200", error_rate: float = 0.0,
+                 error_codes: Optional[List[int]] = None, retry_after_s: float = 1.0,
+                 stream_chunks: int = 8, seed: Optional[int] = None) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_codes = error_codes or [429, 500, 503]
+        self.retry_after_s = retry_after_s
+        self.stream_chunks = max(1, stream_chunks)
+        self.rng = random.Random(seed)
+        self._sampler = self._parse_latency(latency)
+        self.stats = {"requests": 0, "errors": 0, "streams": 0}
+
+    def _parse_latency(self, spec: str):
+        kind, *args = spec.split(":")
+        a = [float(x) for x in args]
+        if kind == "fixed":
+            return lambda: a[0]
+        if kind == "uniform":
+            return lambda: self.rng.uniform(a[0], a[1])
+        if kind == "lognormal":
+            mu = math.log(a[0])
+            return lambda: self.rng.lognormvariate(mu, a[1])
+        if kind == "exp":
+            return lambda: self.rng.expovariate(1.0 / a[0])
+        raise ValueError(f"latenza non valida: {spec!r}")
+
+    def latency_s(self) -> float:
+        return max(0.0, self._sampler()) / 1000.0
+
+
+def _reply_text(model: str, messages: List[Dict[str, Any]]) -> str:
+    last = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    h = hashlib.sha256(f"{model}|{last}".encode("utf-8")).hexdigest()[:12]
+    return (f"[stub {model} {h}] Risposta simulata per: {last[:200]}\n"
+            "Contesto, istruzioni di posa e checklist sono generati dallo stub di load test.")
+
+
+def create_app(cfg: StubConfig) -> FastAPI:
+    app = FastAPI(title="LLM stub (chat-completions)", default_response_class=FastJSONResponse)
+
+    @app.get("/health")
+    async def health():
+        return {"ok": True, "config": {"latency": cfg.latency, "error_rate": cfg.error_rate,
+                                       "error_codes": cfg.error_codes}, "stats": cfg.stats}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(req: Request):
+        body = await req.json()
+        cfg.stats["requests"] += 1
+        model = body.get("model") or "stub"
+        messages = body.get("messages") or []
+        await asyncio.sleep(cfg.latency_s())
+
+        if cfg.rng.random() < cfg.error_rate:
+            cfg.stats["errors"] += 1
+            code = cfg.rng.choice(cfg.error_codes)
+            headers = {"Retry-After": str(cfg.retry_after_s)} if code in (429, 503) else {}
+            return FastJSONResponse({"error": {"message": f"stub error {code}", "type": "stub"}},
+                                    status_code=code, headers=headers)
+
+        text = _reply_text(model, messages)
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 4,
+                 "total_tokens": prompt_tokens + len(text) // 4}
+        cid = "chatcmpl-stub-" + hashlib.sha1(text.encode("utf-8")).hexdigest()[:10]
+
+        if not body.get("stream"):
+            return {"id": cid, "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": text}}],
+                    "usage": usage}
+
+        cfg.stats["streams"] += 1
+        n = cfg.stream_chunks
+        step = max(1, len(text) // n)
+        pieces = [text[i:i + step] for i in range(0, len(text), step)]
+
+        async def sse():
+            for i, p in enumerate(pieces):
+                delta = {"role": "assistant", "content": p} if i == 0 else {"content": p}
+                chunk = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(0.01)
+            end = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                   "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(end)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(sse(), media_type="text/event-stream")
+
+    return app
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Stub chat-completions per load test")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--latency", default="lognormal:800:0.5",
+                    help="fixed:MS | uniform:MIN:MAX | lognormal:MEDIANA_MS:SIGMA | exp:MEDIA_MS")
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--error-codes", default="429,500,503")
+    ap.add_argument("--retry-after", type=float, default=1.0)
+    ap.add_argument("--stream-chunks", type=int, default=8)
+    ap.add_argument("--seed", type=int, default=None)
+    a = ap.parse_args()
+
+    cfg = StubConfig(latency=a.latency, error_rate=a.error_rate,
+                     error_codes=[int(x) for x in a.error_codes.split(",") if x.strip()],
+                     retry_after_s=a.retry_after, stream_chunks=a.stream_chunks, seed=a.seed)
+    import uvicorn
+    uvicorn.run(create_app(cfg), host=a.host, port=a.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
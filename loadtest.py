@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+loadtest.py
+-----------
+Load generator asincrono: rigioca smoke_200.json e domande_test_quick100.json
+contro l'app in esecuzione a un RPS obiettivo (open loop: le richieste partono
+a intervalli fissi anche se le precedenti non sono tornate → niente coordinated omission).
+
+Per ogni endpoint: throughput, percentili di latenza (p50/p90/p95/p99/max),
+tasso di errore (HTTP != 2xx, timeout, eccezioni) e due lag di event loop:
+- app_loop_lag_ms: loop dell'APP, campionato dentro il processo servente
+  (event_log.start_loop_lag) e letto a fine run da /api/status o /health sulla
+  finestra del run; con più worker è quello del worker che risponde al probe
+- generator_lag_ms: loop del generatore (se alto, le latenze misurate non sono
+  affidabili: abbassare l'RPS)
+
+Endpoint:
+    post   POST /api/ask {"question": ...}      (app.py / applastversion.py)
+    get    GET  /api/ask?q=...                  (tecnaria_api.py)
+
+Uso (con llm_stub.py per non consumare API):
+    python loadtest.py --base-url http://127.0.0.1:8000 --rps 20 --duration 60 --endpoints post,get
+    python loadtest.py --rps 50 --duration 30 --out .cache/loadtest.json
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+QUESTION_FILES = [
+    os.path.join(BASE_DIR, "static", "data", "tests", "smoke_200.json"),
+    os.path.join(BASE_DIR, "static", "data", "domande_test_quick100.json"),
+]
+
+
+def load_questions(paths: List[str] = QUESTION_FILES) -> List[str]:
+    out: List[str] = []
+    for p in paths:
+        with open(p, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        items = data if isinstance(data, list) else (data.get("items") or data.get("questions") or [])
+        for it in items:
+            q = it if isinstance(it, str) else (it.get("question") or it.get("q") or it.get("domanda"))
+            if q:
+                out.append(str(q))
+    return out
+
+
+def percentile(sorted_vals: List[float], p: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    k = min(len(sorted_vals) - 1, max(0, int(round(p / 100.0 * (len(sorted_vals) - 1)))))
+    return round(sorted_vals[k], 2)
+
+
+class GeneratorLag:
+    """Ritardo dell'event loop del generatore (non dell'app): sleep(interval) e misura lo sforamento."""
+
+    def __init__(self, interval_s: float = 0.01) -> None:
+        self.interval_s = interval_s
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            t = time.perf_counter()
+            await asyncio.sleep(self.interval_s)
+            self.samples.append(max(0.0, (time.perf_counter() - t - self.interval_s) * 1000))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> Dict[str, Any]:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        s = sorted(self.samples)
+        return {"p50_ms": percentile(s, 50), "p99_ms": percentile(s, 99),
+                "max_ms": round(s[-1], 2) if s else None}
+
+
+async def _one(client: httpx.AsyncClient, endpoint: str, q: str, timeout: float) -> Dict[str, Any]:
+    t = time.perf_counter()
+    try:
+        if endpoint == "get":
+            r = await client.get("/api/ask", params={"q": q}, timeout=timeout)
+        else:
+            r = await client.post("/api/ask", json={"question": q}, timeout=timeout)
+        await r.aread()
+        status: Any = r.status_code
+        ok = 200 <= r.status_code < 300
+    except httpx.TimeoutException:
+        status, ok = "timeout", False
+    except Exception as e:
+        status, ok = type(e).__name__, False
+    return {"ms": (time.perf_counter() - t) * 1000, "ok": ok, "status": status}
+
+
+async def app_loop_lag(client: httpx.AsyncClient, status_paths: List[str], window_s: float) -> Optional[Dict[str, Any]]:
+    """Lag dell'event loop dell'app sugli ultimi window_s secondi (primo status path che lo espone)."""
+    for path in status_paths:
+        try:
+            r = await client.get(path, params={"lag_window_s": round(window_s, 1)}, timeout=10.0)
+            lag = r.json().get("loop_lag") if r.status_code == 200 else None
+        except Exception:
+            lag = None
+        if lag:
+            return lag
+    return None
+
+
+async def run_endpoint(base_url: str, endpoint: str, questions: List[str], rps: float,
+                       duration_s: float, timeout: float, max_inflight: int,
+                       status_paths: List[str]) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=max_inflight, max_keepalive_connections=max_inflight)
+    lag = GeneratorLag()
+    results: List[Dict[str, Any]] = []
+    dropped = 0
+    inflight = asyncio.Semaphore(max_inflight)
+
+    async def fire(q: str) -> None:
+        try:
+            results.append(await _one(client, endpoint, q, timeout))
+        finally:
+            inflight.release()
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+        lag.start()
+        tasks: List[asyncio.Task] = []
+        total = max(1, int(rps * duration_s))
+        t0 = time.perf_counter()
+        for i in range(total):
+            delay = t0 + i / rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if inflight.locked():
+                dropped += 1  # generatore saturo: conteggiato come errore, non accodato
+                continue
+            await inflight.acquire()
+            tasks.append(asyncio.create_task(fire(questions[i % len(questions)])))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - t0
+        lag_stats = await lag.stop()
+        app_lag = await app_loop_lag(client, status_paths, wall)
+
+    lat = sorted(r["ms"] for r in results)
+    errors = sum(1 for r in results if not r["ok"]) + dropped
+    by_status: Dict[str, int] = {}
+    for r in results:
+        by_status[str(r["status"])] = by_status.get(str(r["status"]), 0) + 1
+    sent = len(results) + dropped
+    return {
+        "endpoint": endpoint,
+        "target_rps": rps,
+        "sent": sent,
+        "completed": len(results),
+        "dropped": dropped,
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(len(results) / wall, 2) if wall else None,
+        "error_rate": round(errors / sent, 4) if sent else None,
+        "status": by_status,
+        "latency_ms": {"p50": percentile(lat, 50), "p90": percentile(lat, 90), "p95": percentile(lat, 95),
+                       "p99": percentile(lat, 99), "max": round(lat[-1], 2) if lat else None},
+        "app_loop_lag_ms": app_lag,
+        "generator_lag_ms": lag_stats,
+    }
+
+
+def _print(rep: Dict[str, Any]) -> None:
+    l = rep["latency_ms"]
+    print(f"[{rep['endpoint']:>4}] sent={rep['sent']} done={rep['completed']} dropped={rep['dropped']} "
+          f"thr={rep['throughput_rps']} rps err={rep['error_rate']} | "
+          f"p50={l['p50']} p90={l['p90']} p95={l['p95']} p99={l['p99']} max={l['max']} ms | "
+          f"app loop lag p99={(rep['app_loop_lag_ms'] or {}).get('p99_ms')} ms "
+          f"(generatore p99={rep['generator_lag_ms']['p99_ms']} ms) | status={rep['status']}")
+
+
+async def main_async(a: argparse.Namespace) -> List[Dict[str, Any]]:
+    questions = load_questions()
+    print(f"domande: {len(questions)} | base={a.base_url} rps={a.rps} durata={a.duration}s")
+    reports = []
+    for ep in [e.strip() for e in a.endpoints.split(",") if e.strip()]:
+        rep = await run_endpoint(a.base_url, ep, questions, a.rps, a.duration, a.timeout, a.max_inflight,
+                                 [p.strip() for p in a.status_paths.split(",") if p.strip()])
+        _print(rep)
+        reports.append(rep)
+    return reports
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Load test /api/ask (open loop, RPS fisso)")
+    ap.add_argument("--base-url", default="http://127.0.0.1:8000")
+    ap.add_argument("--rps", type=float, default=10.0)
+    ap.add_argument("--duration", type=float, default=30.0)
+    ap.add_argument("--endpoints", default="post", help="post,get")
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--max-inflight", type=int, default=512)
+    ap.add_argument("--status-paths", default="/api/status,/health",
+                    help="endpoint che espongono loop_lag (app.py: /api/status, applastversion.py: /health)")
+    ap.add_argument("--out", default=None, help="report JSON")
+    a = ap.parse_args()
+
+    reports = asyncio.run(main_async(a))
+    if a.out:
+        os.makedirs(os.path.dirname(a.out) or ".", exist_ok=True)
+        with open(a.out, "w", encoding="utf-8") as f:
+            json.dump({"generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "reports": reports}, f, indent=2)
+        print(f"report → {a.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,71 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+merge_ctf_kb.py
+---------------
+Compilatore della KB GOLD: master + overlays + patches → un solo artefatto + report.
+
+Livelli, in ordine di precedenza crescente (dentro un livello: file in ordine di nome):
+    master    static/data/ctf_system_COMPLETE_GOLD_master.json   {"blocks": [...]}
+    overlay   static/data/overlays/*.json                        {"blocks": [...]}
+    patch     static/data/patches/*.json                         {"items": [...]}
+
+Schema normalizzato = quello del master (id, family, mode, lang, tags, triggers,
+question/question_it, answer/answer_it). Dalle patch:
+    response_variants.gold.<lang> → answer_<lang> (answer = answer_it se manca)
+    triggers_brevi               → triggers
+
+Il report (stesso nome dell'output, .report.json) elenca:
+    overrides   stesso id ridefinito da un livello successivo (voluto: vince il successivo)
+    conflicts   stesso id definito due volte nello STESSO livello con contenuto diverso
+                (ambiguo: vince l'ultimo file, da sistemare a mano)
+    redundant   ridefinizioni identiche (rumore, eliminabili)
+    duplicates  id diversi con la stessa risposta (hash del testo normalizzato)
+    unmatchable blocchi senza question_it né triggers: il matcher lessicale non li trova mai
+    invalid     voci senza id o senza risposta (scartate)
+    diff        rispetto all'artefatto precedente: added / removed / changed
+
+I file sono letti uno alla volta (orjson se installato) e i blocchi normalizzati
+al volo. Il report registra l'impronta dei byte sorgente: se non è cambiata non si
+ricompila nulla (millisecondi anche con decine di migliaia di blocchi), quindi
+--check è adatto a un hook di commit.
+
+Uso:
+    python merge_ctf_kb.py                 # compila, scrive output + report
+    python merge_ctf_kb.py --check         # non scrive: exit 1 se l'output non è aggiornato
+    python merge_ctf_kb.py --strict        # exit 1 se ci sono conflitti
+"""
+
+import argparse
+import hashlib
 import json
 import os
+import sys
+import time
 from glob import glob
 
+try:
+    import orjson
+except Exception:
+    orjson = None
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "static", "data")
 OVERLAYS_DIR = os.path.join(DATA_DIR, "overlays")
+PATCHES_DIR = os.path.join(DATA_DIR, "patches")
 
-MASTER_PATH = os.path.join(DATA_DIR, "ctf_system_COMPLETE_GOLD_v3.json")
+MASTER_PATH = os.path.join(DATA_DIR, "ctf_system_COMPLETE_GOLD_master.json")
 OUTPUT_PATH = os.path.join(DATA_DIR, "ctf_system_SUPER_GOLD_v1.json")
+OUTPUT_VERSION = "SUPER_GOLD_v1"
+
+LAYERS = ("master", "overlay", "patch")
+COMPILER_VERSION = 1  # da incrementare quando cambia la normalizzazione: forza la ricompilazione
+
+
+# ============================================================
+# LETTURA / NORMALIZZAZIONE
+# ============================================================
 
 def load_json(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(path, "rb") as f:
+        raw = f.read()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
 
-def main():
-    # 1) Carica MASTER
-    master = load_json(MASTER_PATH)
-    master_blocks = master.get("blocks", [])
-    print(f"MASTER: {len(master_blocks)} blocchi")
-
-    # 2) Carica TUTTE le patch in overlays/
-    overlay_paths = sorted(glob(os.path.join(OVERLAYS_DIR, "*.json")))
-    overlay_blocks = []
-
-    for p in overlay_paths:
-        data = load_json(p)
-        blocks = data.get("blocks", [])
-        print(f"OVERLAY {os.path.basename(p)}: {len(blocks)} blocchi")
-        overlay_blocks.extend(blocks)
-
-    print(f"Totale blocchi overlay: {len(overlay_blocks)}")
-
-    # 3) Merge per ID: overlay sovrascrive master se ha stesso id
-    by_id = {}
-
-    # Prima il master
-    for b in master_blocks:
-        bid = b.get("id")
-        if not bid:
-            continue
-        by_id[bid] = b
 
-    # Poi le overlay: sovrascrivono
-    for b in overlay_blocks:
-        bid = b.get("id")
-        if not bid:
+def dumps_canonical(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def _entries(data):
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        for key in ("blocks", "items"):
+            if isinstance(data.get(key), list):
+                return data[key]
+    return []
+
+
+def source_files(master_path=MASTER_PATH, overlays_dir=OVERLAYS_DIR, patches_dir=PATCHES_DIR):
+    """[(livello, percorso)] in ordine di applicazione."""
+    files = [("master", master_path)] if os.path.exists(master_path) else []
+    files += [("overlay", p) for p in sorted(glob(os.path.join(overlays_dir, "*.json")))]
+    files += [("patch", p) for p in sorted(glob(os.path.join(patches_dir, "*.json")))]
+    return files
+
+
+def _name(path):
+    return os.path.relpath(path, DATA_DIR) if os.path.abspath(path).startswith(DATA_DIR) else path
+
+
+def sources_digest(files):
+    """Impronta dei byte sorgente (+ versione del compilatore): uguale → output già aggiornato, niente parsing."""
+    h = hashlib.sha1(f"v{COMPILER_VERSION}".encode("utf-8"))
+    for layer, path in files:
+        with open(path, "rb") as f:
+            h.update(f"|{layer}|{_name(path)}|".encode("utf-8") + hashlib.sha1(f.read()).digest())
+    return h.hexdigest()[:16]
+
+
+def iter_sources(files):
+    """(livello, file, posizione, voce grezza) un file alla volta."""
+    for layer, path in files:
+        name = _name(path)
+        for i, raw in enumerate(_entries(load_json(path))):
+            yield layer, name, i, raw
+
+
+def _str_list(v):
+    if not v:
+        return []
+    if isinstance(v, str):
+        v = [v]
+    out = []
+    for x in v:
+        x = x.strip() if isinstance(x, str) else str(x).strip()
+        if x:
+            out.append(x)
+    return out
+
+
+def normalize_block(raw):
+    """Voce di qualsiasi sorgente → blocco nello schema del master (None se non è un dict)."""
+    if not isinstance(raw, dict):
+        return None
+    b = dict(raw)
+
+    variants = b.pop("response_variants", None)
+    if isinstance(variants, dict):
+        gold = variants.get("gold")
+        if isinstance(gold, dict):
+            for lang, text in gold.items():
+                if isinstance(text, str) and text.strip() and not b.get(f"answer_{lang}"):
+                    b[f"answer_{lang}"] = text.strip()
+        rest = {k: v for k, v in variants.items() if k != "gold"}
+        if rest:
+            b["response_variants"] = rest
+
+    triggers = _str_list(b.get("triggers")) + _str_list(b.pop("triggers_brevi", None))
+    b["triggers"] = list(dict.fromkeys(triggers))
+    b["tags"] = _str_list(b.get("tags"))
+
+    if not b.get("question_it") and isinstance(b.get("question"), str):
+        b["question_it"] = b["question"]
+    if not b.get("answer_it") and isinstance(b.get("answer"), str):
+        b["answer_it"] = b["answer"]
+    if b.get("answer_it") and not b.get("answer"):
+        b["answer"] = b["answer_it"]
+    if b.get("question_it") and not b.get("question"):
+        b["question"] = b["question_it"]
+    b.setdefault("mode", "gold")
+    b.setdefault("lang", "it")
+    if "id" in b:
+        b["id"] = str(b["id"]).strip()
+    return b
+
+
+def text_hash(text):
+    """Hash del testo normalizzato (maiuscole e spazi non contano): duplicati di contenuto."""
+    return hashlib.sha1(" ".join(text.casefold().split()).encode("utf-8")).hexdigest()[:16]
+
+
+def block_hash(block):
+    return hashlib.sha1(dumps_canonical(block)).hexdigest()[:16]
+
+
+# ============================================================
+# COMPILAZIONE
+# ============================================================
+
+def _changed_fields(old, new):
+    return sorted(k for k in set(old) | set(new) if old.get(k) != new.get(k))
+
+
+def compile_kb(entries):
+    """entries: iterabile di (livello, file, posizione, voce grezza) → (blocchi ordinati per id, report)"""
+    by_id = {}  # id → (blocco, hash, livello, file)
+    report = {"overrides": [], "conflicts": [], "redundant": [], "duplicates": [],
+              "unmatchable": [], "invalid": [], "sources": {}}
+
+    for layer, src, i, raw in entries:
+        report["sources"][src] = report["sources"].get(src, 0) + 1
+        b = normalize_block(raw)
+        if b is None or not b.get("id") or not b.get("answer_it"):
+            report["invalid"].append({"source": src, "index": i,
+                                      "reason": "non è un oggetto" if b is None else
+                                      ("id mancante" if not b.get("id") else "risposta mancante")})
             continue
-        by_id[bid] = b
+        h = block_hash(b)
+        bid = b["id"]
+        prev = by_id.get(bid)
+        if prev is not None:
+            old, old_h, old_layer, old_src = prev
+            entry = {"id": bid, "from": old_src, "to": src}
+            if old_h == h:
+                report["redundant"].append(entry)
+                continue
+            entry["fields"] = _changed_fields(old, b)
+            if old_layer == layer:
+                report["conflicts"].append(entry)
+            elif LAYERS.index(layer) > LAYERS.index(old_layer):
+                report["overrides"].append(entry)
+        by_id[bid] = (b, h, layer, src)
 
-    merged_blocks = list(by_id.values())
-    print(f"Totale blocchi MERGED: {len(merged_blocks)}")
+    blocks = [by_id[k][0] for k in sorted(by_id)]
 
-    # 4) Ordiniamo per id giusto per avere qualcosa di leggibile
-    merged_blocks.sort(key=lambda x: x.get("id", ""))
+    by_text = {}
+    for b in blocks:
+        by_text.setdefault(text_hash(b["answer_it"]), []).append(b["id"])
+        if not b.get("question_it") and not b.get("triggers"):
+            report["unmatchable"].append(b["id"])
+    report["duplicates"] = [{"hash": h, "ids": ids} for h, ids in sorted(by_text.items()) if len(ids) > 1]
 
-    # 5) Scriviamo il nuovo SUPER MASTER
-    out = {
-        "family": "CTF_SYSTEM",
-        "version": "SUPER_GOLD_v1",
-        "blocks": merged_blocks
+    families = {}
+    for b in blocks:
+        families[b.get("family") or "?"] = families.get(b.get("family") or "?", 0) + 1
+    report["families"] = dict(sorted(families.items()))
+    report["hashes"] = {k: v[1] for k, v in by_id.items()}
+    return blocks, report
+
+
+def diff_with_previous(prev_hashes, hashes):
+    prev_hashes = prev_hashes or {}
+    return {
+        "added": sorted(k for k in hashes if k not in prev_hashes),
+        "removed": sorted(k for k in prev_hashes if k not in hashes),
+        "changed": sorted(k for k in hashes if k in prev_hashes and prev_hashes[k] != hashes[k]),
     }
 
-    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-        json.dump(out, f, ensure_ascii=False, indent=2)
 
-    print(f"File scritto: {OUTPUT_PATH}")
+def _dump_pretty(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2) + b"\n"
+    return (json.dumps(obj, ensure_ascii=False, indent=2) + "\n").encode("utf-8")
+
+
+def _write_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _report_path(output_path):
+    return os.path.splitext(output_path)[0] + ".report.json"
+
+
+def _print_summary(report, blocks, dt):
+    print(f"Sorgenti: {len(report['sources'])} file, {sum(report['sources'].values())} voci → "
+          f"{len(blocks)} blocchi in {dt * 1000:.0f} ms")
+    print(f"Famiglie: {report['families']}")
+    for key in ("overrides", "conflicts", "redundant", "duplicates", "unmatchable", "invalid"):
+        print(f"  {key:<12} {len(report[key])}")
+    d = report["diff"]
+    print(f"Diff: +{len(d['added'])} -{len(d['removed'])} ~{len(d['changed'])}")
+    for c in report["conflicts"][:20]:
+        print(f"  [CONFLITTO] {c['id']}: {c['from']} ↔ {c['to']} campi={c['fields']}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compila master + overlays + patches GOLD")
+    ap.add_argument("--master", default=MASTER_PATH)
+    ap.add_argument("--overlays", default=OVERLAYS_DIR)
+    ap.add_argument("--patches", default=PATCHES_DIR)
+    ap.add_argument("--out", default=OUTPUT_PATH)
+    ap.add_argument("--check", action="store_true", help="non scrive: exit 1 se l'output va rigenerato")
+    ap.add_argument("--strict", action="store_true", help="exit 1 in presenza di conflitti")
+    ap.add_argument("--force", action="store_true", help="ricompila anche con sorgenti invariate")
+    a = ap.parse_args()
+
+    t0 = time.perf_counter()
+    files = source_files(a.master, a.overlays, a.patches)
+    digest = sources_digest(files)
+    # l'impronta si legge dal report (piccolo, scritto dopo l'output): l'artefatto resta su disco
+    last = load_json(_report_path(a.out)) if os.path.exists(_report_path(a.out)) and os.path.exists(a.out) else {}
+    if last.get("sources_digest") == digest and not a.force:
+        print(f"Sorgenti invariate ({len(files)} file, {(time.perf_counter() - t0) * 1000:.0f} ms): "
+              f"output aggiornato {a.out}")
+        sys.exit(1 if a.strict and last.get("conflicts") else 0)
+
+    blocks, report = compile_kb(iter_sources(files))
+    prev = load_json(a.out) if os.path.exists(a.out) else {}
+    generation = hashlib.sha1("".join(f"{k}:{v};" for k, v in sorted(report["hashes"].items()))
+                              .encode("utf-8")).hexdigest()[:12]
+    up_to_date = prev.get("generation") == generation
+    if up_to_date:
+        report["diff"] = diff_with_previous(report["hashes"], report["hashes"])
+    else:
+        prev_hashes = {b["id"]: block_hash(b) for b in prev.get("blocks", []) if isinstance(b, dict) and b.get("id")}
+        report["diff"] = diff_with_previous(prev_hashes, report["hashes"])
+    _print_summary(report, blocks, time.perf_counter() - t0)
+
+    if a.check:
+        # blocchi identici ma sorgenti cambiate (es. solo formattazione): basta riscrivere il report
+        print("Output aggiornato (report con impronta sorgenti da rigenerare)" if up_to_date
+              else f"Output da rigenerare: {a.out}")
+        sys.exit(0 if up_to_date and not (a.strict and report["conflicts"]) else 1)
+
+    if up_to_date:
+        print(f"Blocchi invariati: {a.out}")
+    else:
+        out = {"version": OUTPUT_VERSION, "generation": generation,
+               "sources": [_name(p) for _, p in files], "blocks": blocks}
+        _write_atomic(a.out, _dump_pretty(out))
+        print(f"File scritto: {a.out}")
+    report.pop("hashes")
+    report.update(generation=generation, previous_generation=prev.get("generation"),
+                  sources_digest=digest, generated_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    _write_atomic(_report_path(a.out), _dump_pretty(report))
+    print(f"Report: {_report_path(a.out)}")
+    if a.strict and report["conflicts"]:
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
-
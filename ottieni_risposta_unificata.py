@@ -1,35 +1,174 @@
 import os
-import openai
-from langdetect import detect
-from deep_translator import GoogleTranslator
-from dotenv import load_dotenv
+import math
+import threading
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
-load_dotenv()
+import lang_id
+import llm_gateway
+import translation_memory
+from scraper_tecnaria import normalize_text
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
-def ottieni_risposta_unificata(domanda):
+def _load_env() -> None:
+    # python-dotenv solo quando serve davvero (prima chiamata LLM), non all'import
     try:
-        # 🔍 Legge tutti i file .txt nella cartella /documenti
-        documenti_dir = "documenti"
-        contesto = ""
-        for nome_file in os.listdir(documenti_dir):
-            if nome_file.endswith(".txt"):
-                percorso = os.path.join(documenti_dir, nome_file)
-                try:
-                    with open(percorso, "r", encoding="utf-8") as f:
-                        contesto += f"\n\n### FILE: {nome_file} ###\n"
-                        contesto += f.read()
-                except Exception as e:
-                    contesto += f"\n[Errore nella lettura di {nome_file}: {e}]\n"
-
-        # 🔤 Traduzione domanda (per compatibilità con OpenAI)
-        lingua_originale = detect(domanda)
-        domanda_en = GoogleTranslator(source='auto', target='en').translate(domanda)
+        from dotenv import load_dotenv
+        load_dotenv()
+    except Exception:
+        pass
+
+# 📚 Contesto: documenti caricati e spezzati in chunk UNA volta, indicizzati in memoria (BM25)
+DOCUMENTI_DIR = os.getenv("DOCUMENTI_DIR", "documenti")
+CHUNK_CHARS = int(os.getenv("CONTEXT_CHUNK_CHARS", "1200"))
+CONTEXT_TOP_K = int(os.getenv("CONTEXT_TOP_K", "6"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+_BM25_K1 = 1.5
+_BM25_B = 0.75
+
+
+class Chunk(NamedTuple):
+    id: str
+    file: str
+    text: str
+    tokens: int  # stima token (~4 caratteri per token)
+
+
+class _CorpusIndex:
+    def __init__(self, chunks: List[Chunk], postings: Dict[str, List[Tuple[int, int]]], lengths: List[int]):
+        self.chunks = chunks
+        self.postings = postings
+        self.lengths = lengths
+        self.avgdl = (sum(lengths) / len(lengths)) if lengths else 0.0
+
+
+_INDEX: Optional[_CorpusIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def _spezza(nome_file: str, testo: str) -> List[Chunk]:
+    """Chunk per paragrafi, accorpati fino a ~CHUNK_CHARS caratteri."""
+    out: List[Chunk] = []
+    buf: List[str] = []
+    size = 0
+
+    def emetti() -> None:
+        nonlocal size
+        if buf:
+            t = "\n\n".join(buf).strip()
+            if t:
+                out.append(Chunk(f"{nome_file}#{len(out)}", nome_file, t, max(1, len(t) // 4)))
+        buf.clear()
+        size = 0
+
+    for par in testo.split("\n\n"):
+        par = par.strip()
+        if not par:
+            continue
+        while len(par) > CHUNK_CHARS:
+            emetti()
+            buf.append(par[:CHUNK_CHARS])
+            size = CHUNK_CHARS
+            emetti()
+            par = par[CHUNK_CHARS:]
+        if size + len(par) > CHUNK_CHARS:
+            emetti()
+        buf.append(par)
+        size += len(par) + 2
+    emetti()
+    return out
+
+
+def carica_documenti(documenti_dir: str = DOCUMENTI_DIR) -> _CorpusIndex:
+    """Legge tutti i .txt una volta e costruisce l'indice invertito dei chunk."""
+    chunks: List[Chunk] = []
+    for nome_file in sorted(os.listdir(documenti_dir)):
+        if nome_file.endswith(".txt"):
+            percorso = os.path.join(documenti_dir, nome_file)
+            try:
+                with open(percorso, "r", encoding="utf-8") as f:
+                    chunks.extend(_spezza(nome_file, f.read()))
+            except Exception as e:
+                print(f"[CONTESTO][WARN] Errore nella lettura di {nome_file}: {e}")
+
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    lengths: List[int] = []
+    for i, c in enumerate(chunks):
+        toks = normalize_text(c.text).split()
+        lengths.append(len(toks))
+        for t, tf in Counter(toks).items():
+            postings.setdefault(t, []).append((i, tf))
+    print(f"[CONTESTO] {len(chunks)} chunk indicizzati da {documenti_dir}")
+    return _CorpusIndex(chunks, postings, lengths)
+
+
+def _indice() -> _CorpusIndex:
+    global _INDEX
+    if _INDEX is None:
+        with _INDEX_LOCK:
+            if _INDEX is None:
+                _INDEX = carica_documenti()
+    return _INDEX
+
+
+def ricarica_documenti() -> int:
+    global _INDEX
+    idx = carica_documenti()
+    _INDEX = idx
+    return len(idx.chunks)
+
+
+def seleziona_contesto(query: str,
+                       top_k: int = CONTEXT_TOP_K,
+                       token_budget: int = CONTEXT_TOKEN_BUDGET) -> List[Chunk]:
+    """Top-k chunk per BM25 che stanno nel budget di token (in ordine di rilevanza)."""
+    idx = _indice()
+    n = len(idx.chunks)
+    if not n:
+        return []
+    scores: Dict[int, float] = {}
+    for t in set(normalize_text(query).split()):
+        plist = idx.postings.get(t)
+        if not plist:
+            continue
+        idf = math.log(1.0 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+        for i, tf in plist:
+            dl = idx.lengths[i] / idx.avgdl if idx.avgdl else 1.0
+            scores[i] = scores.get(i, 0.0) + idf * tf * (_BM25_K1 + 1) / (tf + _BM25_K1 * (1 - _BM25_B + _BM25_B * dl))
+
+    scelti: List[Chunk] = []
+    usati = 0
+    for i, _ in sorted(scores.items(), key=lambda x: (-x[1], x[0])):
+        c = idx.chunks[i]
+        if usati + c.tokens > token_budget:
+            continue
+        scelti.append(c)
+        usati += c.tokens
+        if len(scelti) >= top_k:
+            break
+    return scelti
+
+
+def ottieni_risposta_unificata_con_meta(domanda: str) -> Dict[str, Any]:
+    """Come ottieni_risposta_unificata, ma restituisce anche i metadati (chunk usati)."""
+    meta: Dict[str, Any] = {"chunk_ids": []}
+    if not llm_gateway.is_configured():
+        _load_env()
+    try:
+        # 🔤 Traduzione domanda (per compatibilità con OpenAI) — via memoria di traduzione
+        lingua_originale = lang_id.detect_lang(domanda)
+        domanda_en = translation_memory.translate(domanda, lingua_originale, 'en')
+        meta["lang"] = lingua_originale
+
+        # 🔍 Solo i chunk rilevanti (documenti in italiano: cerco con domanda originale + traduzione)
+        chunks = seleziona_contesto(f"{domanda} {domanda_en}")
+        meta["chunk_ids"] = [c.id for c in chunks]
+        meta["context_tokens"] = sum(c.tokens for c in chunks)
+        contesto = "".join(f"\n\n### CHUNK: {c.id} ###\n{c.text}" for c in chunks)
 
         # ⚠️ Prompt rigido: NO invenzioni
-        prompt = f"""You are a technical assistant for the company Tecnaria. 
-Only answer using the content provided in the 'context' below. 
+        prompt = f"""You are a technical assistant for the company Tecnaria.
+Only answer using the content provided in the 'context' below.
 If the answer is not explicitly found in the context, simply reply:
 "I'm sorry, I could not find any relevant information in the documents provided."
 
@@ -41,25 +180,32 @@ QUESTION:
 """
 
         # 🧠 Chiamata all’API OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
+        res = llm_gateway.chat(
+            [
                 {"role": "system", "content": "You are a helpful assistant."},
                 {"role": "user", "content": prompt}
             ],
+            model="gpt-4",
+            purpose="documenti",
             temperature=0.0,
             max_tokens=1200
         )
+        if not res.ok:
+            raise RuntimeError(res.error)
 
-        risposta_en = response.choices[0].message["content"]
+        risposta_en = res.content
 
         # 🔁 Traduzione finale nella lingua dell’utente
         if lingua_originale != "en":
-            risposta = GoogleTranslator(source='en', target=lingua_originale).translate(risposta_en)
+            risposta = translation_memory.translate(risposta_en, 'en', lingua_originale)
         else:
             risposta = risposta_en
 
-        return risposta
+        return {"risposta": risposta, "meta": meta}
 
     except Exception as e:
-        return f"Errore durante l'elaborazione: {e}"
+        return {"risposta": f"Errore durante l'elaborazione: {e}", "meta": meta}
+
+
+def ottieni_risposta_unificata(domanda):
+    return ottieni_risposta_unificata_con_meta(domanda)["risposta"]
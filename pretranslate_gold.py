@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Job offline: pre-traduce tutte le answer_it GOLD (master + overlays) in EN/FR/DE/ES.
+
+Output: static/i18n/<lang>.json
+    {"lang": "en", "source": "it", "answers": {"<block id>": {"src": sha256(answer_it), "text": "..."}}}
+
+applastversion.reload_all() li carica come answer_<lang> (solo se l'hash della
+answer_it corrente coincide): a runtime nessuna traduzione per i blocchi GOLD.
+
+Incrementale: le voci con hash invariato non vengono ritradotte; le traduzioni
+passano dalla memoria di traduzione (translation_memory), quindi una riesecuzione
+dopo un'interruzione riparte da dove era arrivata.
+
+Uso:
+    python pretranslate_gold.py            # en fr de es
+    python pretranslate_gold.py en de      # solo alcune lingue
+"""
+
+import json
+import os
+import sys
+from glob import glob
+
+import translation_memory
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "static", "data")
+OVERLAYS_DIR = os.path.join(DATA_DIR, "overlays")
+I18N_DIR = os.path.join(BASE_DIR, "static", "i18n")
+MASTER_PATH = os.path.join(DATA_DIR, "ctf_system_COMPLETE_GOLD_master.json")
+
+TARGET_LANGS = ("en", "fr", "de", "es")
+MAX_CHARS = 4500  # limite GoogleTranslator: 5000 caratteri per richiesta
+
+
+def load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_i18n(lang):
+    path = os.path.join(I18N_DIR, f"{lang}.json")
+    try:
+        data = load_json(path)
+    except Exception:
+        data = None
+    if not isinstance(data, dict) or not isinstance(data.get("answers"), dict):
+        data = {"lang": lang, "source": "it", "answers": {}}
+    return data
+
+
+def gold_blocks():
+    blocks = list(load_json(MASTER_PATH).get("blocks", []))
+    for p in sorted(glob(os.path.join(OVERLAYS_DIR, "*.json"))):
+        blocks.extend(load_json(p).get("blocks", []))
+    by_id = {}
+    for b in blocks:
+        if b.get("id") and b.get("answer_it"):
+            by_id[b["id"]] = b
+    return list(by_id.values())
+
+
+def _pezzi(text):
+    """Spezza per paragrafi sotto MAX_CHARS (le risposte GOLD stanno quasi sempre in un pezzo)."""
+    out, buf = [], ""
+    for par in text.split("\n"):
+        if buf and len(buf) + len(par) + 1 > MAX_CHARS:
+            out.append(buf)
+            buf = ""
+        buf = f"{buf}\n{par}" if buf else par
+    if buf:
+        out.append(buf)
+    return out
+
+
+def traduci(text, lang):
+    return "\n".join(translation_memory.translate(p, "it", lang) for p in _pezzi(text))
+
+
+def main(langs):
+    blocks = gold_blocks()
+    print(f"GOLD: {len(blocks)} blocchi con answer_it")
+    os.makedirs(I18N_DIR, exist_ok=True)
+
+    for lang in langs:
+        data = load_i18n(lang)
+        answers = data["answers"]
+        fatti = saltati = 0
+        for b in blocks:
+            src = translation_memory.text_hash(b["answer_it"])
+            cur = answers.get(b["id"])
+            if cur and cur.get("src") == src and cur.get("text"):
+                saltati += 1
+                continue
+            testo = traduci(b["answer_it"], lang)
+            if testo and testo != b["answer_it"]:
+                answers[b["id"]] = {"src": src, "text": testo}
+                fatti += 1
+
+        # blocchi spariti dal GOLD: via anche dalle traduzioni
+        ids = {b["id"] for b in blocks}
+        for bid in [k for k in answers if k not in ids]:
+            del answers[bid]
+
+        path = os.path.join(I18N_DIR, f"{lang}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+        print(f"[{lang}] tradotti={fatti} invariati={saltati} totale={len(answers)} → {path}")
+
+    print(f"Memoria di traduzione: {translation_memory.get_memory().stats()}")
+
+
+if __name__ == "__main__":
+    main([a.lower() for a in sys.argv[1:]] or list(TARGET_LANGS))
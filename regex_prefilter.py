@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+regex_prefilter.py
+- Estrae da ogni regex i "letterali obbligatori" (ancore): se nessuna ancora compare nel
+  testo, la regex non può matchare e non va nemmeno valutata.
+- LiteralPrefilter: indice trigramma → ancore → chiavi, interrogato con UNA sola scansione
+  del testo. Il costo dipende dalla lunghezza del testo e dalle regole candidate,
+  non dal numero totale di regole.
+- Regole senza ancore utili (es. solo classi/lookahead generici) restano "sempre candidate".
+
+Dipendenze: solo libreria standard.
+"""
+
+from __future__ import annotations
+import re
+from typing import Dict, FrozenSet, Hashable, Iterable, List, Optional, Set, Tuple
+
+try:  # Python >= 3.11
+    from re import _parser as _sre_parse
+    from re import _constants as _sre_c
+except ImportError:  # pragma: no cover - Python < 3.11
+    import sre_parse as _sre_parse
+    import sre_constants as _sre_c
+
+MIN_ANCHOR_LEN = 3
+
+_REPEATS = {_sre_c.MAX_REPEAT, _sre_c.MIN_REPEAT}
+if hasattr(_sre_c, "POSSESSIVE_REPEAT"):
+    _REPEATS.add(_sre_c.POSSESSIVE_REPEAT)
+_ATOMIC = getattr(_sre_c, "ATOMIC_GROUP", None)
+
+
+def _pick(reqs: List[FrozenSet[str]]) -> Optional[FrozenSet[str]]:
+    """Tra più requisiti (tutti obbligatori) sceglie il più selettivo."""
+    if not reqs:
+        return None
+    return max(reqs, key=lambda r: (min(len(a) for a in r), -len(r)))
+
+
+def _requirement(items) -> Optional[FrozenSet[str]]:
+    """
+    Requisito di una sequenza: insieme di ancore di cui ALMENO UNA deve comparire
+    nel testo. None = nessuna ancora utilizzabile.
+    """
+    reqs: List[FrozenSet[str]] = []
+    run: List[str] = []
+
+    def flush() -> None:
+        if len(run) >= MIN_ANCHOR_LEN:
+            reqs.append(frozenset(["".join(run).lower()]))
+        run.clear()
+
+    for op, av in items:
+        if op is _sre_c.LITERAL:
+            run.append(chr(av))
+        elif op is _sre_c.AT:
+            # zero-width (\b, ^, $): non interrompe la sequenza di letterali
+            continue
+        elif op is _sre_c.SUBPATTERN:
+            sub = av[-1]
+            if all(o is _sre_c.LITERAL for o, _ in sub):
+                run.extend(chr(v) for _, v in sub)
+                continue
+            flush()
+            r = _requirement(sub)
+            if r:
+                reqs.append(r)
+        elif op is _sre_c.BRANCH:
+            flush()
+            alts = [_requirement(a) for a in av[1]]
+            if alts and all(alts):
+                reqs.append(frozenset().union(*alts))
+        elif op in _REPEATS:
+            flush()
+            if av[0] >= 1:
+                r = _requirement(av[2])
+                if r:
+                    reqs.append(r)
+        elif op is _sre_c.ASSERT:
+            flush()
+            if av[0] == 1:  # lookahead positivo: il contenuto deve comparire
+                r = _requirement(av[1])
+                if r:
+                    reqs.append(r)
+        elif _ATOMIC is not None and op is _ATOMIC:
+            flush()
+            r = _requirement(av)
+            if r:
+                reqs.append(r)
+        else:
+            flush()
+    flush()
+    return _pick(reqs)
+
+
+def required_literals(pattern: str) -> Optional[FrozenSet[str]]:
+    """
+    Ancore (minuscole) di una regex: il match è possibile solo se almeno una compare
+    nel testo minuscolo. None se la regex non ha ancore sicure.
+    """
+    try:
+        parsed = _sre_parse.parse(pattern)
+    except Exception:
+        return None
+    if parsed.state.flags & re.VERBOSE:
+        return None
+    return _requirement(list(parsed))
+
+
+class LiteralPrefilter:
+    """Indice multi-pattern: chiave → ancore, interrogato con una scansione per testo."""
+
+    def __init__(self) -> None:
+        self._by_tri: Dict[str, List[Tuple[str, Hashable]]] = {}
+        self._always: List[Hashable] = []
+        self.size = 0
+
+    def add(self, key: Hashable, pattern: Optional[str] = None,
+            anchors: Optional[Iterable[str]] = None) -> None:
+        """Registra una chiave con le sue ancore (o le ricava dalla regex)."""
+        anchors_set = frozenset(a.lower() for a in anchors) if anchors is not None else (
+            required_literals(pattern) if pattern else None)
+        self.size += 1
+        if not anchors_set or any(len(a) < MIN_ANCHOR_LEN for a in anchors_set):
+            self._always.append(key)
+            return
+        for a in anchors_set:
+            self._by_tri.setdefault(a[:MIN_ANCHOR_LEN], []).append((a, key))
+
+    @property
+    def always(self) -> Tuple[Hashable, ...]:
+        return tuple(self._always)
+
+    def candidates(self, text: str) -> Set[Hashable]:
+        """Chiavi le cui ancore compaiono nel testo (+ chiavi sempre candidate)."""
+        out: Set[Hashable] = set(self._always)
+        if not self._by_tri or not text:
+            return out
+        low = text.lower()
+        by_tri = self._by_tri
+        for i in range(len(low) - MIN_ANCHOR_LEN + 1):
+            hits = by_tri.get(low[i:i + MIN_ANCHOR_LEN])
+            if not hits:
+                continue
+            for anchor, key in hits:
+                if key not in out and low.startswith(anchor, i):
+                    out.add(key)
+        return out
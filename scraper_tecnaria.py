@@ -2,24 +2,43 @@
 """
 scraper_tecnaria.py
 - Indicizza tutti i .txt in DOC_DIR (default: documenti_gTab)
-- Estrae TAG e coppie D:/R: (domanda/risposta)
+- Estrae TAG e coppie D:/R: (domanda/risposta) con parser in streaming (file anche da centinaia di MB)
 - Retrieval ibrido: BM25 (rank-bm25) + keyword overlap + fuzzy (rapidfuzz) + boost TAG/nome file
-- Ritorna SOLO la risposta (mai "D:" in output). Aggiunge opzionale arricchimento Sinapsi (topics/rules).
+- Ritorna SOLO la risposta (mai "D:" in output). Aggiunge opzionale arricchimento Sinapsi (topics/rules),
+  compilato al load in una tabella di dispatch token → regole.
 - Robusto: se BM25/rapidfuzz mancano, cade su keyword senza errori.
 
+- Indice immutabile e versionato: ogni build produce un nuovo snapshot pubblicato con
+  un unico swap atomico; le query in corso continuano sullo snapshot precedente.
+- Parsing/tokenizzazione in process pool (spawn, entry point txt_parser) per corpora grandi (INDEX_WORKERS), merge in ordine file.
+
 API esposte:
 - build_index(doc_dir) -> int
-- is_ready() -> bool
-- search_best_answer(q) -> {answer, found, score, from, tags, matched_question?}
+- rebuild_index_async(doc_dir) -> threading.Thread (build in background + swap)
+- is_ready() -> int (versione corrente, 0 = indice non pronto)
+- current_index() -> IndexSnapshot
+- search_best_answer(q) -> {answer, found, score, from, tags, matched_question?, index_version}
 - INDEX -> indice globale (for debugging/log)
 """
 
 from __future__ import annotations
+import functools
+import multiprocessing
 import os
 import re
 import json
-import unicodedata
-from typing import Any, Dict, List, Tuple, Optional
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Tuple, Optional
+
+import txt_parser
+from event_log import diag
+from regex_prefilter import LiteralPrefilter
+# parser e normalizzazione in un modulo foglia (entry point dei worker spawn); riesportati qui
+from txt_parser import (STOPWORDS_MIN, STREAM_CHUNK_CHARS, iter_txt_records, normalize_text,  # noqa: F401
+                        parse_txt_file, strip_accents)
+from txt_parser import item_tokens as _item_tokens
 
 # ===== Dipendenze soft =====
 try:
@@ -52,25 +71,61 @@ TOP_K = int(os.getenv("TOP_K", os.getenv("TOPK_SEMANTIC", "8")))
 MIN_CHARS_PER_CHUNK = int(os.getenv("MIN_CHARS_PER_CHUNK", "500"))
 MAX_ANSWER_CHARS = int(os.getenv("MAX_ANSWER_CHARS", "1200"))
 DEBUG = os.getenv("DEBUG_SCRAPER", os.getenv("DEBUG", "0")) == "1"
+# Parsing parallelo: 0 = auto (cpu_count), 1 = sequenziale; pool solo oltre N file
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "0"))
+INDEX_PARALLEL_MIN_FILES = int(os.getenv("INDEX_PARALLEL_MIN_FILES", "64"))
 
 SINAPSI_ENABLE = os.getenv("SINAPSI_ENABLE", "1") == "1"
 SINAPSI_PATH = os.getenv("SINAPSI_BOT_JSON", "SINAPSI_BOT.JSON")
+_CRITICI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "static", "data", "critici")
+SINAPSI_EXTRA_PATHS = [p for p in os.getenv(
+    "SINAPSI_EXTRA_PATHS",
+    os.pathsep.join([os.path.join(_CRITICI_DIR, "sinapsi_rules.json"), os.path.join(_CRITICI_DIR, "sinapsi_brain.json")]),
+).split(os.pathsep) if p.strip()]
 
 # ===== Stato globale =====
+class SinapsiRule(NamedTuple):
+    order: int
+    if_any: frozenset
+    if_all: frozenset
+    regex: Optional[Any]
+    add: str
+
+class SinapsiCompiled(NamedTuple):
+    """Sinapsi compilato al load: dispatch token → regole, niente normalizzazioni per query."""
+    topics: Dict[str, Tuple[Tuple[int, str], ...]]
+    rules: Tuple[SinapsiRule, ...]
+    by_token: Dict[str, Tuple[int, ...]]
+    always: Tuple[int, ...]
+    patterns: LiteralPrefilter
+    prefix: str
+    suffix: str
+
+    def __bool__(self) -> bool:
+        return bool(self.topics or self.rules or self.prefix or self.suffix)
+
+class IndexSnapshot(NamedTuple):
+    """Indice completo e immutabile: items, BM25 e Sinapsi viaggiano sempre insieme."""
+    version: int
+    items: Tuple[Dict[str, Any], ...]
+    bm25: Optional[Any]
+    corpus_tokens: Tuple[Tuple[str, ...], ...]
+    sinapsi: Optional[SinapsiCompiled]
+    doc_dir: str
+
+_EMPTY_SNAPSHOT = IndexSnapshot(0, (), None, (), None, "")
+
+# Unico riferimento pubblicato: si legge una volta per query, si sostituisce con un solo assegnamento.
+_CURRENT: IndexSnapshot = _EMPTY_SNAPSHOT
+_VERSION_LOCK = threading.Lock()
+_BUILD_LOCK = threading.Lock()
+_LAST_VERSION = 0
+
+# Alias di compatibilità (solo debug/log): riflettono lo snapshot corrente.
 INDEX: List[Dict[str, Any]] = []
 _BM25: Optional[BM25Okapi] = None
 _CORPUS_TOKENS: List[List[str]] = []
-_SINAPSI: Dict[str, Any] = {}
-
-# ===== Stopwords / Normalizzazione =====
-STOPWORDS_MIN = {
-    "il","lo","la","i","gli","le","un","uno","una","di","del","della","dei","degli","delle",
-    "e","ed","o","con","per","su","tra","fra","in","da","al","allo","ai","agli","alla","alle",
-    "che","come","dove","quando","anche","mi","ti","si","ci","vi","a","da","de","dal","dall",
-    "dalla","dalle","non","piu","meno","solo","qual","quale","quali","quanta","quante","quanto",
-    "questa","questo","questi","queste","quella","quello","quelli","quelle"
-}
-_WHITES = re.compile(r"\s+", flags=re.UNICODE)
+_SINAPSI: Optional[SinapsiCompiled] = None
 
 SYN_QUERY = {
     "p560": ["p 560","p-560","spit","spit p560","sparachiodi","chiodatrice","pistola a cartuccia","pistola a polvere"],
@@ -82,19 +137,6 @@ SYN_QUERY = {
     "documenti": ["documentazione","eta","dop","ce","manuale","relazione","schede"]
 }
 
-def strip_accents(s: str) -> str:
-    return "".join(ch for ch in unicodedata.normalize("NFKD", s) if not unicodedata.combining(ch))
-
-def normalize_text(s: str) -> str:
-    if not s:
-        return ""
-    s = s.lower()
-    s = strip_accents(s)
-    s = re.sub(r"[^a-z0-9àèéìòóùç\s\-_]", " ", s)
-    s = _WHITES.sub(" ", s).strip()
-    toks = [t for t in s.split() if t not in STOPWORDS_MIN]
-    return " ".join(toks)
-
 def expand_query_synonyms(q: str) -> str:
     base = normalize_text(q)
     tokens = base.split()
@@ -112,65 +154,6 @@ def expand_query_synonyms(q: str) -> str:
             seen.add(t)
     return " ".join(out)
 
-# ===== Parsing TXT =====
-_TAGS_RE = re.compile(r"^\s*\[TAGS\s*:\s*(.*?)\]\s*$", re.IGNORECASE)
-_D_RE = re.compile(r"^\s*(D|DOMANDA)\s*:\s*(.*)$", re.IGNORECASE)
-_R_RE = re.compile(r"^\s*(R|RISPOSTA)\s*:\s*(.*)$", re.IGNORECASE)
-
-def parse_txt_file(path: str) -> Dict[str, Any]:
-    tags: List[str] = []
-    qas: List[Dict[str, str]] = []
-    text_lines: List[str] = []
-
-    with open(path, "r", encoding="utf-8", errors="ignore") as f:
-        lines = f.read().splitlines()
-
-    cur_q: Optional[str] = None
-    cur_a: List[str] = []
-
-    for raw in lines:
-        line = raw.rstrip("\n")
-
-        m_tags = _TAGS_RE.match(line)
-        if m_tags:
-            tline = m_tags.group(1)
-            parts = [t.strip() for t in tline.split(",") if t.strip()]
-            tags.extend(parts)
-            continue
-
-        m_d = _D_RE.match(line)
-        if m_d:
-            if cur_q is not None:
-                qas.append({"q": (cur_q or "").strip(), "a": "\n".join(cur_a).strip()})
-            cur_q = m_d.group(2).strip()
-            cur_a = []
-            continue
-
-        m_r = _R_RE.match(line)
-        if m_r:
-            cur_a.append(m_r.group(2))
-            continue
-
-        # linea generica
-        text_lines.append(line)
-        if cur_q is not None:
-            cur_a.append(line)
-
-    if cur_q is not None:
-        qas.append({"q": (cur_q or "").strip(), "a": "\n".join(cur_a).strip()})
-
-    full_text = "\n".join(text_lines).strip()
-    return {
-        "file": os.path.basename(path),
-        "path": path,
-        "name": os.path.splitext(os.path.basename(path))[0].lower(),
-        "tags": tags,
-        "norm_tags": [normalize_text(t) for t in tags],
-        "qas": qas,
-        "text": full_text,
-        "norm": normalize_text(full_text)
-    }
-
 def list_txt_files(doc_dir: str) -> List[str]:
     out = []
     for root, _, files in os.walk(doc_dir):
@@ -181,21 +164,12 @@ def list_txt_files(doc_dir: str) -> List[str]:
     return out
 
 # ===== Indicizzazione =====
-def _build_bm25(items: List[Dict[str, Any]]) -> Tuple[Optional[BM25Okapi], List[List[str]]]:
+def _build_bm25(items: List[Dict[str, Any]],
+                corpus_tokens: Optional[List[List[str]]] = None) -> Tuple[Optional[BM25Okapi], List[List[str]]]:
     if BM25Okapi is None or np is None:
         return None, []
-    corpus_tokens: List[List[str]] = []
-    for it in items:
-        toks = []
-        if it.get("norm"):
-            toks.extend(it["norm"].split())
-        for qa in it.get("qas", []):
-            qn = normalize_text(qa.get("q", ""))
-            toks.extend(qn.split())
-            an = normalize_text(qa.get("a", ""))
-            # (opzionale) includiamo anche risposta per migliorare recall
-            toks.extend(an.split())
-        corpus_tokens.append([t for t in toks if t])
+    if corpus_tokens is None:
+        corpus_tokens = [_item_tokens(it) for it in items]
     if not corpus_tokens:
         return None, []
     try:
@@ -204,55 +178,203 @@ def _build_bm25(items: List[Dict[str, Any]]) -> Tuple[Optional[BM25Okapi], List[
     except Exception:
         return None, []
 
-def build_index(doc_dir: Optional[str] = None) -> int:
-    """Costruisce indice globale e carica Sinapsi."""
-    global INDEX, _BM25, _CORPUS_TOKENS, _SINAPSI
-    base = doc_dir or DOC_DIR
-    print(f"[SCRAPER] Indicizzazione da: {os.path.abspath(base)}", flush=True)
+def _parse_for_index(path: str) -> Tuple[Optional[Dict[str, Any]], Optional[List[str]], Optional[str]]:
+    """Unità di lavoro in processo: vedi txt_parser.parse_for_index."""
+    return txt_parser.parse_for_index(path, MIN_CHARS_PER_CHUNK, BM25Okapi is not None and np is not None)
+
+def _index_workers(n_files: int) -> int:
+    if n_files < INDEX_PARALLEL_MIN_FILES:
+        return 1
+    workers = INDEX_WORKERS if INDEX_WORKERS > 0 else (os.cpu_count() or 1)
+    return max(1, min(workers, n_files))
+
+def _parse_all(paths: List[str]) -> Tuple[List[Dict[str, Any]], Optional[List[List[str]]]]:
+    """Parsing di tutti i file; l'ordine del risultato segue sempre `paths` (indice identico)."""
+    workers = _index_workers(len(paths))
+    t0 = time.perf_counter()
+    if workers > 1:
+        chunk = max(1, len(paths) // (workers * 8))
+        try:
+            # spawn, non fork: il rebuild gira in un thread del server (processo multithread)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as ex:
+                # txt_parser.parse_for_index, non _parse_for_index: il worker importa solo il parser
+                work = functools.partial(txt_parser.parse_for_index, min_chars=MIN_CHARS_PER_CHUNK,
+                                         with_tokens=BM25Okapi is not None and np is not None)
+                results = list(ex.map(work, paths, chunksize=chunk))
+        except Exception as e:
+            diag("SCRAPER", f"Pool di parsing non disponibile ({e}), passo al sequenziale", "warn")
+            workers = 1
+            results = [_parse_for_index(p) for p in paths]
+    else:
+        results = [_parse_for_index(p) for p in paths]
+
+    items: List[Dict[str, Any]] = []
+    tokens: List[List[str]] = []
+    for p, (it, toks, err) in zip(paths, results):
+        if err is not None:
+            diag("SCRAPER", f"Errore parsing {p}: {err}", "warn")
+        if it is None:
+            continue
+        items.append(it)
+        if toks is not None:
+            tokens.append(toks)
+
+    dt = time.perf_counter() - t0
+    rate = len(paths) / dt if dt > 0 else float("inf")
+    diag("SCRAPER", f"Parsing {len(paths)} file in {dt:.2f}s ({rate:.0f} file/s, workers={workers})")
+    return items, (tokens if len(tokens) == len(items) else None)
+
+def _compile_sinapsi(sources: List[Any]) -> Optional[SinapsiCompiled]:
+    """
+    Compila una o più sorgenti Sinapsi:
+    - dict {topics, rules[if_any/if_all/add], prefix, suffix} (SINAPSI_BOT.JSON)
+    - lista [{id, pattern, mode, answer}] (critici/sinapsi_rules.json, sinapsi_brain.json):
+      entrano nell'arricchimento solo le voci mode="augment" (le override le gestisce l'API).
+    Ogni regola viene indicizzata sui suoi token trigger: a runtime si valutano solo
+    le regole i cui token compaiono nella query.
+    """
+    topics: Dict[str, List[Tuple[int, str]]] = {}
+    rules: List[SinapsiRule] = []
+    by_token: Dict[str, List[int]] = {}
+    always: List[int] = []
+    patterns = LiteralPrefilter()
+    prefix = suffix = ""
+    t_order = 0
+
+    for src in sources:
+        if isinstance(src, dict):
+            for k, v in (src.get("topics", {}) or {}).items():
+                text = str(v).strip()
+                topics.setdefault(normalize_text(k), []).append((t_order, text))
+                t_order += 1
+            for r in (src.get("rules", []) or []):
+                if_any = frozenset(normalize_text(x) for x in (r.get("if_any") or []))
+                if_all = frozenset(normalize_text(x) for x in (r.get("if_all") or []))
+                rule = SinapsiRule(len(rules), if_any, if_all, None, str(r.get("add", "")).strip())
+                # if_any vuoto → basta un qualunque token di if_all come chiave di dispatch
+                keys = if_any or (frozenset([min(if_all)]) if if_all else frozenset())
+                if keys:
+                    for t in keys:
+                        by_token.setdefault(t, []).append(rule.order)
+                else:
+                    always.append(rule.order)
+                rules.append(rule)
+            prefix = prefix or str(src.get("prefix", "")).strip()
+            suffix = suffix or str(src.get("suffix", "")).strip()
+        elif isinstance(src, list):
+            for r in src:
+                if not isinstance(r, dict) or (r.get("mode") or "augment") != "augment":
+                    continue
+                try:
+                    rx = re.compile(r.get("pattern") or "")
+                except re.error as e:
+                    diag("SCRAPER", f"Sinapsi pattern non valido ({r.get('id')}): {e}", "warn")
+                    continue
+                rule = SinapsiRule(len(rules), frozenset(), frozenset(), rx, str(r.get("answer", "")).strip())
+                patterns.add(rule.order, rx.pattern)
+                rules.append(rule)
+
+    compiled = SinapsiCompiled(
+        topics={k: tuple(v) for k, v in topics.items()},
+        rules=tuple(rules),
+        by_token={k: tuple(v) for k, v in by_token.items()},
+        always=tuple(always),
+        patterns=patterns,
+        prefix=prefix,
+        suffix=suffix,
+    )
+    return compiled if compiled else None
+
+def _load_sinapsi() -> Optional[SinapsiCompiled]:
+    if not SINAPSI_ENABLE:
+        return None
+    sources: List[Any] = []
+    for path in [SINAPSI_PATH] + SINAPSI_EXTRA_PATHS:
+        try:
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                    data = json.load(f) or {}
+                sources.append(data)
+                if isinstance(data, dict):
+                    diag("SCRAPER", f"Sinapsi ON (rules={len(data.get('rules', []))}, topics={len(data.get('topics', {}))}) file={path}")
+                else:
+                    diag("SCRAPER", f"Sinapsi ON (patterns={len(data)}) file={path}")
+            else:
+                diag("SCRAPER", f"Sinapsi file non trovato: {os.path.abspath(path)}")
+        except Exception as e:
+            diag("SCRAPER", f"Errore lettura Sinapsi {path}: {e}", "warn")
+    return _compile_sinapsi(sources)
+
+def _next_version() -> int:
+    global _LAST_VERSION
+    with _VERSION_LOCK:
+        _LAST_VERSION += 1
+        return _LAST_VERSION
+
+def _build_snapshot(base: str) -> IndexSnapshot:
+    """Costruisce un nuovo snapshot completo senza toccare quello pubblicato."""
+    diag("SCRAPER", f"Indicizzazione da: {os.path.abspath(base)}")
 
     if not os.path.exists(base):
-        INDEX = []
-        _BM25 = None
-        _CORPUS_TOKENS = []
-        print(f"[SCRAPER][WARN] DOC_DIR non esiste: {base}", flush=True)
-        return 0
+        diag("SCRAPER", f"DOC_DIR non esiste: {base}", "warn")
+        return IndexSnapshot(_next_version(), (), None, (), None, base)
 
+    t0 = time.perf_counter()
     paths = list_txt_files(base)
-    print(f"[SCRAPER] Trovati {len(paths)} file .txt", flush=True)
+    diag("SCRAPER", f"Trovati {len(paths)} file .txt")
 
-    items: List[Dict[str, Any]] = []
-    for p in paths:
-        try:
-            it = parse_txt_file(p)
-            # filtra i blocchi troppo corti, ma garantisci almeno 1 item per file
-            keep = (len((it.get("text") or "")) >= MIN_CHARS_PER_CHUNK) or it.get("qas")
-            if keep:
-                items.append(it)
-        except Exception as e:
-            print(f"[SCRAPER][WARN] Errore parsing {p}: {e}", flush=True)
+    items, tokens = _parse_all(paths)
 
     # BM25
-    _BM25, _CORPUS_TOKENS = _build_bm25(items)
+    bm25, corpus_tokens = _build_bm25(items, tokens)
 
     # carica Sinapsi
-    _SINAPSI = {}
-    if SINAPSI_ENABLE:
-        try:
-            if os.path.exists(SINAPSI_PATH):
-                with open(SINAPSI_PATH, "r", encoding="utf-8", errors="ignore") as f:
-                    _SINAPSI = json.load(f) or {}
-                print(f"[SCRAPER] Sinapsi ON (rules={len(_SINAPSI.get('rules', []))}, topics={len(_SINAPSI.get('topics', {}))}) file={SINAPSI_PATH}", flush=True)
-            else:
-                print(f"[SCRAPER] Sinapsi file non trovato: {os.path.abspath(SINAPSI_PATH)}", flush=True)
-        except Exception as e:
-            print(f"[SCRAPER][WARN] Errore lettura Sinapsi: {e}", flush=True)
-
-    INDEX = items
-    print(f"[SCRAPER] Compat: INDEX len={len(INDEX)}", flush=True)
-    return len(INDEX)
+    sinapsi = _load_sinapsi()
+    diag("SCRAPER", f"Build indice completata in {time.perf_counter() - t0:.2f}s")
+
+    return IndexSnapshot(
+        version=_next_version(),
+        items=tuple(items),
+        bm25=bm25,
+        corpus_tokens=tuple(tuple(t) for t in corpus_tokens),
+        sinapsi=sinapsi,
+        doc_dir=base,
+    )
+
+def _publish(snap: IndexSnapshot) -> None:
+    """Swap atomico dello snapshot corrente (+ alias di compatibilità)."""
+    global _CURRENT, INDEX, _BM25, _CORPUS_TOKENS, _SINAPSI
+    _CURRENT = snap
+    INDEX = list(snap.items)
+    _BM25 = snap.bm25
+    _CORPUS_TOKENS = [list(t) for t in snap.corpus_tokens]
+    _SINAPSI = snap.sinapsi
 
-def is_ready() -> bool:
-    return bool(INDEX)
+def build_index(doc_dir: Optional[str] = None) -> int:
+    """Costruisce indice globale e carica Sinapsi (sincrono, pubblica a fine build)."""
+    base = doc_dir or DOC_DIR
+    with _BUILD_LOCK:
+        snap = _build_snapshot(base)
+        _publish(snap)
+    diag("SCRAPER", f"Compat: INDEX len={len(snap.items)} version={snap.version}")
+    return len(snap.items)
+
+def rebuild_index_async(doc_dir: Optional[str] = None) -> threading.Thread:
+    """
+    Ricostruisce l'indice in un thread di background.
+    Le query continuano a girare sullo snapshot corrente finché il nuovo non è pubblicato.
+    """
+    t = threading.Thread(target=build_index, args=(doc_dir,), name="scraper-rebuild", daemon=True)
+    t.start()
+    return t
+
+def current_index() -> IndexSnapshot:
+    return _CURRENT
+
+def is_ready() -> int:
+    """Versione dello snapshot pubblicato se contiene documenti, altrimenti 0 (falsy)."""
+    snap = _CURRENT
+    return snap.version if snap.items else 0
 
 # ===== Scoring =====
 def _keyword_overlap(q: str, doc_norm: str) -> float:
@@ -313,33 +435,36 @@ def _pick_best_answer_text(query: str, item: Dict[str, Any]) -> Tuple[str, Optio
     return best_ans or "", best_q
 
 # ===== Sinapsi =====
-def _sinapsi_enrich(answer: str, query: str) -> str:
-    if not SINAPSI_ENABLE or not _SINAPSI:
+def _sinapsi_enrich(answer: str, query: str, sinapsi: Optional[SinapsiCompiled] = None) -> str:
+    sinapsi = _CURRENT.sinapsi if sinapsi is None else sinapsi
+    if not SINAPSI_ENABLE or not sinapsi:
         return answer
     nq = set(normalize_text(query).split())
     out_parts: List[str] = []
 
-    # topics
-    topics = _SINAPSI.get("topics", {}) or {}
-    for k, v in topics.items():
-        nk = normalize_text(k)
-        if nk in nq:
-            out_parts.append(str(v).strip())
-
-    # rules
-    rules = _SINAPSI.get("rules", []) or []
-    for r in rules:
-        if_any = [normalize_text(x) for x in (r.get("if_any") or [])]
-        if_all = [normalize_text(x) for x in (r.get("if_all") or [])]
-        ok_any = (not if_any) or any(t in nq for t in if_any)
-        ok_all = all(t in nq for t in if_all) if if_all else True
-        if ok_any and ok_all:
-            add = str(r.get("add", "")).strip()
-            if add:
-                out_parts.append(add)
-
-    prefix = str(_SINAPSI.get("prefix", "")).strip()
-    suffix = str(_SINAPSI.get("suffix", "")).strip()
+    # topics (lookup diretto per token, ordine del file preservato)
+    hits = [x for t in nq for x in sinapsi.topics.get(t, ())]
+    out_parts.extend(text for _, text in sorted(hits))
+
+    # rules: solo quelle raggiunte dai token della query (o dalle ancore dei pattern)
+    cand = set(sinapsi.always)
+    for t in nq:
+        cand.update(sinapsi.by_token.get(t, ()))
+    if sinapsi.patterns.size:
+        cand.update(sinapsi.patterns.candidates(query))
+    for i in sorted(cand):
+        r = sinapsi.rules[i]
+        if r.regex is not None:
+            ok = r.regex.search(query) is not None
+        else:
+            ok_any = (not r.if_any) or not r.if_any.isdisjoint(nq)
+            ok_all = r.if_all.issubset(nq)
+            ok = ok_any and ok_all
+        if ok and r.add:
+            out_parts.append(r.add)
+
+    prefix = sinapsi.prefix
+    suffix = sinapsi.suffix
 
     final = answer.strip()
     if prefix:
@@ -353,7 +478,11 @@ def _sinapsi_enrich(answer: str, query: str) -> str:
 
 # ===== Ricerca =====
 def search_best_answer(query: str) -> Dict[str, Any]:
-    if not INDEX:
+    # un solo snapshot per tutta la query: items e BM25 sono sempre coerenti
+    snap = _CURRENT
+    items = snap.items
+    bm25 = snap.bm25
+    if not items:
         return {"answer": "Indice non pronto.", "found": False, "from": None}
 
     nq_base = normalize_text(query)
@@ -361,10 +490,10 @@ def search_best_answer(query: str) -> Dict[str, Any]:
 
     # BM25 una volta sola
     bm_scores = None
-    if _BM25 is not None and np is not None:
+    if bm25 is not None and np is not None:
         try:
             q_tokens = nq.split()
-            bm_arr = _BM25.get_scores(q_tokens)
+            bm_arr = bm25.get_scores(q_tokens)
             bm_max = float(np.max(bm_arr)) if getattr(bm_arr, "size", 0) > 0 else 1.0
             bm_scores = (bm_arr / bm_max) if bm_max > 0 else bm_arr
         except Exception:
@@ -372,7 +501,7 @@ def search_best_answer(query: str) -> Dict[str, Any]:
 
     # scoring ibrido
     scored: List[Tuple[float, Dict[str, Any]]] = []
-    for idx, it in enumerate(INDEX):
+    for idx, it in enumerate(items):
         kw = _keyword_overlap(nq, it.get("norm", ""))
         fz = (fuzz.token_set_ratio(nq, it.get("norm", "")) / 100.0) if it.get("norm") else 0.0
         bs = _boost_name_tags(it, nq)
@@ -396,16 +525,16 @@ def search_best_answer(query: str) -> Dict[str, Any]:
     if norm_score < SIMILARITY_THRESHOLD:
         # second chance con query base (senza espansione sinonimi)
         bm_scores2 = None
-        if _BM25 is not None and np is not None:
+        if bm25 is not None and np is not None:
             try:
-                bm_arr2 = _BM25.get_scores(nq_base.split())
+                bm_arr2 = bm25.get_scores(nq_base.split())
                 bm_max2 = float(np.max(bm_arr2)) if getattr(bm_arr2, "size", 0) > 0 else 1.0
                 bm_scores2 = (bm_arr2 / bm_max2) if bm_max2 > 0 else bm_arr2
             except Exception:
                 bm_scores2 = None
 
         rescored: List[Tuple[float, Dict[str, Any]]] = []
-        for idx, it in enumerate(INDEX):
+        for idx, it in enumerate(items):
             kw = _keyword_overlap(nq_base, it.get("norm", ""))
             fz = (fuzz.token_set_ratio(nq_base, it.get("norm", "")) / 100.0) if it.get("norm") else 0.0
             bs = _boost_name_tags(it, nq_base)
@@ -419,7 +548,7 @@ def search_best_answer(query: str) -> Dict[str, Any]:
 
     # Enrichment Sinapsi
     try:
-        answer_txt = _sinapsi_enrich(answer_txt, query)
+        answer_txt = _sinapsi_enrich(answer_txt, query, snap.sinapsi)
     except Exception:
         pass
 
@@ -428,7 +557,8 @@ def search_best_answer(query: str) -> Dict[str, Any]:
         "found": True,
         "score": round(norm_score, 3),
         "from": best_item.get("file"),
-        "tags": best_item.get("tags") or []
+        "tags": best_item.get("tags") or [],
+        "index_version": snap.version
     }
     # For debugging UI (puoi decidere di nasconderlo in app.py)
     if matched_q:
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+singleflight.py
+---------------
+Coalescenza delle richieste identiche in volo (pattern "single-flight").
+
+Chiave = domanda normalizzata + percorso di risposta (es. "gold", "rerank:<id candidati>").
+La prima richiesta (leader) esegue la chiamata a monte; i duplicati concorrenti
+aspettano lo stesso risultato. In un picco (newsletter, fiera) le chiamate LLM
+scendono a una per domanda distinta. llm_cache copre i duplicati *successivi*,
+qui si coprono quelli *simultanei*.
+
+- waiter limitati (max_waiters): oltre soglia → SingleFlightFull
+- i waiter seguono il leader: se il leader va in timeout o fallisce ricevono
+  la stessa eccezione; se il leader viene cancellato → LeaderCancelled
+- la cancellazione di un waiter non tocca il leader né gli altri waiter
+
+AsyncSingleFlight per handler async (app.py), SingleFlight per codice sincrono
+(threadpool FastAPI, applastversion.ai_rerank).
+
+Env: SINGLEFLIGHT_MAX_WAITERS (default 256)
+"""
+
+from __future__ import annotations
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+MAX_WAITERS = int(os.getenv("SINGLEFLIGHT_MAX_WAITERS", "256"))
+
+
+class SingleFlightFull(Exception):
+    """Troppi waiter sulla stessa chiave."""
+
+
+class LeaderCancelled(Exception):
+    """La richiesta leader è stata cancellata: i waiter non hanno un risultato."""
+
+
+class _Stats:
+    def __init__(self) -> None:
+        self.leaders = 0
+        self.shared = 0
+        self.rejected = 0
+
+    def as_dict(self, inflight: int) -> Dict[str, int]:
+        return {"leaders": self.leaders, "shared": self.shared, "rejected": self.rejected, "inflight": inflight}
+
+
+class _AsyncCall:
+    __slots__ = ("future", "waiters")
+
+    def __init__(self, future: asyncio.Future) -> None:
+        self.future = future
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """Da usare sempre dallo stesso event loop (un worker uvicorn = un loop)."""
+
+    def __init__(self, max_waiters: int = MAX_WAITERS) -> None:
+        self.max_waiters = max_waiters
+        self._calls: Dict[str, _AsyncCall] = {}
+        self._stats = _Stats()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]],
+                 timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """(risultato, condiviso). condiviso=True se servito dal leader di un'altra richiesta."""
+        call = self._calls.get(key)
+        if call is not None:
+            if call.waiters >= self.max_waiters:
+                self._stats.rejected += 1
+                raise SingleFlightFull(key)
+            call.waiters += 1
+            self._stats.shared += 1
+            try:
+                # shield: se QUESTO waiter viene cancellato, il future condiviso resta intatto
+                return await asyncio.shield(call.future), True
+            except asyncio.CancelledError:
+                if call.future.cancelled():
+                    raise LeaderCancelled(key) from None
+                raise
+            finally:
+                call.waiters -= 1
+
+        fut = asyncio.get_running_loop().create_future()
+        # eccezione del leader senza waiter: evita il warning "exception was never retrieved"
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        call = _AsyncCall(fut)
+        self._calls[key] = call
+        self._stats.leaders += 1
+        try:
+            result = await asyncio.wait_for(fn(), timeout) if timeout else await fn()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result, False
+        finally:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        return self._stats.as_dict(len(self._calls))
+
+
+class _SyncCall:
+    __slots__ = ("future", "waiters", "deadline")
+
+    def __init__(self, deadline: Optional[float]) -> None:
+        self.future: Future = Future()
+        self.waiters = 0
+        self.deadline = deadline
+
+
+class SingleFlight:
+    """Versione thread-safe per funzioni bloccanti."""
+
+    def __init__(self, max_waiters: int = MAX_WAITERS) -> None:
+        self.max_waiters = max_waiters
+        self._calls: Dict[str, _SyncCall] = {}
+        self._lock = threading.Lock()
+        self._stats = _Stats()
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        timeout = scadenza del leader: i waiter non aspettano oltre (TimeoutError).
+        Il leader bloccante non si può interrompere: il suo limite è quello di fn stessa.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                if call.waiters >= self.max_waiters:
+                    self._stats.rejected += 1
+                    raise SingleFlightFull(key)
+                call.waiters += 1
+                self._stats.shared += 1
+                leader = False
+            else:
+                call = _SyncCall(time.monotonic() + timeout if timeout else None)
+                self._calls[key] = call
+                self._stats.leaders += 1
+                leader = True
+
+        if not leader:
+            try:
+                remaining = None if call.deadline is None else max(0.0, call.deadline - time.monotonic())
+                return call.future.result(timeout=remaining), True
+            except FutureTimeout:
+                raise TimeoutError(f"single-flight: leader oltre il timeout ({key})") from None
+            finally:
+                with self._lock:
+                    call.waiters -= 1
+
+        try:
+            result = fn()
+        except BaseException as e:
+            call.future.set_exception(e)
+            raise
+        else:
+            call.future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return self._stats.as_dict(len(self._calls))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+startup.py
+----------
+Avvio misurato e warm-up esplicito.
+
+- step(nome, fase): misura (ms) import e caricamenti → report di avvio per passo
+- @on_warmup(nome): registra lavoro da fare PRIMA di servire traffico
+  (compilazione regex, trie intenti, modello lingua, import pesanti)
+- warmup(): esegue i warm-up una volta sola; con gunicorn --preload gira nel master
+  prima del fork (vedi gunicorn.conf.py) e i worker nascono già caldi;
+  con uvicorn singolo gira in background all'evento startup (warmup_async)
+- is_ready()/report(): stato per /ready (distinto dalla liveness)
+
+Nei warm-up NON aprire connessioni (SQLite, HTTP): non sopravvivono al fork.
+"""
+
+from __future__ import annotations
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+_T0 = time.perf_counter()
+_STEPS: List[Dict[str, Any]] = []
+_WARMUPS: List[Tuple[str, Callable[[], Any]]] = []
+_LOCK = threading.Lock()
+_STATE = {"ready": False, "running": False, "errors": {}, "warm_ms": None}
+
+
+@contextmanager
+def step(name: str, phase: str = "load") -> Iterator[None]:
+    t = time.perf_counter()
+    err: Optional[str] = None
+    try:
+        yield
+    except Exception as e:
+        err = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        rec = {"phase": phase, "name": name, "ms": round((time.perf_counter() - t) * 1000, 2)}
+        if err:
+            rec["error"] = err
+        _STEPS.append(rec)
+
+
+def timed_import(module: str) -> Any:
+    with step(module, "import"):
+        return importlib.import_module(module)
+
+
+def on_warmup(name: str) -> Callable[[Callable[[], Any]], Callable[[], Any]]:
+    def deco(fn: Callable[[], Any]) -> Callable[[], Any]:
+        _WARMUPS.append((name, fn))
+        return fn
+    return deco
+
+
+def warmup() -> bool:
+    """Esegue i warm-up registrati (idempotente). True se tutti riusciti."""
+    with _LOCK:
+        if _STATE["ready"] or _STATE["running"]:
+            return _STATE["ready"]
+        _STATE["running"] = True
+    t = time.perf_counter()
+    errors: Dict[str, str] = {}
+    for name, fn in list(_WARMUPS):
+        try:
+            with step(name, "warmup"):
+                fn()
+        except Exception as e:
+            errors[name] = f"{type(e).__name__}: {e}"
+            print(f"[STARTUP][WARN] warm-up '{name}' fallito: {e}")
+    with _LOCK:
+        _STATE["errors"] = errors
+        _STATE["warm_ms"] = round((time.perf_counter() - t) * 1000, 2)
+        _STATE["ready"] = not errors
+        _STATE["running"] = False
+    print(f"[STARTUP] warm-up {'ok' if not errors else 'con errori'} in {_STATE['warm_ms']} ms "
+          f"({len(_WARMUPS)} passi)")
+    return _STATE["ready"]
+
+
+def warmup_async() -> Optional[threading.Thread]:
+    """Warm-up in background (server già in ascolto, /ready a 503 finché non finisce)."""
+    if _STATE["ready"] or _STATE["running"]:
+        return None
+    th = threading.Thread(target=warmup, name="warmup", daemon=True)
+    th.start()
+    return th
+
+
+def is_ready() -> bool:
+    return bool(_STATE["ready"])
+
+
+def report() -> Dict[str, Any]:
+    by_phase: Dict[str, float] = {}
+    for s in _STEPS:
+        by_phase[s["phase"]] = round(by_phase.get(s["phase"], 0.0) + s["ms"], 2)
+    return {
+        "ready": _STATE["ready"],
+        "warming": _STATE["running"],
+        "uptime_ms": round((time.perf_counter() - _T0) * 1000, 2),
+        "warm_ms": _STATE["warm_ms"],
+        "errors": dict(_STATE["errors"]),
+        "by_phase_ms": by_phase,
+        "steps": list(_STEPS),
+    }
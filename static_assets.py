@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+static_assets.py
+----------------
+Pipeline degli asset statici della UI: build + serving.
+
+Build (python static_assets.py, oppure in warm-up se static/dist manca o i sorgenti sono cambiati):
+- ogni asset (img, css, js, font) copiato in static/dist come nome.<hash>.ext
+- riferimenti assoluti "/static/<percorso>" riscritti verso "/static/dist/<percorso hashato>"
+  in html/css/js (gli HTML restano col loro nome: sono i punti d'ingresso)
+- varianti .gz e .br (brotli se installato) per i tipi testuali, solo se più piccole
+- static/dist/manifest.json: sorgente → hashato, ETag per file e variante, impronta dei sorgenti
+
+Serving (PrecompressedStatic, montato su /static/dist):
+- sceglie .br / .gz in base ad Accept-Encoding (Vary: Accept-Encoding)
+- file hashati: Cache-Control immutable, 1 anno; HTML: no-cache (rivalidazione)
+- ETag forte dal contenuto, If-None-Match → 304
+"""
+
+from __future__ import annotations
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli
+except Exception:
+    brotli = None
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(_BASE_DIR, "static")
+DIST_DIR = os.path.join(SOURCE_DIR, "dist")
+MANIFEST_NAME = "manifest.json"
+URL_PREFIX = "/static/"
+DIST_URL_PREFIX = "/static/dist/"
+
+# dati letti dal backend, non asset della UI
+EXCLUDE_DIRS = {"dist", "data", "static", "i18n", "i18n-cache", "docs"}
+ASSET_EXT = {".css", ".js", ".png", ".jpg", ".jpeg", ".webp", ".gif", ".svg", ".ico", ".woff", ".woff2"}
+ENTRY_EXT = {".html"}
+TEXT_EXT = {".css", ".js", ".html", ".svg", ".json", ".txt"}
+REWRITE_EXT = {".css", ".js", ".html"}
+MIN_GAIN = 0.95  # variante tenuta solo se < 95% dell'originale
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+# ============================================================
+# BUILD
+# ============================================================
+
+def _sources(src_dir: str) -> List[str]:
+    out = []
+    for root, dirs, files in os.walk(src_dir):
+        rel_root = os.path.relpath(root, src_dir)
+        if rel_root == ".":
+            dirs[:] = [d for d in dirs if d not in EXCLUDE_DIRS]
+        for f in files:
+            ext = os.path.splitext(f)[1].lower()
+            if ext in ASSET_EXT or ext in ENTRY_EXT:
+                out.append(os.path.normpath(os.path.join(rel_root, f)).replace(os.sep, "/"))
+    # prima i file senza riferimenti (immagini/font), poi css, js, infine html
+    rank = {".css": 1, ".js": 2, ".html": 3}
+    return sorted(out, key=lambda p: (rank.get(os.path.splitext(p)[1].lower(), 0), p))
+
+
+def _rewrite(text: str, mapping: Dict[str, str]) -> str:
+    if not mapping:
+        return text
+    pat = re.compile("|".join(re.escape(URL_PREFIX + k) for k in sorted(mapping, key=len, reverse=True))
+                     + r"(?=[\"'\s)?#])")
+    return pat.sub(lambda m: DIST_URL_PREFIX + mapping[m.group(0)[len(URL_PREFIX):]], text)
+
+
+def _etag(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:20]
+
+
+def _write_variants(dst: str, data: bytes) -> Dict[str, str]:
+    """Scrive dst (+ .gz/.br se convenienti). → {encoding: etag}"""
+    with open(dst, "wb") as f:
+        f.write(data)
+    tags = {"identity": _etag(data)}
+    if os.path.splitext(dst)[1].lower() not in TEXT_EXT or not data:
+        return tags
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data) * MIN_GAIN:
+        with open(dst + ".gz", "wb") as f:
+            f.write(gz)
+        tags["gzip"] = _etag(gz)
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data) * MIN_GAIN:
+            with open(dst + ".br", "wb") as f:
+                f.write(br)
+            tags["br"] = _etag(br)
+    return tags
+
+
+def sources_digest(src_dir: str = SOURCE_DIR) -> str:
+    """Impronta dei sorgenti (percorso + byte, + brotli sì/no): uguale → dist già aggiornata."""
+    h = hashlib.sha1(f"v1|br={brotli is not None}".encode("utf-8"))
+    for rel in _sources(src_dir):
+        with open(os.path.join(src_dir, rel), "rb") as f:
+            h.update(f"|{rel}|".encode("utf-8") + hashlib.sha1(f.read()).digest())
+    return h.hexdigest()[:16]
+
+
+def build(src_dir: str = SOURCE_DIR, dist_dir: str = DIST_DIR) -> Dict[str, Any]:
+    """Build completo (dist ricreata da zero). → manifest"""
+    tmp = dist_dir + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    mapping: Dict[str, str] = {}
+    files: Dict[str, Dict[str, Any]] = {}
+    size_in = size_out = 0
+    for rel in _sources(src_dir):
+        with open(os.path.join(src_dir, rel), "rb") as f:
+            data = f.read()
+        ext = os.path.splitext(rel)[1].lower()
+        if ext in REWRITE_EXT:
+            data = _rewrite(data.decode("utf-8"), mapping).encode("utf-8")
+        if ext in ENTRY_EXT:
+            out_rel = rel
+        else:
+            stem, _ = os.path.splitext(rel)
+            out_rel = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+            mapping[rel] = out_rel
+        dst = os.path.join(tmp, out_rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tags = _write_variants(dst, data)
+        files[out_rel] = {"src": rel, "immutable": ext not in ENTRY_EXT, "etag": tags}
+        size_in += len(data)
+        best = min([len(data)] + [os.path.getsize(dst + s) for s in (".gz", ".br") if os.path.exists(dst + s)])
+        size_out += best
+
+    manifest = {"version": 1, "assets": mapping, "files": files, "brotli": brotli is not None,
+                "sources_digest": sources_digest(src_dir),
+                "bytes": {"identity": size_in, "best_encoded": size_out}}
+    with open(os.path.join(tmp, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    os.replace(tmp, dist_dir)
+    print(f"[STATIC] build: {len(files)} file, {size_in} → {size_out} byte (brotli={'sì' if brotli else 'no'})")
+    return manifest
+
+
+def load_manifest(dist_dir: str = DIST_DIR) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(dist_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def ensure_built(src_dir: str = SOURCE_DIR, dist_dir: str = DIST_DIR) -> Dict[str, Any]:
+    """Build solo se manca o se i sorgenti sono cambiati (warm-up). Per forzarla: python static_assets.py"""
+    manifest = load_manifest(dist_dir)
+    if manifest and manifest.get("sources_digest") == sources_digest(src_dir):
+        return manifest
+    return build(src_dir=src_dir, dist_dir=dist_dir)
+
+
+# ============================================================
+# SERVING
+# ============================================================
+
+class PrecompressedStatic(StaticFiles):
+    """StaticFiles su static/dist con varianti precompresse, cache immutable e ETag forti."""
+
+    def __init__(self, directory: str = DIST_DIR) -> None:
+        super().__init__(directory=directory, check_dir=False)
+        self.dist_dir = directory
+        self.manifest: Optional[Dict[str, Any]] = None
+        self._loaded = False  # manifest già cercato: l'esito negativo resta in cache fino a reload()
+
+    def reload(self) -> bool:
+        self.manifest = load_manifest(self.dist_dir)
+        self._loaded = True
+        return self.manifest is not None
+
+    @property
+    def built(self) -> bool:
+        if not self._loaded:
+            self.reload()
+        return self.manifest is not None
+
+    def _choose(self, entry: Dict[str, Any], accept: str) -> Tuple[str, str]:
+        tags = entry["etag"]
+        acc = {a.split(";")[0].strip().lower() for a in accept.split(",")}
+        for enc, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if enc in tags and enc in acc:
+                return enc, suffix
+        return "identity", ""
+
+    async def get_response(self, path: str, scope) -> Response:
+        rel = path.replace(os.sep, "/").lstrip("/")
+        entry = (self.manifest or {}).get("files", {}).get(rel) if self.built else None
+        if entry is None:
+            return await super().get_response(path, scope)
+
+        req = Headers(scope=scope)
+        enc, suffix = self._choose(entry, req.get("accept-encoding", ""))
+        etag = f'"{entry["etag"][enc]}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": IMMUTABLE if entry["immutable"] else REVALIDATE,
+            "Vary": "Accept-Encoding",
+        }
+        inm = req.get("if-none-match")
+        if inm and (inm.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in inm.split(",")]):
+            return Response(status_code=304, headers=headers)
+        if enc != "identity":
+            headers["Content-Encoding"] = enc
+        media_type = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+        return FileResponse(os.path.join(self.dist_dir, rel + suffix), media_type=media_type, headers=headers)
+
+    def url(self, src_rel: str) -> str:
+        """URL pubblico di un asset sorgente (es. 'img/logo.jpg')."""
+        hashed = (self.manifest or {}).get("assets", {}).get(src_rel)
+        return DIST_URL_PREFIX + hashed if hashed else URL_PREFIX + src_rel
+
+
+if __name__ == "__main__":
+    m = build()
+    print(json.dumps(m["bytes"]))
+    sys.exit(0)
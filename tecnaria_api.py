@@ -1,10 +1,13 @@
 # tecnaria_api.py — shim UI + test GET/POST /api/ask per l'app FastAPI esistente
 # Render deve avviare: uvicorn tecnaria_api:app --host 0.0.0.0 --port $PORT
 
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi import Query
+from fastapi.responses import HTMLResponse
+from fastapi import Query, Request
 import time
 
+from admission import AdmissionRejected, client_id, get_admission
+from json_fragments import FastJSONResponse, RawJSONResponse, assemble, cached_fragment
+
 # Importa l'istanza FastAPI già definita in app.py
 # (DEVE esistere in app.py: app = FastAPI(...), intent_route(q: str) -> dict)
 from app import app  # usa SEMPRE questa app, NON ridefinire app qui!
@@ -93,10 +96,7 @@ async function ask() {
   if(!q){ qEl.focus(); return; }
   statusEl.textContent = 'invio…';
   try{
-    const r = await fetch('/api/ask', {
-      method:'POST', headers:{'Content-Type':'application/json'},
-      body: JSON.stringify({ q })
-    });
+    const r = await fetch('/api/ask?q=' + encodeURIComponent(q));
     const j = await r.json();
     textEl.textContent = j.text || '';
     htmlEl.innerHTML = j.html || '';
@@ -143,25 +143,31 @@ def __routes():
         ]
     except Exception:
         routes = []
-    return JSONResponse({"routes": routes})
+    return FastJSONResponse({"routes": routes})
 
 # ---- GET /api/ask (test da browser) ----
 @app.get("/api/ask")
-def api_ask_get(q: str = Query("", description="Domanda")):
+def api_ask_get(request: Request, q: str = Query("", description="Domanda")):
+    try:
+        get_admission().admit(client_id(request))
+    except AdmissionRejected as e:
+        return FastJSONResponse({"ok": False, "error": f"Troppe richieste ({e.reason})"},
+                                status_code=429, headers={"Retry-After": e.retry_after})
     if intent_route is None:
-        return JSONResponse({"ok": False, "error": "intent_route non disponibile in app.py"}, status_code=500)
-    t0 = time.time()
+        return FastJSONResponse({"ok": False, "error": "intent_route non disponibile in app.py"}, status_code=500)
+    t0 = time.perf_counter()
     routed = intent_route(q or "")
-    ms = int((time.time() - t0) * 1000) or 1
-    return {
-        "ok": True,
-        "match_id": str(routed.get("match_id") or "<NULL>"),
-        "ms": ms,
-        "text": str(routed.get("text") or ""),
-        "html": str(routed.get("html") or ""),
-        "lang": routed.get("lang"),
-        "family": routed.get("family"),
-        "intent": routed.get("intent"),
-        "source": routed.get("source"),
-        "score": routed.get("score"),
-    }
+    ms = round((time.perf_counter() - t0) * 1000, 3)
+    # text/html sono stringhe fisse dell'intento: bytes JSON pronti, solo concatenati
+    return RawJSONResponse(assemble(
+        ok=routed.get("match_id") is not None,
+        match_id=str(routed.get("match_id") or "<NULL>"),
+        ms=ms,
+        text=cached_fragment(str(routed.get("text") or "")),
+        html=cached_fragment(str(routed.get("html") or "")),
+        lang=routed.get("lang"),
+        family=routed.get("family"),
+        intent=routed.get("intent"),
+        source=routed.get("source"),
+        score=routed.get("score"),
+    ))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+translation_memory.py
+---------------------
+Memoria di traduzione persistente davanti a GoogleTranslator.
+
+- chiave = sha256(sorgente + destinazione + testo), valore = testo tradotto
+- persistenza locale SQLite con eviction LRU (stesso store di llm_cache.ResponseCache)
+- una traduzione già vista non torna più in rete, anche dopo un riavvio
+- errori di rete: si restituisce il testo originale (e non si memorizza nulla)
+- codici lingua di lang_id (fastText/ISO 639-1) convertiti in codici Google
+  (he → iw, zh → zh-CN, jv → jw, ...); sorgente non supportata → 'auto'
+
+Env: TM_PATH (default .cache/translation_memory.sqlite), TM_MAX_ENTRIES (default 50000),
+     TM_MAX_MB (default 100)
+"""
+
+from __future__ import annotations
+import hashlib
+import os
+from typing import Optional
+
+from llm_cache import ResponseCache
+
+GoogleTranslator = None  # deep_translator importato al primo miss (import lento)
+_GOOGLE_CODES: frozenset = frozenset()  # codici accettati da GoogleTranslator (dalle costanti di deep_translator)
+
+# lang_id (fastText) → Google, dove differiscono
+_TO_GOOGLE = {"he": "iw", "zh": "zh-CN", "jv": "jw", "nb": "no", "nn": "no", "fil": "tl", "mni": "mni-Mtei"}
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TM_PATH = os.getenv("TM_PATH", os.path.join(_BASE_DIR, ".cache", "translation_memory.sqlite"))
+TM_MAX_ENTRIES = int(os.getenv("TM_MAX_ENTRIES", "50000"))
+TM_MAX_BYTES = int(float(os.getenv("TM_MAX_MB", "100")) * 1024 * 1024)
+
+_TM: Optional[ResponseCache] = None
+
+
+def get_memory() -> ResponseCache:
+    global _TM
+    if _TM is None:
+        _TM = ResponseCache(path=TM_PATH, mode="read-through",
+                            max_entries=TM_MAX_ENTRIES, max_bytes=TM_MAX_BYTES)
+    return _TM
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def tm_key(text: str, source: str, target: str) -> str:
+    return hashlib.sha256(f"{source}\x1f{target}\x1f{text}".encode("utf-8")).hexdigest()
+
+
+def lookup(text: str, source: str, target: str) -> Optional[str]:
+    hit = get_memory().get(tm_key(text, source, target))
+    return hit.content if hit is not None else None
+
+
+def _load_translator() -> bool:
+    global GoogleTranslator, _GOOGLE_CODES
+    if GoogleTranslator is None:
+        try:
+            from deep_translator import GoogleTranslator as _GT
+            from deep_translator.constants import GOOGLE_LANGUAGES_TO_CODES
+        except Exception:
+            return False
+        _GOOGLE_CODES = frozenset(GOOGLE_LANGUAGES_TO_CODES.values())
+        GoogleTranslator = _GT
+    return True
+
+
+def google_code(code: str) -> Optional[str]:
+    """Codice lang_id → codice Google; None se Google non supporta la lingua."""
+    code = (code or "").strip()
+    code = _TO_GOOGLE.get(code.lower(), code)
+    return code if code in _GOOGLE_CODES else None
+
+
+def translate(text: str, source: str, target: str) -> str:
+    """Traduzione con memoria: prima il DB locale, poi (solo al primo incontro) Google."""
+    if not text or not text.strip() or source == target:
+        return text
+    key = tm_key(text, source, target)
+    tm = get_memory()
+    hit = tm.get(key)
+    if hit is not None:
+        return hit.content
+    if not _load_translator():
+        print("[TM][WARN] deep_translator non disponibile: testo non tradotto")
+        return text
+    g_source, g_target = google_code(source) or "auto", google_code(target)
+    if g_target is None:
+        print(f"[TM][WARN] lingua di destinazione '{target}' non supportata da Google: testo non tradotto")
+        return text
+    try:
+        out = GoogleTranslator(source=g_source, target=g_target).translate(text)
+    except Exception as e:
+        print(f"[TM][WARN] traduzione {source}->{target} fallita: {e}")
+        return text
+    if out:
+        tm.put(key, f"google:{source}>{target}", out)
+    return out or text
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+txt_parser.py
+-------------
+Parsing in streaming dei .txt della KB (TAG, coppie D:/R:, testo libero) e
+normalizzazione/tokenizzazione per BM25.
+
+Modulo foglia (solo stdlib): è l'entry point dei worker del process pool di
+scraper_tecnaria (contesto spawn), che così importano solo il parser e non
+event_log, numpy, rank_bm25 o il resto dell'indice.
+"""
+
+from __future__ import annotations
+import io
+import os
+import re
+import unicodedata
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# ===== Stopwords / Normalizzazione =====
+STOPWORDS_MIN = {
+    "il","lo","la","i","gli","le","un","uno","una","di","del","della","dei","degli","delle",
+    "e","ed","o","con","per","su","tra","fra","in","da","al","allo","ai","agli","alla","alle",
+    "che","come","dove","quando","anche","mi","ti","si","ci","vi","a","da","de","dal","dall",
+    "dalla","dalle","non","piu","meno","solo","qual","quale","quali","quanta","quante","quanto",
+    "questa","questo","questi","queste","quella","quello","quelli","quelle"
+}
+_WHITES = re.compile(r"\s+", flags=re.UNICODE)
+
+def strip_accents(s: str) -> str:
+    return "".join(ch for ch in unicodedata.normalize("NFKD", s) if not unicodedata.combining(ch))
+
+def normalize_text(s: str) -> str:
+    if not s:
+        return ""
+    s = s.lower()
+    s = strip_accents(s)
+    s = re.sub(r"[^a-z0-9àèéìòóùç\s\-_]", " ", s)
+    s = _WHITES.sub(" ", s).strip()
+    toks = [t for t in s.split() if t not in STOPWORDS_MIN]
+    return " ".join(toks)
+
+# ===== Parsing TXT =====
+_TAGS_RE = re.compile(r"^\s*\[TAGS\s*:\s*(.*?)\]\s*$", re.IGNORECASE)
+_D_RE = re.compile(r"^\s*(D|DOMANDA)\s*:\s*(.*)$", re.IGNORECASE)
+_R_RE = re.compile(r"^\s*(R|RISPOSTA)\s*:\s*(.*)$", re.IGNORECASE)
+
+STREAM_CHUNK_CHARS = int(os.getenv("STREAM_CHUNK_CHARS", "65536"))
+
+def iter_txt_records(path: str, chunk_chars: int = STREAM_CHUNK_CHARS) -> Iterator[Tuple[str, Any]]:
+    """
+    Parser in streaming: legge il file riga per riga e emette eventi man mano.
+    - ("tags", [tag, ...])
+    - ("qa", {"q": ..., "a": ...})
+    - ("chunk", testo)  righe generiche consecutive, ~chunk_chars per evento;
+      "\n".join(chunk) ricostruisce il testo generico completo.
+    Il file non viene mai caricato interamente in memoria.
+    """
+    cur_q: Optional[str] = None
+    cur_a: List[str] = []
+    buf: List[str] = []
+    buf_len = 0
+
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for raw in f:
+            # splitlines() come nel parsing storico (\x0c, \u2028, ... separano righe)
+            for line in raw.splitlines():
+                m_tags = _TAGS_RE.match(line)
+                if m_tags:
+                    tline = m_tags.group(1)
+                    yield "tags", [t.strip() for t in tline.split(",") if t.strip()]
+                    continue
+
+                m_d = _D_RE.match(line)
+                if m_d:
+                    if cur_q is not None:
+                        yield "qa", {"q": (cur_q or "").strip(), "a": "\n".join(cur_a).strip()}
+                    cur_q = m_d.group(2).strip()
+                    cur_a = []
+                    continue
+
+                m_r = _R_RE.match(line)
+                if m_r:
+                    cur_a.append(m_r.group(2))
+                    continue
+
+                # linea generica
+                buf.append(line)
+                buf_len += len(line) + 1
+                if cur_q is not None:
+                    cur_a.append(line)
+                if buf_len >= chunk_chars:
+                    yield "chunk", "\n".join(buf)
+                    buf = []
+                    buf_len = 0
+
+    if buf:
+        yield "chunk", "\n".join(buf)
+    if cur_q is not None:
+        yield "qa", {"q": (cur_q or "").strip(), "a": "\n".join(cur_a).strip()}
+
+def parse_txt_file(path: str) -> Dict[str, Any]:
+    tags: List[str] = []
+    qas: List[Dict[str, str]] = []
+    text_buf = io.StringIO()
+    norm_parts: List[str] = []
+    first = True
+
+    for kind, payload in iter_txt_records(path):
+        if kind == "tags":
+            tags.extend(payload)
+        elif kind == "qa":
+            qas.append(payload)
+        else:
+            if not first:
+                text_buf.write("\n")
+            text_buf.write(payload)
+            first = False
+            # normalize_text lavora per token: normalizzare a pezzi dà lo stesso risultato
+            nc = normalize_text(payload)
+            if nc:
+                norm_parts.append(nc)
+
+    full_text = text_buf.getvalue().strip()
+    text_buf.close()
+    return {
+        "file": os.path.basename(path),
+        "path": path,
+        "name": os.path.splitext(os.path.basename(path))[0].lower(),
+        "tags": tags,
+        "norm_tags": [normalize_text(t) for t in tags],
+        "qas": qas,
+        "text": full_text,
+        "norm": " ".join(norm_parts)
+    }
+
+# ===== Token BM25 / unità di lavoro del pool =====
+def item_tokens(it: Dict[str, Any]) -> List[str]:
+    toks = []
+    if it.get("norm"):
+        toks.extend(it["norm"].split())
+    for qa in it.get("qas", []):
+        qn = normalize_text(qa.get("q", ""))
+        toks.extend(qn.split())
+        an = normalize_text(qa.get("a", ""))
+        # (opzionale) includiamo anche risposta per migliorare recall
+        toks.extend(an.split())
+    return [t for t in toks if t]
+
+def parse_for_index(path: str, min_chars: int, with_tokens: bool) -> Tuple[Optional[Dict[str, Any]], Optional[List[str]], Optional[str]]:
+    """
+    Unità di lavoro (anche in processo figlio): parsing + normalizzazione + token BM25.
+    Ritorna (item, tokens, errore); item None se il file va scartato.
+    """
+    try:
+        it = parse_txt_file(path)
+    except Exception as e:
+        return None, None, str(e)
+    # filtra i blocchi troppo corti, ma garantisci almeno 1 item per file
+    keep = (len((it.get("text") or "")) >= min_chars) or it.get("qas")
+    if not keep:
+        return None, None, None
+    toks = item_tokens(it) if with_tokens else None
+    return it, toks, None